@@ -0,0 +1,190 @@
+import copy
+import logging
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The role which applies the items of each change type (see ansible/project/apply-change-set.yml)
+CHANGE_ROLES = {
+    'interfaces': 'cisco-config-interfaces',
+    'routes': 'cisco-config-static_routes',
+}
+# The variables the roles use when an item does not set them (see the vars of the roles)
+ROLE_DEFAULTS = {
+    'interfaces': {'enabled': True},
+    'routes': {'state': 'merged'},
+}
+
+
+def _item_key(item: dict) -> tuple:
+    """
+    Identify the configured object of a change item (every field except its state)
+    :param item: The change item
+    :return: Hashable key of the item
+    """
+    return tuple(sorted((key, value) for key, value in item.items() if key != 'state'))
+
+
+def _apply_interface(resources: dict, item: dict) -> None:
+    """
+    Apply an interface change to the network resources of a host (see the cisco-config-interfaces role)
+    :param resources: The ansible_network_resources of the host
+    :param item: The change item with the role defaults
+    :return: None
+    """
+    interface = next((interface for interface in resources['interfaces'] if interface['name'] == item['name']), None)
+    if interface is None:
+        interface = {'name': item['name']}
+        resources['interfaces'].append(interface)
+    interface['enabled'] = item['enabled']
+    if item.get('description'):
+        interface['description'] = item['description']
+
+
+def _apply_route(resources: dict, item: dict) -> None:
+    """
+    Apply a static route change to the network resources of a host (see the cisco-config-static_routes role).
+    The route is changed in the table of its VRF (the global routing table if the item has no vrf).
+    A merged route adds its next hop to the route,
+    a deleted route removes the next hop and the route itself if it has no other next hop.
+    :param resources: The ansible_network_resources of the host
+    :param item: The change item with the role defaults
+    :return: None
+    """
+    if item['state'] not in ('merged', 'deleted'):
+        raise ValueError(f"Cannot simulate route state {item['state']}")
+    static_routes = resources.setdefault('static_routes', [])
+    vrf = item.get('vrf')
+    table = next((table for table in static_routes if table.get('vrf') == vrf), None)
+    if table is None:
+        table = {'vrf': vrf, 'address_families': []} if vrf else {'address_families': []}
+        static_routes.append(table)
+    address_family = next((address_family for address_family in table['address_families']
+                           if address_family.get('afi', 'ipv4') == 'ipv4'), None)
+    if address_family is None:
+        address_family = {'afi': 'ipv4', 'routes': []}
+        table['address_families'].append(address_family)
+    routes = address_family.setdefault('routes', [])
+    route = next((route for route in routes if route['dest'] == item['dest_address']), None)
+    next_hop = {'forward_router_address': item['next_hop']}
+    if item['state'] == 'deleted':
+        if route is not None:
+            route['next_hops'] = [hop for hop in route.get('next_hops', [])
+                                  if hop.get('forward_router_address') != item['next_hop']]
+            if not route['next_hops']:
+                routes.remove(route)
+    elif route is None:
+        routes.append({'dest': item['dest_address'], 'next_hops': [next_hop]})
+    elif all(hop.get('forward_router_address') != item['next_hop'] for hop in route.setdefault('next_hops', [])):
+        route['next_hops'].append(next_hop)
+
+
+class ChangeSet:
+    def __init__(self):
+        """
+        Configuration changes planned for multiple hosts, applied together in a single Ansible run.
+        The changes are stored per host and per change type (interfaces, routes) in the order they were added.
+        Interface changes are applied before the route changes of the same host.
+        A change which is already planned for the same object in the same state is only added once.
+        """
+        self.changes: Dict[str, Dict[str, List[dict]]] = {}
+
+    def add(self, hostname: str, change_type: str, items: List[dict]) -> None:
+        """
+        Add changes of a host
+        :param hostname: The host to configure
+        :param change_type: The type of the changes (key of CHANGE_ROLES)
+        :param items: The items passed to the role (Eg.: routes with dest_address, next_hop and state)
+        :return: None
+        """
+        if change_type not in CHANGE_ROLES:
+            raise ValueError(f"Unknown change type {change_type}")
+        for item in items:
+            planned = self.changes.setdefault(hostname, {}).setdefault(change_type, [])
+            # Skip the change if the same item is already planned in the same state
+            # (Eg.: the same route is fixed in both directions)
+            previous = next((change for change in reversed(planned) if _item_key(change) == _item_key(item)), None)
+            if previous != item:
+                planned.append(item)
+
+    def add_interfaces(self, hostname: str, interfaces: List[dict]) -> None:
+        """
+        Add interface changes of a host
+        :param hostname: The host to configure
+        :param interfaces: The interfaces to configure (name, description, enabled)
+        :return: None
+        """
+        self.add(hostname, 'interfaces', interfaces)
+
+    def add_routes(self, hostname: str, routes: List[dict], vrf: str = None) -> None:
+        """
+        Add static route changes of a host. Routes are applied in order, so a route can be deleted and re-added.
+        :param hostname: The host to configure
+        :param routes: The routes to configure (dest_address, next_hop, state)
+        :param vrf: The VRF of the routes, None for the global routing table
+        :return: None
+        """
+        self.add(hostname, 'routes', [{**route, 'vrf': vrf} for route in routes] if vrf is not None else routes)
+
+    @property
+    def hosts(self) -> List[str]:
+        """
+        The hosts which have changes
+        """
+        return list(self.changes)
+
+    def update(self, other: 'ChangeSet') -> None:
+        """
+        Add every change of another change set after the changes of this one
+        :param other: The change set to add
+        :return: None
+        """
+        for hostname, changes in other.changes.items():
+            for change_type, items in changes.items():
+                self.add(hostname, change_type, items)
+
+    def items(self) -> Iterator[Tuple[str, str, dict]]:
+        """
+        Iterate over the changes as (hostname, role, role_vars), in the order the playbook applies them
+        """
+        for hostname, changes in self.changes.items():
+            for change_type, role in CHANGE_ROLES.items():
+                if change_type in changes:
+                    yield hostname, role, {change_type: changes[change_type]}
+
+    def apply_to_facts(self, facts: Dict[str, dict]) -> Dict[str, dict]:
+        """
+        Simulate the change set on gathered facts, as the roles would change the configuration of the devices.
+        The given facts are not modified.
+        :param facts: The facts of the hosts (hostname -> facts)
+        :return: The changed facts of the hosts in the change set (hostname -> facts)
+        """
+        changed = {}
+        for hostname, changes in self.changes.items():
+            if hostname not in facts:
+                logger.warning(f"Cannot simulate the changes of {hostname}, its facts are missing")
+                continue
+            host_facts = copy.deepcopy(facts[hostname])
+            resources = host_facts['ansible_network_resources']
+            for item in changes.get('interfaces', []):
+                _apply_interface(resources, {**ROLE_DEFAULTS['interfaces'], **item})
+            for item in changes.get('routes', []):
+                _apply_route(resources, {**ROLE_DEFAULTS['routes'], **item})
+            changed[hostname] = host_facts
+        return changed
+
+    def as_extravars(self) -> dict:
+        """
+        Get the change set as extra variables of the apply-change-set playbook
+        :return: Dictionary with the change_set variable
+        """
+        return {'change_set': self.changes}
+
+    def __bool__(self) -> bool:
+        return bool(self.changes)
+
+    def __len__(self) -> int:
+        return sum(len(items) for changes in self.changes.values() for items in changes.values())
+
+    def __repr__(self) -> str:
+        return f"ChangeSet({self.changes})"
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, List
+
+from ansible_api.facts import gather_ios_facts, gather_ios_fingerprints, load_facts, save_facts
+from utils import trace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = '../ansible/fact_cache.json.gz'
+
+
+class FactCache:
+    def __init__(self, filename: str = DEFAULT_CACHE_FILE,
+                 gather_fingerprints: Callable[[List[str]], Dict[str, str]] = gather_ios_fingerprints,
+                 gather_facts: Callable[[List[str]], dict] = gather_ios_facts):
+        """
+        Persistent cache of the facts of every host, keyed by the configuration fingerprint of the host.
+        A gather first collects the fingerprints (cheap), then the full facts only of the hosts
+        whose fingerprint changed since the facts were cached.
+        The parsed Host objects of the unchanged hosts are reused too (see get_host).
+        :param filename: The cache file (gzip compressed if it ends with .gz). If None, the cache is not saved.
+        :param gather_fingerprints: Function returning the fingerprints of the given hosts (every host if None)
+        :param gather_facts: Function returning the facts of the given hosts
+        """
+        self.filename = os.path.abspath(filename) if filename is not None else None
+        self.gather_fingerprints = gather_fingerprints
+        self.gather_facts = gather_facts
+        # Hostname -> {'fingerprint': ..., 'facts': ..., 'size': size of the facts in JSON}
+        self.entries: Dict[str, dict] = {}
+        # Hostname -> (facts, Host) of the last parsed facts
+        self._hosts: Dict[str, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.hosts_reused = 0
+        self._lock = threading.Lock()
+        if self.filename is not None and os.path.exists(self.filename):
+            try:
+                self.entries = load_facts(self.filename)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Fact cache {self.filename} cannot be loaded, starting with an empty cache: {e}")
+
+    def gather(self, hosts: List[str] = None) -> dict:
+        """
+        Gather the facts of the hosts, only the hosts with a changed fingerprint are gathered from the devices
+        :param hosts: Only gather the facts of these hosts. If None, facts of every router will be gathered
+        :return: The facts (hostname -> facts). The facts of the unchanged hosts are the cached objects.
+            A changed host whose facts could not be gathered is not in the result.
+        """
+        fingerprints = self.gather_fingerprints(hosts)
+        with self._lock:
+            # A host without a fingerprint (Eg.: the command failed) is always gathered
+            stale = sorted(hostname for hostname, fingerprint in fingerprints.items()
+                           if fingerprint is None or self.entries.get(hostname, {}).get('fingerprint') != fingerprint)
+            hits = [hostname for hostname in fingerprints if hostname not in stale]
+        gathered = self.gather_facts(stale) if stale else {}
+        with self._lock:
+            for hostname, host_facts in gathered.items():
+                self.entries[hostname] = {
+                    'fingerprint': fingerprints.get(hostname),
+                    'facts': host_facts,
+                    'size': len(json.dumps(host_facts, separators=(',', ':'))),
+                }
+            saved = sum(self.entries[hostname]['size'] for hostname in hits)
+            self.hits += len(hits)
+            self.misses += len(stale)
+            self.bytes_saved += saved
+            # A changed host which was not gathered is left out, its cached facts are outdated
+            missing = [hostname for hostname in stale if hostname not in gathered]
+            results = {hostname: self.entries[hostname]['facts'] for hostname in fingerprints
+                       if hostname in self.entries and hostname not in missing}
+            if gathered and self.filename is not None:
+                save_facts(self.entries, self.filename)
+        if missing:
+            logger.warning(f"Fact cache: facts of the changed hosts {missing} could not be gathered, they are left out")
+        trace.count('fact_cache_hits', len(hits))
+        trace.count('fact_cache_misses', len(stale))
+        trace.count('fact_cache_bytes_saved', saved)
+        logger.info(f"Fact cache: {len(hits)} unchanged, {len(stale)} gathered ({saved} bytes not transferred)")
+        return results
+
+    def get_host(self, hostname: str, facts: dict) -> 'Host':
+        """
+        Get the parsed Host of the facts. The Host is reused if the same facts were parsed before
+        (the cache returns the same facts object for an unchanged host).
+        :param hostname: The inventory hostname
+        :param facts: The facts of the host
+        :return: The Host object (shared, it must not be changed)
+        """
+        with self._lock:
+            cached = self._hosts.get(hostname)
+            if cached is not None and cached[0] is facts:
+                self.hosts_reused += 1
+                return cached[1]
+        # Imported here, so the CLI can import the cache without the analysis modules (see main.py)
+        from network_analyzer.Host import Host
+        host = Host(facts)
+        with self._lock:
+            self._hosts[hostname] = (facts, host)
+        return host
+
+    def stats(self) -> dict:
+        """
+        Get the statistics of the cache since it was created
+        :return: Dictionary with the hits, misses, hit rate, bytes saved and the number of reused Host objects
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'hosts_reused': self.hosts_reused,
+            }
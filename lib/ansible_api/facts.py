@@ -1,19 +1,139 @@
+import asyncio
+import gzip
+import json
 import os
 import logging
+from typing import Callable, Dict, List, Union
 
-from ansible_api.playbook import run_playbook
+from ansible_api.playbook import StreamResult, run_playbook, run_playbook_async, stream_playbook
+from ansible_api.runner import ANSIBLE_TIMEOUT, HOST_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
+# Inventory group of the routers, the hosts of the gather playbooks
+ROUTERS_GROUP = 'routers'
 
-def gather_ios_facts() -> dict:
+
+def gather_ios_facts(hosts: List[str] = None) -> dict:
     """
     Gather facts from Cisco IOS devices
+    :param hosts: Only gather the facts of these hosts. If None, facts of every router will be gathered
     :return: The gathered facts
     """
     results = run_playbook(
-        playbook_file=os.path.abspath('../ansible/project/gather-ios-facts.yml'), data_dir='../ansible'
+        playbook_file=os.path.abspath('../ansible/project/gather-ios-facts.yml'), data_dir='../ansible', limit=hosts
+    )
+    logger.debug("Facts gathered")
+    logger.debug(results)
+    return results
+
+
+async def gather_ios_facts_async(hosts: List[str] = None, semaphore: asyncio.Semaphore = None,
+                                 timeout: float = ANSIBLE_TIMEOUT) -> dict:
+    """
+    Async variant of gather_ios_facts
+    :param hosts: Only gather the facts of these hosts. If None, facts of every router will be gathered
+    :param semaphore: Concurrency cap shared with other runs (see ansible_api.runner.limit_concurrency)
+    :param timeout: Seconds after the run is cancelled (AnsibleTimeoutException)
+    :return: The gathered facts
+    """
+    results = await run_playbook_async(
+        playbook_file=os.path.abspath('../ansible/project/gather-ios-facts.yml'), data_dir='../ansible', limit=hosts,
+        semaphore=semaphore, timeout=timeout
     )
     logger.debug("Facts gathered")
     logger.debug(results)
     return results
+
+
+def get_inventory_hosts(group: str = ROUTERS_GROUP) -> Union[List[str], None]:
+    """
+    Get the hosts of an inventory group (ansible-inventory --list)
+    :param group: The inventory group
+    :return: The hostnames, None if the inventory cannot be listed
+    """
+    import ansible_runner  # type: ignore
+    from ansible_runner.exceptions import ConfigurationError  # type: ignore
+    try:
+        response, error = ansible_runner.get_inventory(
+            action='list', inventories=[os.path.abspath('../ansible/inventory')], response_format='json', quiet=True
+        )
+    except ConfigurationError as e:
+        response, error = None, e
+    if not isinstance(response, dict):
+        logger.warning(f"The inventory cannot be listed: {error}")
+        return None
+    return list(response.get(group, {}).get('hosts', []))
+
+
+def stream_ios_facts(on_facts: Callable[[str, dict], None], hosts: List[str] = None,
+                     host_timeout: float = HOST_TIMEOUT) -> StreamResult:
+    """
+    Gather facts from Cisco IOS devices and pass on the facts of every host as soon as they arrive
+    (see ansible_api.playbook.stream_playbook)
+    :param on_facts: Called with the hostname and the facts of every host which returns them
+    :param hosts: Only gather the facts of these hosts. If None, facts of every router will be gathered
+    :param host_timeout: Seconds after a host which did not return its facts is marked stale
+    :return: The gathered facts and the stale and failed hosts
+    """
+    if hosts is None:
+        # The hosts waiting for a fork can only be marked stale if every expected host is known
+        hosts = get_inventory_hosts() or None
+    result = stream_playbook(
+        playbook_file=os.path.abspath('../ansible/project/gather-ios-facts.yml'), data_dir='../ansible', limit=hosts,
+        on_facts=on_facts, host_timeout=host_timeout
+    )
+    logger.debug("Facts streamed")
+    return result
+
+
+def gather_ios_fingerprints(hosts: List[str] = None) -> Dict[str, str]:
+    """
+    Gather the configuration fingerprint of Cisco IOS devices (see gather-ios-fingerprint.yml).
+    This is much cheaper than gathering the facts, the fingerprint only changes if the configuration changes.
+    :param hosts: Only gather the fingerprints of these hosts. If None, every router will be checked
+    :return: Dictionary of hostname -> fingerprint
+    """
+    results = run_playbook(
+        playbook_file=os.path.abspath('../ansible/project/gather-ios-fingerprint.yml'), data_dir='../ansible',
+        limit=hosts
+    )
+    logger.debug(f"Fingerprints gathered: {results}")
+    return {hostname: facts.get('ios_config_fingerprint') for hostname, facts in results.items()}
+
+
+def _open_snapshot(filename: str, mode: str):
+    """
+    Open a fact snapshot file. Files ending with .gz are gzip compressed.
+    :param filename: The snapshot file
+    :param mode: Open mode ('rt' or 'wt')
+    :return: The opened file object
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode, encoding='utf-8')
+    return open(filename, mode, encoding='utf-8')
+
+
+def save_facts(facts: dict, filename: str) -> None:
+    """
+    Save gathered facts to a snapshot file, so the analysis can be re-run without touching the network.
+    The snapshot is compact JSON (gzip compressed if the filename ends with .gz).
+    :param facts: The gathered facts (hostname -> facts)
+    :param filename: The snapshot file to write
+    :return: None
+    """
+    with _open_snapshot(filename, 'wt') as snapshot:
+        json.dump(facts, snapshot, separators=(',', ':'))
+    logger.info(f"Facts of {len(facts)} hosts saved to {filename}")
+
+
+def load_facts(filename: str) -> dict:
+    """
+    Load facts from a snapshot file created by save_facts
+    :param filename: The snapshot file to read
+    :return: The facts (hostname -> facts) in the same format as gather_ios_facts returns them
+    """
+    with _open_snapshot(filename, 'rt') as snapshot:
+        facts = json.load(snapshot)
+    logger.info(f"Facts of {len(facts)} hosts loaded from {filename}")
+    return facts
@@ -1,22 +1,40 @@
+import asyncio
 import logging
+import queue
+import threading
+import time
 from pathlib import Path
-import ansible_runner  # type: ignore
+from typing import Callable, Dict, List, NamedTuple, Set, Union
 
+from ansible_api.runner import run_ansible_async, ANSIBLE_TIMEOUT, HOST_TIMEOUT, POLL_INTERVAL
 from network_analyzer.exception.exception import PlaybookRunException
+from utils import trace
 
 logger = logging.getLogger(__name__)
 
 
-def run_playbook(playbook_file: str, data_dir: str) -> dict:
+def _playbook_arguments(playbook_file: str, data_dir: str, limit: Union[str, List[str]]) -> dict:
     """
-    Run the given playbook via Ansible
+    Get the ansible_runner parameters which run a playbook
     :param playbook_file: The playbook file path to run
     :param data_dir: The private_data_dir for ansible_runner.
-        This is the directory where the playbook/inventory file is located
+    :param limit: Only run the playbook on these hosts (host pattern or list of hostnames)
+    :return: Keyword arguments of ansible_runner.run
+    """
+    if isinstance(limit, list):
+        limit = ','.join(limit)
+    logger.info("Running playbook '{}' in data_dir '{}'{}".format(
+        Path(playbook_file).name, Path(data_dir).name, f" limited to {limit}" if limit else ""
+    ))
+    return {'private_data_dir': data_dir, 'playbook': playbook_file, 'limit': limit}
+
+
+def _collect_facts(r) -> dict:
+    """
+    Check the result of a finished playbook run and collect the facts of the successful hosts
+    :param r: The finished ansible_runner Runner object
     :return: The facts gathered by the playbook
     """
-    logger.info("Running playbook '{}' in data_dir '{}'".format(Path(playbook_file).name, Path(data_dir).name))
-    r = ansible_runner.run(private_data_dir=data_dir, playbook=playbook_file)
     logger.info("{} ({})".format(r.status, r.rc))
     if r.status != "successful":
         raise PlaybookRunException(f"Playbook run failed {r.status}")
@@ -26,3 +44,205 @@ def run_playbook(playbook_file: str, data_dir: str) -> dict:
         facts = r.get_fact_cache(ok_host)
         host_facts[ok_host] = facts
     return host_facts
+
+
+@trace.traced('ansible.run_playbook')
+def run_playbook(playbook_file: str, data_dir: str, limit: Union[str, List[str]] = None) -> dict:
+    """
+    Run the given playbook via Ansible
+    :param playbook_file: The playbook file path to run
+    :param data_dir: The private_data_dir for ansible_runner.
+        This is the directory where the playbook/inventory file is located
+    :param limit: Only run the playbook on these hosts (host pattern or list of hostnames).
+        If None, the playbook runs on every host of its play
+    :return: The facts gathered by the playbook
+    """
+    # Importing ansible_runner is slow, it is only imported when a playbook is actually run
+    import ansible_runner  # type: ignore
+    trace.count('ansible_runs')
+    r = ansible_runner.run(**_playbook_arguments(playbook_file, data_dir, limit))
+    return _collect_facts(r)
+
+
+async def run_playbook_async(playbook_file: str, data_dir: str, limit: Union[str, List[str]] = None,
+                             semaphore: asyncio.Semaphore = None, timeout: float = ANSIBLE_TIMEOUT) -> dict:
+    """
+    Async variant of run_playbook. Multiple playbooks can be awaited concurrently.
+    :param playbook_file: The playbook file path to run
+    :param data_dir: The private_data_dir for ansible_runner.
+    :param limit: Only run the playbook on these hosts (host pattern or list of hostnames)
+    :param semaphore: Concurrency cap shared with other runs (see ansible_api.runner.limit_concurrency)
+    :param timeout: Seconds after the run is cancelled (AnsibleTimeoutException)
+    :return: The facts gathered by the playbook
+    """
+    r = await run_ansible_async(
+        semaphore=semaphore, timeout=timeout, **_playbook_arguments(playbook_file, data_dir, limit)
+    )
+    return _collect_facts(r)
+
+
+class StreamResult(NamedTuple):
+    # The facts of the hosts which returned them (hostname -> facts)
+    facts: dict
+    # Hosts which did not finish in time (their facts are missing)
+    stale: List[str]
+    # Hosts which failed or were unreachable
+    failed: List[str]
+
+
+class FactStream:
+    def __init__(self, host_timeout: float = HOST_TIMEOUT, hosts: List[str] = None):
+        """
+        Event handler of a playbook run which collects the facts of every host as soon as its task returns them.
+        The events are received in the thread of ansible-runner, the facts are passed on through a queue.
+        A host which runs a task longer than the host timeout is marked stale, its late result is ignored.
+        :param host_timeout: Seconds a host can run a task before it is marked stale
+        :param hosts: The hosts which are expected to return facts.
+            If None, the hosts waiting for a fork are unknown, so the run is never stopped early.
+        """
+        self.host_timeout = host_timeout
+        self.expected: Union[Set[str], None] = set(hosts) if hosts is not None else None
+        # Hostname -> time.monotonic() when its running task started
+        self.started: Dict[str, float] = {}
+        self.finished: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.stale: Set[str] = set()
+        self.arrived: queue.Queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def handle_event(self, event: dict) -> bool:
+        """
+        Process an ansible-runner event (event_handler of ansible_runner.run)
+        :param event: The event
+        :return: True, so the event is kept in the artifacts
+        """
+        data = event.get('event_data', {})
+        hostname = data.get('host')
+        if hostname is None:
+            return True
+        with self._lock:
+            if event.get('event') == 'runner_on_start':
+                self.started[hostname] = time.monotonic()
+            elif event.get('event') == 'runner_on_ok':
+                self.started.pop(hostname, None)
+                facts = data.get('res', {}).get('ansible_facts')
+                if facts and hostname not in self.stale:
+                    self.finished.add(hostname)
+                    self.arrived.put((hostname, facts))
+            elif event.get('event') in ('runner_on_failed', 'runner_on_unreachable'):
+                self.started.pop(hostname, None)
+                self.failed.add(hostname)
+        return True
+
+    def expire(self) -> List[str]:
+        """
+        Mark the hosts stale which run their task longer than the host timeout
+        :return: The hosts marked stale now
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [hostname for hostname, started in self.started.items()
+                       if now - started > self.host_timeout and hostname not in self.stale]
+            self.stale.update(expired)
+        return expired
+
+    def mark_running_stale(self) -> None:
+        """
+        Mark every running host stale (Eg.: when the whole run times out)
+        :return: None
+        """
+        with self._lock:
+            self.stale.update(self.started)
+
+    def only_stale_running(self) -> bool:
+        """
+        Check if every host which is still running (or expected, but not started) is stale
+        """
+        if self.expected is None:
+            return False
+        with self._lock:
+            done = self.finished | self.failed | self.stale
+            return bool(self.stale) and set(self.started) <= self.stale and self.expected <= done
+
+    def get(self, timeout: float):
+        """
+        Wait for the facts of the next host
+        :param timeout: Seconds to wait
+        :return: Tuple of hostname and facts, None if no facts arrived in time
+        """
+        try:
+            return self.arrived.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+@trace.traced('ansible.stream_playbook')
+def stream_playbook(playbook_file: str, data_dir: str, limit: Union[str, List[str]] = None,
+                    on_facts: Callable[[str, dict], None] = None, host_timeout: float = HOST_TIMEOUT,
+                    timeout: float = ANSIBLE_TIMEOUT) -> StreamResult:
+    """
+    Run the given playbook and pass on the facts of every host as soon as they arrive.
+    Unlike run_playbook, a slow, failed or unreachable host does not hold back the other hosts:
+    a host which runs longer than the host timeout is marked stale, and the run is cancelled
+    when only stale hosts are left.
+    :param playbook_file: The playbook file path to run
+    :param data_dir: The private_data_dir for ansible_runner.
+    :param limit: Only run the playbook on these hosts (host pattern or list of hostnames).
+        The hosts of a list which did not return facts are reported stale.
+        With a host pattern, the run is not stopped early (the hosts waiting for a fork are unknown).
+    :param on_facts: Called in the calling thread with the hostname and the facts of every host which returns them
+    :param host_timeout: Seconds a host can run a task before it is marked stale
+    :param timeout: Seconds after the run is cancelled, the running hosts are marked stale
+    :return: The collected facts and the stale and failed hosts
+    """
+    import ansible_runner  # type: ignore
+    trace.count('ansible_runs')
+    hosts = limit if isinstance(limit, list) else None
+    stream = FactStream(host_timeout, hosts)
+    arguments = _playbook_arguments(playbook_file, data_dir, limit)
+    if hosts:
+        # Every host gets a fork, so a stale host can not keep a waiting host from starting
+        arguments['forks'] = len(hosts)
+    thread, runner = ansible_runner.run_async(
+        event_handler=stream.handle_event, cancel_callback=stream.cancelled.is_set, **arguments
+    )
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    facts = {}
+
+    def deliver(hostname: str, host_facts: dict) -> None:
+        facts[hostname] = host_facts
+        trace.count('hosts_streamed')
+        if on_facts is not None:
+            on_facts(hostname, host_facts)
+
+    try:
+        while True:
+            arrived = stream.get(POLL_INTERVAL)
+            if arrived is not None:
+                deliver(*arrived)
+                continue
+            if not thread.is_alive():
+                break
+            for hostname in stream.expire():
+                logger.warning(f"{hostname} did not return its facts in {host_timeout} seconds, it is marked stale")
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"Playbook run timed out after {timeout} seconds, the running hosts are marked stale")
+                stream.mark_running_stale()
+                break
+            if stream.only_stale_running():
+                break
+    finally:
+        # Stop waiting for the stale hosts (or stop the run if on_facts raised an exception)
+        if thread.is_alive():
+            stream.cancelled.set()
+            thread.join()
+    # Facts which arrived while the run was stopped
+    arrived = stream.get(0)
+    while arrived is not None:
+        deliver(*arrived)
+        arrived = stream.get(0)
+    stale = sorted(stream.stale | ((stream.expected or set()) - set(facts) - stream.failed))
+    logger.info(f"{runner.status} ({runner.rc}), facts of {len(facts)} hosts, "
+                f"stale: {stale or 'none'}, failed: {sorted(stream.failed) or 'none'}")
+    return StreamResult(facts, stale, sorted(stream.failed))
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Iterable, List
+
+
+from network_analyzer.exception.exception import AnsibleTimeoutException
+from utils import trace
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of Ansible runs executed at the same time by the async API
+ANSIBLE_CONCURRENCY = 4
+# Seconds after a single Ansible run is cancelled
+ANSIBLE_TIMEOUT = 300
+# Seconds between two checks of a running Ansible run
+POLL_INTERVAL = 0.1
+# Seconds a host can run a task of a streamed run before it is marked stale (see ansible_api.playbook.FactStream)
+HOST_TIMEOUT = 60
+
+
+def limit_concurrency(limit: int = ANSIBLE_CONCURRENCY) -> asyncio.Semaphore:
+    """
+    Create a concurrency cap which can be shared by the async Ansible functions
+    :param limit: Maximum number of Ansible runs at the same time
+    :return: The semaphore to pass to the async functions
+    """
+    return asyncio.Semaphore(limit)
+
+
+async def run_ansible_async(semaphore: asyncio.Semaphore = None, timeout: float = ANSIBLE_TIMEOUT, **kwargs):
+    """
+    Run Ansible in the background (ansible_runner.run_async) and wait for it without blocking the event loop
+    :param semaphore: Concurrency cap shared with other runs (see limit_concurrency). If None, the run is not limited
+    :param timeout: Seconds after the run is cancelled. If None, the run is never cancelled
+    :param kwargs: Parameters of ansible_runner.run (private_data_dir, playbook, role, limit...)
+    :return: The finished ansible_runner Runner object (status, rc, stats, get_fact_cache)
+    """
+    if semaphore is None:
+        return await _run_ansible_async(timeout, **kwargs)
+    async with semaphore:
+        return await _run_ansible_async(timeout, **kwargs)
+
+
+@trace.traced('ansible.run_async')
+async def _run_ansible_async(timeout: float, **kwargs):
+    trace.count('ansible_runs')
+    cancelled = threading.Event()
+    import ansible_runner  # type: ignore
+    thread, runner = ansible_runner.run_async(cancel_callback=cancelled.is_set, **kwargs)
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    try:
+        while thread.is_alive():
+            if deadline is not None and loop.time() >= deadline:
+                cancelled.set()
+                # Wait until ansible-runner terminates the process
+                await loop.run_in_executor(None, thread.join)
+                raise AnsibleTimeoutException(f"Ansible run timed out after {timeout} seconds")
+            await asyncio.sleep(POLL_INTERVAL)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+    return runner
+
+
+async def gather_concurrently(awaitables: Iterable[Awaitable]) -> List:
+    """
+    Await multiple Ansible runs concurrently (Eg.: run_task_async on independent hosts)
+    The first failure is raised after every run has finished.
+    :param awaitables: The runs to await
+    :return: The results in the order of the awaitables
+    """
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
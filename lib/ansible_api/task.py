@@ -1,12 +1,31 @@
+import asyncio
 import logging
+import os
 from pathlib import Path
-import ansible_runner  # type: ignore
 
+from ansible_api.change_set import ChangeSet
+from ansible_api.runner import run_ansible_async, ANSIBLE_TIMEOUT
+from utils import trace
 from utils.permission import change_ansible_runner_permissions
 
 logger = logging.getLogger(__name__)
 
+CHANGE_SET_PLAYBOOK = 'apply-change-set.yml'
 
+
+def _task_finished(r) -> None:
+    """
+    Log the result of a finished task run
+    :param r: The finished ansible_runner Runner object
+    :return: None
+    """
+    # Need to change every time, because ansible-runner removes all permissions...
+    change_ansible_runner_permissions()
+    logger.info("{} ({})".format(r.status, r.rc))
+    logger.debug(r.stats)
+
+
+@trace.traced('ansible.run_task')
 def run_task(role: str, hosts: str, role_vars: dict, data_dir: str) -> None:
     """
     Run the given task(s) via Ansible
@@ -17,8 +36,79 @@ def run_task(role: str, hosts: str, role_vars: dict, data_dir: str) -> None:
     :return: None
     """
     logger.info("Running task/role {} in data dir {}".format(Path(role).name, Path(data_dir).name))
+    import ansible_runner  # type: ignore
+    trace.count('ansible_runs')
     r = ansible_runner.run(private_data_dir=data_dir, role=role, hosts=hosts, role_vars=role_vars)
-    # Need to change every time, because ansible-runner removes all permissions...
-    change_ansible_runner_permissions()
-    logger.info("{} ({})".format(r.status, r.rc))
-    logger.debug(r.stats)
+    _task_finished(r)
+
+
+async def run_task_async(role: str, hosts: str, role_vars: dict, data_dir: str,
+                         semaphore: asyncio.Semaphore = None, timeout: float = ANSIBLE_TIMEOUT) -> None:
+    """
+    Async variant of run_task. Multiple tasks on independent hosts can be awaited concurrently.
+    :param role: The role file to execute
+    :param hosts: On which hosts to execute the role
+    :param role_vars: Variables which will be passed to the role
+    :param data_dir: The private_data_dir for ansible_runner.
+    :param semaphore: Concurrency cap shared with other runs (see ansible_api.runner.limit_concurrency)
+    :param timeout: Seconds after the run is cancelled (AnsibleTimeoutException)
+    :return: None
+    """
+    logger.info("Running task/role {} in data dir {}".format(Path(role).name, Path(data_dir).name))
+    r = await run_ansible_async(
+        semaphore=semaphore, timeout=timeout, private_data_dir=data_dir, role=role, hosts=hosts, role_vars=role_vars
+    )
+    _task_finished(r)
+
+
+def _change_set_arguments(change_set: ChangeSet, data_dir: str) -> dict:
+    """
+    Get the ansible_runner parameters which apply a change set
+    :param change_set: The changes to apply
+    :param data_dir: The private_data_dir for ansible_runner.
+    :return: Keyword arguments of ansible_runner.run
+    """
+    logger.info("Applying {} change(s) on hosts {} in data dir {}".format(
+        len(change_set), ','.join(change_set.hosts), Path(data_dir).name
+    ))
+    return {
+        'private_data_dir': data_dir,
+        'playbook': os.path.join(os.path.abspath(data_dir), 'project', CHANGE_SET_PLAYBOOK),
+        'extravars': change_set.as_extravars(),
+        'limit': ','.join(change_set.hosts)
+    }
+
+
+@trace.traced('ansible.run_change_set')
+def run_change_set(change_set: ChangeSet, data_dir: str) -> None:
+    """
+    Apply the changes of multiple hosts in a single Ansible run (apply-change-set.yml playbook).
+    Every host gets its own changes through the change_set extra variable.
+    :param change_set: The changes to apply
+    :param data_dir: The private_data_dir for ansible_runner.
+    :return: None
+    """
+    if not change_set:
+        logger.debug("Empty change set, nothing to apply")
+        return
+    import ansible_runner  # type: ignore
+    trace.count('ansible_runs')
+    r = ansible_runner.run(**_change_set_arguments(change_set, data_dir))
+    _task_finished(r)
+
+
+async def run_change_set_async(change_set: ChangeSet, data_dir: str,
+                               semaphore: asyncio.Semaphore = None, timeout: float = ANSIBLE_TIMEOUT) -> None:
+    """
+    Async variant of run_change_set
+    :param change_set: The changes to apply
+    :param data_dir: The private_data_dir for ansible_runner.
+    :param semaphore: Concurrency cap shared with other runs (see ansible_api.runner.limit_concurrency)
+    :param timeout: Seconds after the run is cancelled (AnsibleTimeoutException)
+    :return: None
+    """
+    if not change_set:
+        logger.debug("Empty change set, nothing to apply")
+        return
+    r = await run_ansible_async(semaphore=semaphore, timeout=timeout, **_change_set_arguments(change_set, data_dir))
+    _task_finished(r)
@@ -0,0 +1,74 @@
+"""
+Benchmark of many NetworkAnalyzer instances in one process, sequentially, in threads and in processes.
+Every analyzer must give the same result and the memory must grow linearly with the number of analyzers.
+Usage (from the lib directory): python -m benchmark.parallel_analyzers --devices 50 --analyzers 16 --workers 4
+"""
+import argparse
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from benchmark.topology import Topology, generate_topology
+from network_analyzer.NetworkAnalyzer import NetworkAnalyzer
+
+
+def create_analyzer(topology: Topology) -> NetworkAnalyzer:
+    return NetworkAnalyzer(topology.facts, source=topology.source, destination=topology.destination,
+                           test_case_name="Parallel analyzers benchmark")
+
+
+def analyze(topology: Topology) -> tuple:
+    """
+    Create an analyzer and check the source/destination pair
+    :param topology: The generated network
+    :return: Tuple of the number of hosts, the number of graph edges and the loop state
+    """
+    analyzer = create_analyzer(topology)
+    state = analyzer.detect_loop_in_route()
+    return (len(analyzer.hosts), analyzer.graph_from_source.number_of_edges(),
+            analyzer.graph_from_destination.number_of_edges(), repr(state))
+
+
+def benchmark(device_count: int, analyzer_count: int, workers: int) -> None:
+    topology = generate_topology('ring', device_count)
+    expected = analyze(topology)
+
+    # Memory of the analyzers kept alive at the same time
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    analyzers = [create_analyzer(topology) for _ in range(analyzer_count)]
+    per_analyzer = (tracemalloc.get_traced_memory()[0] - baseline) / analyzer_count
+    tracemalloc.stop()
+    assert all(len(analyzer.hosts) == device_count for analyzer in analyzers), "Analyzers share their hosts"
+    del analyzers
+
+    cases = (
+        ('sequential', None),
+        (f"{workers} threads", ThreadPoolExecutor),
+        (f"{workers} processes", ProcessPoolExecutor),
+    )
+    for name, executor_class in cases:
+        start = time.perf_counter()
+        if executor_class is None:
+            results = [analyze(topology) for _ in range(analyzer_count)]
+        else:
+            with executor_class(max_workers=workers) as executor:
+                results = list(executor.map(analyze, [topology] * analyzer_count))
+        elapsed = time.perf_counter() - start
+        assert all(result == expected for result in results), f"Different results with {name}"
+        print(f"{device_count:>6} devices  {analyzer_count:>4} analyzers  {name:<12} {elapsed * 1000:>9.1f} ms")
+    print(f"{device_count:>6} devices  {per_analyzer / 1024:>9.1f} KiB per analyzer")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Parallel NetworkAnalyzer benchmark")
+    parser.add_argument('--devices', type=int, nargs='+', default=[50], help="Inventory sizes")
+    parser.add_argument('--analyzers', type=int, default=16, help="Number of analyzers")
+    parser.add_argument('--workers', type=int, default=4, help="Number of threads/processes")
+    args = parser.parse_args()
+    for device_count in args.devices:
+        benchmark(device_count, args.analyzers, args.workers)
+
+
+if __name__ == "__main__":
+    main()
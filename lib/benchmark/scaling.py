@@ -0,0 +1,196 @@
+"""
+Scaling benchmark of the analysis steps on generated topologies (see benchmark.topology).
+Every result is appended to a JSON lines file with the commit and the time of the run, so the results of
+different versions can be compared. No playbook is run: the fixes are only planned (NetworkAnalyzer.plan_fix).
+Usage (from the lib directory):
+    python -m benchmark.scaling --topologies ring fat-tree --routers 10 100 1000 5000 --faults none loop rupture
+    python -m benchmark.scaling --compare (compare the last run with the previous run of the same cases)
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import networkx as nx  # type: ignore
+
+from benchmark.topology import FAULTS, TOPOLOGIES, Topology, generate_topology
+from network_analyzer.Host import Host
+from network_analyzer.NetworkAnalyzer import NetworkAnalyzer
+from utils.graph import check_missing_interface_route, find_missing_interface_routes
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join(LIB_DIR, 'benchmark', 'results', 'scaling.jsonl')
+# A full mesh of N routers has N * (N - 1) / 2 links, larger meshes are skipped
+MESH_LIMIT = 200
+# Plotting is skipped above this many routers (the labels are unreadable and drawing dominates the run)
+PLOT_LIMIT = 1000
+STEPS = ('host_load', 'analyzer', 'init_graph', 'detect_loop', 'plan_fix', 'route_sweep', 'route_sweep_scalar', 'plot')
+
+
+def git_commit() -> str:
+    """
+    Get the current commit of the repository
+    :return: The commit hash, None if it is not available
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=LIB_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(function: Callable, repeat: int) -> dict:
+    """
+    Run a function multiple times and measure the wall time
+    :return: Dictionary with the median time in milliseconds, or the error of the first failed run
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            function()
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}"[:200]}
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'ms': round(statistics.median(timings), 3)}
+
+
+def benchmark_topology(topology: Topology, repeat: int, plot: bool, directory: str) -> Dict[str, dict]:
+    """
+    Measure every analysis step on a topology
+    :param topology: The generated topology
+    :param repeat: Number of runs per step
+    :param plot: Measure plot_graph too
+    :param directory: Directory for the plots
+    :return: Dictionary of step -> result (see measure)
+    """
+    facts = topology.facts
+
+    def create_analyzer() -> NetworkAnalyzer:
+        return NetworkAnalyzer(facts, source=topology.source, destination=topology.destination,
+                               test_case_name=f"Scaling benchmark ({topology.name})")
+
+    results = {
+        'host_load': measure(lambda: [Host(host_facts) for host_facts in facts.values()], repeat),
+        'analyzer': measure(create_analyzer, repeat),
+    }
+    try:
+        analyzer = create_analyzer()
+    except Exception as e:
+        results.update({step: {'error': f"{type(e).__name__}: {e}"[:200]} for step in STEPS[2:]})
+        return results
+
+    def init_graph() -> None:
+        analyzer.graph_from_source = nx.DiGraph()
+        analyzer.graph_from_destination = nx.DiGraph()
+        analyzer.init_graph()
+
+    results['init_graph'] = measure(init_graph, repeat)
+    results['detect_loop'] = measure(analyzer.detect_loop_in_route, repeat)
+    results['plan_fix'] = measure(analyzer.plan_fix, repeat)
+
+    # Which interfaces are covered by the routes on every host: one batch sweep and the per-host scalar checks
+    def route_sweep() -> dict:
+        return find_missing_interface_routes(analyzer.hosts, analyzer.source.network, analyzer.destination.network,
+                                             analyzer.vrf)
+
+    def route_sweep_scalar() -> dict:
+        return {host.hostname: check_missing_interface_route(host, analyzer.source.network,
+                                                             analyzer.destination.network, analyzer.vrf)
+                for host in analyzer.hosts}
+
+    assert route_sweep() == route_sweep_scalar(), "The batch and scalar route sweeps differ"
+    results['route_sweep'] = measure(route_sweep, repeat)
+    results['route_sweep_scalar'] = measure(route_sweep_scalar, repeat)
+    if plot:
+        results['plot'] = measure(lambda: analyzer.plot_graph(os.path.join(directory, 'plot.png')), repeat)
+    return results
+
+
+def run(topologies: List[str], router_counts: List[int], faults: List[str], static_count: int, repeat: int,
+        output: str) -> None:
+    commit = git_commit()
+    started = datetime.now().isoformat(timespec='seconds')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with tempfile.TemporaryDirectory() as directory, open(output, 'a', encoding='utf-8') as file:
+        for name in topologies:
+            for router_count in router_counts:
+                if name == 'mesh' and router_count > MESH_LIMIT:
+                    print(f"{name:<14} {router_count:>6} routers  skipped (more than {MESH_LIMIT} routers)")
+                    continue
+                for fault in faults:
+                    start = time.perf_counter()
+                    topology = generate_topology(name, router_count, static_count,
+                                                 faults=[] if fault == 'none' else [fault])
+                    generate_ms = round((time.perf_counter() - start) * 1000, 3)
+                    results = benchmark_topology(topology, repeat, router_count <= PLOT_LIMIT, directory)
+                    record = {
+                        'started': started, 'commit': commit, 'python': platform.python_version(),
+                        'topology': name, 'routers': router_count, 'statics': static_count, 'fault': fault,
+                        'repeat': repeat, 'generate_ms': generate_ms, 'results': results,
+                    }
+                    file.write(json.dumps(record) + '\n')
+                    file.flush()
+                    print(f"{name:<14} {router_count:>6} routers  {fault:<9} " + '  '.join(
+                        f"{step} {result['ms']:.1f} ms" if 'ms' in result else f"{step} {result['error']}"
+                        for step, result in results.items()
+                    ))
+
+
+def compare(output: str) -> None:
+    """
+    Compare the results of the last run with the previous results of the same cases
+    :param output: The results file
+    :return: None
+    """
+    with open(output, encoding='utf-8') as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    if not records:
+        print("No results")
+        return
+    last_run = records[-1]['started']
+    previous = {}
+    for record in records:
+        key = (record['topology'], record['routers'], record['statics'], record['fault'])
+        if record['started'] != last_run:
+            previous[key] = record
+            continue
+        before = previous.get(key)
+        if before is None:
+            continue
+        changes = []
+        for step, result in record['results'].items():
+            old = before['results'].get(step, {})
+            if 'ms' in result and old.get('ms'):
+                changes.append(f"{step} {old['ms']:.1f} -> {result['ms']:.1f} ms ({result['ms'] / old['ms']:.2f}x)")
+        print(f"{key[0]:<14} {key[1]:>6} routers  {key[3]:<9} {before['commit']} -> {record['commit']}  "
+              + '  '.join(changes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Scaling benchmark on generated topologies")
+    parser.add_argument('--topologies', nargs='+', choices=TOPOLOGIES, default=list(TOPOLOGIES),
+                        help="Topologies to generate")
+    parser.add_argument('--routers', type=int, nargs='+', default=[10, 100, 1000, 5000], help="Numbers of routers")
+    parser.add_argument('--faults', nargs='+', choices=('none',) + FAULTS, default=['none', 'loop', 'rupture'],
+                        help="Injected problems (none is the healthy network)")
+    parser.add_argument('--statics', type=int, default=8, help="Number of extra static routes per router")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs per measurement")
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT, help="Append the results to this JSON lines file")
+    parser.add_argument('--compare', action='store_true',
+                        help="Compare the last run in the results file with the previous runs instead of running")
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.output)
+    else:
+        run(args.topologies, args.routers, args.faults, args.statics, args.repeat, args.output)
+
+
+if __name__ == "__main__":
+    main()
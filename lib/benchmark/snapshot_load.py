@@ -0,0 +1,77 @@
+"""
+Benchmark of the fact snapshot format (save_facts/load_facts) for large inventories.
+Usage (from the lib directory): python -m benchmark.snapshot_load --devices 100 1000 5000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from ansible_api.facts import load_facts, save_facts
+
+
+def synthetic_facts(device_count: int, interface_count: int = 16) -> dict:
+    """
+    Create facts for routers connected in a ring, in the format gathered by gather-ios-facts.yml
+    :param device_count: Number of routers
+    :param interface_count: Number of interfaces per router
+    :return: The facts (hostname -> facts)
+    """
+    facts = {}
+    for index in range(device_count):
+        hostname = f"R{index + 1}"
+        interfaces = [{'name': f"GigabitEthernet0/{port}", 'enabled': port < 2, 'duplex': 'auto', 'speed': 'auto'}
+                      for port in range(interface_count)]
+        l3_interfaces = [{'name': f"GigabitEthernet0/{port}"} for port in range(interface_count)]
+        # Gi0/0 connects to the next router, Gi0/1 to the previous one (/30 links from 172.16.0.0/12)
+        l3_interfaces[0]['ipv4'] = [
+            {'address': f"172.{16 + index // 16384}.{index // 64 % 256}.{index % 64 * 4 + 1}/30"}
+        ]
+        previous = (index - 1) % device_count
+        l3_interfaces[1]['ipv4'] = [
+            {'address': f"172.{16 + previous // 16384}.{previous // 64 % 256}.{previous % 64 * 4 + 2}/30"}
+        ]
+        facts[hostname] = {
+            'ansible_net_hostname': hostname,
+            'ansible_net_system': 'ios',
+            'ansible_network_resources': {
+                'hostname': {'hostname': hostname},
+                'interfaces': interfaces,
+                'l2_interfaces': [{'name': interface['name']} for interface in interfaces],
+                'l3_interfaces': l3_interfaces,
+                'static_routes': [{'address_families': [{'afi': 'ipv4', 'routes': [
+                    {'dest': f"10.{route}.0.0/16", 'next_hops': [{'forward_router_address': '172.16.0.2'}]}
+                    for route in range(8)
+                ]}]}],
+            }
+        }
+    return facts
+
+
+def benchmark(device_count: int, repeat: int) -> None:
+    facts = synthetic_facts(device_count)
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in ('json', 'json.gz'):
+            filename = os.path.join(directory, f"facts.{extension}")
+            save_facts(facts, filename)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                load_facts(filename)
+                timings.append(time.perf_counter() - start)
+            print(f"{device_count:>6} devices  {extension:<8} {os.path.getsize(filename) / 1024:>10.1f} KiB  "
+                  f"load {statistics.median(timings) * 1000:>9.1f} ms (median of {repeat})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fact snapshot load benchmark")
+    parser.add_argument('--devices', type=int, nargs='+', default=[100, 1000, 5000], help="Inventory sizes")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of loads per measurement")
+    args = parser.parse_args()
+    for device_count in args.devices:
+        benchmark(device_count, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
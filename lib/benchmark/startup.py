@@ -0,0 +1,61 @@
+"""
+Benchmark of the CLI startup: time from the process start to the first analysis result (offline, from a snapshot).
+Usage (from the lib directory): python -m benchmark.startup --devices 10 100 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ansible_api.facts import save_facts
+from benchmark.topology import generate_topology
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(arguments: list, directory: str, repeat: int) -> float:
+    """
+    Run main.py with the arguments and measure the wall time
+    :return: The median run time in seconds
+    """
+    environment = dict(os.environ, PYTHONPATH=LIB_DIR)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(LIB_DIR, 'main.py'), *arguments], cwd=directory, env=environment,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def benchmark(device_count: int, repeat: int) -> None:
+    # The runs are started in a temporary directory, so the log file and the plots do not pollute the repository
+    with tempfile.TemporaryDirectory() as directory:
+        facts_file = os.path.join(directory, 'facts.json')
+        topology = generate_topology('ring', device_count)
+        save_facts(topology.facts, facts_file)
+        analysis = ['--facts-file', facts_file, '-s', topology.source, '-d', topology.destination, '-l', 'ERROR']
+        cases = (
+            ('--help', ['--help']),
+            ('analysis --no-plot', analysis + ['--no-plot']),
+            ('analysis + plot', analysis + ['-f', os.path.join(directory, 'plot.png')]),
+        )
+        for name, arguments in cases:
+            print(f"{device_count:>6} devices  {name:<20} {measure(arguments, directory, repeat) * 1000:>9.1f} ms "
+                  f"(median of {repeat})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CLI startup (time to first analysis) benchmark")
+    parser.add_argument('--devices', type=int, nargs='+', default=[10, 100], help="Inventory sizes")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of runs per measurement")
+    args = parser.parse_args()
+    for device_count in args.devices:
+        benchmark(device_count, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Check of the analysis of a partially gathered network (see NetworkAnalyzer.from_stream).
+The facts of the hosts are ingested one by one in a random order, leaving out a router which is not used by the
+routes in either direction (stale host). The result must be the same as the result of the full network
+and the graphs must be built at the latest when every host arrived.
+Usage (from the lib directory): python -m benchmark.streaming --topology ring --routers 8 --fault loop rupture
+"""
+import argparse
+import random
+import time
+
+import networkx as nx
+
+from benchmark.topology import TOPOLOGIES, FAULTS, Topology, generate_topology
+from network_analyzer.NetworkAnalyzer import NetworkAnalyzer
+
+
+def analyze_partial(topology: Topology, hostnames: list) -> NetworkAnalyzer:
+    """
+    Ingest the facts of some hosts one by one
+    :param topology: The generated network
+    :param hostnames: The hosts whose facts arrive, in the order of arrival
+    :return: The analyzer of the partial network
+    """
+    analyzer = NetworkAnalyzer.create_partial(topology.source, topology.destination, "Streaming check")
+    for hostname in hostnames:
+        analyzer.ingest_host_facts(hostname, topology.facts[hostname])
+    assert analyzer.graphs_built, "Graphs are not built from the partial network"
+    analyzer.freeze_initial_graphs()
+    return analyzer
+
+
+def check(topology_name: str, router_count: int, faults: list, seed: int) -> None:
+    topology = generate_topology(topology_name, router_count, faults=faults)
+    full = NetworkAnalyzer(topology.facts, source=topology.source, destination=topology.destination,
+                           test_case_name="Streaming check")
+    expected = repr(full.detect_loop_in_route())
+    # The routers reached by the routes in either direction
+    on_route = {full.source.hostname, full.destination.hostname} | \
+        nx.descendants(full.graph_from_source, full.source.hostname) | \
+        nx.descendants(full.graph_from_destination, full.destination.hostname)
+    generator = random.Random(seed)
+    checked = 0
+    start = time.perf_counter()
+    for stale in sorted(topology.facts):
+        if stale in on_route:
+            continue
+        hostnames = [hostname for hostname in topology.facts if hostname != stale]
+        generator.shuffle(hostnames)
+        result = repr(analyze_partial(topology, hostnames).detect_loop_in_route())
+        assert result == expected, f"{stale} is stale: {result} instead of {expected}"
+        checked += 1
+    elapsed = time.perf_counter() - start
+    print(f"{topology_name:<14} {router_count:>4} routers  faults: {','.join(faults) or '-':<14}"
+          f"{checked:>4} stale routers checked {elapsed * 1000:>9.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Partially gathered network check")
+    parser.add_argument('--topology', choices=TOPOLOGIES, nargs='+', default=['ring'], help="Topologies")
+    parser.add_argument('--routers', type=int, nargs='+', default=[8], help="Numbers of routers")
+    parser.add_argument('--fault', choices=FAULTS, nargs='*', default=[], help="Faults, checked one by one")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the order of arrival")
+    args = parser.parse_args()
+    for topology_name in args.topology:
+        for router_count in args.routers:
+            for faults in [[]] + [[fault] for fault in args.fault]:
+                check(topology_name, router_count, faults, args.seed)
+
+
+if __name__ == "__main__":
+    main()
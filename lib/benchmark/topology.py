@@ -0,0 +1,272 @@
+"""
+Synthetic topology generator for the benchmarks.
+The generated facts have the same format as the facts gathered by gather-ios-facts.yml, so they can be used
+everywhere instead of the facts of the lab. Every router has static routes towards the source and destination
+networks and towards some other edge networks, along the shortest paths of the topology.
+Usage (from the lib directory): python -m benchmark.topology --topology ring --routers 10 --fault loop -o facts.json
+"""
+import argparse
+import logging
+from collections import deque
+from typing import Dict, List, NamedTuple, Tuple
+
+from ansible_api.facts import save_facts
+
+logger = logging.getLogger(__name__)
+
+TOPOLOGIES = ('ring', 'mesh', 'hub-and-spoke', 'fat-tree')
+# Problems which can be injected into the route from the source network towards the destination network
+FAULTS = ('loop', 'rupture', 'netmask', 'shutdown')
+# The netmask of the destination route with the 'netmask' fault (too specific, like in test case 3)
+WRONG_PREFIXLEN = 28
+
+
+class Topology(NamedTuple):
+    name: str
+    facts: dict
+    # The source and destination edge networks (CIDR)
+    source: str
+    destination: str
+    # The hostnames of the routers on the route from the source towards the destination (before the faults)
+    path: List[str]
+
+
+def ring_links(router_count: int) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    Every router is connected to the next one, the last router to the first one
+    :param router_count: Number of routers
+    :return: Tuple of the links (router index pairs) and the routers with an edge network
+    """
+    if router_count < 3:
+        return [(0, 1)] if router_count == 2 else [], list(range(router_count))
+    return [(index, (index + 1) % router_count) for index in range(router_count)], list(range(router_count))
+
+
+def mesh_links(router_count: int) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    Every router is connected to every other router
+    :param router_count: Number of routers
+    :return: Tuple of the links (router index pairs) and the routers with an edge network
+    """
+    links = [(first, second) for first in range(router_count) for second in range(first + 1, router_count)]
+    return links, list(range(router_count))
+
+
+def hub_and_spoke_links(router_count: int) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    The first router (hub) is connected to every other router (spoke). Only the spokes have edge networks.
+    :param router_count: Number of routers
+    :return: Tuple of the links (router index pairs) and the routers with an edge network
+    """
+    return [(0, spoke) for spoke in range(1, router_count)], list(range(1, router_count))
+
+
+def fat_tree_links(router_count: int) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    Two-tier folded Clos (leaf-spine): every leaf is connected to every spine. Only the leaves have edge networks.
+    The number of spines grows with the square root of the number of routers.
+    :param router_count: Number of routers
+    :return: Tuple of the links (router index pairs) and the routers with an edge network
+    """
+    spine_count = max(2, int(router_count ** 0.5) // 2)
+    if router_count <= spine_count:
+        raise ValueError(f"A fat-tree needs more than {spine_count} routers")
+    leaves = list(range(spine_count, router_count))
+    return [(spine, leaf) for leaf in leaves for spine in range(spine_count)], leaves
+
+
+TOPOLOGY_LINKS = {
+    'ring': ring_links,
+    'mesh': mesh_links,
+    'hub-and-spoke': hub_and_spoke_links,
+    'fat-tree': fat_tree_links,
+}
+
+
+def link_addresses(link: int) -> Tuple[str, str]:
+    """
+    Get the IP addresses of the two ends of a link (/30 networks from 172.16.0.0/12)
+    :param link: The index of the link
+    :return: Tuple of the addresses (with prefix length) of the two ends
+    """
+    prefix = f"172.{16 + link // 16384}.{link // 64 % 256}"
+    return f"{prefix}.{link % 64 * 4 + 1}/30", f"{prefix}.{link % 64 * 4 + 2}/30"
+
+
+def edge_network(router: int) -> str:
+    """
+    Get the edge network of a router (/24 networks from 10.128.0.0/9, so the management network is not used)
+    :param router: The index of the router
+    :return: The network (CIDR)
+    """
+    return f"10.{128 + router // 256}.{router % 256}.0/24"
+
+
+def interface_name(port: int) -> str:
+    return f"GigabitEthernet{port // 16}/{port % 16}"
+
+
+def distances_to(neighbours: List[List[Tuple[int, str]]], target: int) -> Dict[int, int]:
+    """
+    Get the number of hops from every router to a target router (breadth-first search)
+    :param neighbours: Router index -> list of (neighbour index, address of the neighbour on the link)
+    :param target: The index of the target router
+    :return: Router index -> number of hops
+    """
+    distances = {target: 0}
+    queue = deque([target])
+    while queue:
+        router = queue.popleft()
+        for neighbour, _ in neighbours[router]:
+            if neighbour not in distances:
+                distances[neighbour] = distances[router] + 1
+                queue.append(neighbour)
+    return distances
+
+
+def shortest_path_tree(neighbours: List[List[Tuple[int, str]]], target: int, ecmp: bool) \
+        -> Dict[int, List[str]]:
+    """
+    Get the next hops of every router towards a target router along the shortest paths
+    :param neighbours: Router index -> list of (neighbour index, address of the neighbour on the link)
+    :param target: The index of the target router
+    :param ecmp: Use every next hop of the equal cost paths (otherwise only the neighbour with the lowest index)
+    :return: Router index -> next hop addresses
+    """
+    distances = distances_to(neighbours, target)
+    next_hops = {}
+    for router, distance in distances.items():
+        if router == target:
+            continue
+        candidates = sorted((neighbour, address) for neighbour, address in neighbours[router]
+                            if distances.get(neighbour) == distance - 1)
+        next_hops[router] = [address for _, address in (candidates if ecmp else candidates[:1])]
+    return next_hops
+
+
+def static_route(destination: str, next_hops: List[str]) -> dict:
+    return {'dest': destination, 'next_hops': [{'forward_router_address': address} for address in next_hops]}
+
+
+def generate_topology(topology: str, router_count: int, static_count: int = 8, faults: List[str] = (),
+                      ecmp: bool = False) -> Topology:
+    """
+    Generate the facts of a network
+    :param topology: One of TOPOLOGIES
+    :param router_count: Number of routers
+    :param static_count: Number of static routes per router towards other edge networks
+        (besides the routes towards the source and destination networks)
+    :param faults: Problems injected into the route from the source towards the destination (see FAULTS)
+    :param ecmp: Add every next hop of the equal cost paths to the routes
+    :return: The generated topology
+    """
+    if topology not in TOPOLOGY_LINKS:
+        raise ValueError(f"Unknown topology {topology}, use one of {', '.join(TOPOLOGIES)}")
+    links, edge_routers = TOPOLOGY_LINKS[topology](router_count)
+    if len(edge_routers) < 2:
+        raise ValueError(f"The {topology} topology needs more routers")
+
+    hostnames = [f"R{router + 1}" for router in range(router_count)]
+    # Router index -> list of l3 interface facts, and (neighbour index, address of the neighbour)
+    l3_interfaces: List[List[dict]] = [[] for _ in range(router_count)]
+    neighbours: List[List[Tuple[int, str]]] = [[] for _ in range(router_count)]
+    # (router, next hop address) -> name of the interface towards the next hop
+    exit_interfaces: Dict[Tuple[int, str], str] = {}
+    for link, (first, second) in enumerate(links):
+        first_address, second_address = link_addresses(link)
+        for router, address, neighbour, neighbour_address in ((first, first_address, second, second_address),
+                                                              (second, second_address, first, first_address)):
+            name = interface_name(len(l3_interfaces[router]))
+            l3_interfaces[router].append({'name': name, 'ipv4': [{'address': address}]})
+            neighbour_ip = neighbour_address.split('/')[0]
+            neighbours[router].append((neighbour, neighbour_ip))
+            exit_interfaces[(router, neighbour_ip)] = name
+    for router in edge_routers:
+        address = edge_network(router).replace('.0/24', '.1/24')
+        name = interface_name(len(l3_interfaces[router]))
+        l3_interfaces[router].append({'name': name, 'ipv4': [{'address': address}]})
+
+    # The source is the first edge router, the destination is the edge router farthest from it
+    source_router = edge_routers[0]
+    hops = distances_to(neighbours, source_router)
+    destination_router = max(edge_routers, key=lambda router: (hops.get(router, -1), router))
+
+    # Destinations of the static routes: the source, the destination and evenly spaced other edge networks
+    others = [router for router in edge_routers if router not in (source_router, destination_router)]
+    step = max(1, len(others) // static_count) if static_count else 0
+    targets = [source_router, destination_router] + (others[::step][:static_count] if step else [])
+    routes: List[Dict[str, List[str]]] = [{} for _ in range(router_count)]
+    for target in targets:
+        for router, next_hops in shortest_path_tree(neighbours, target, ecmp).items():
+            routes[router][edge_network(target)] = next_hops
+
+    source, destination = edge_network(source_router), edge_network(destination_router)
+    path = [source_router]
+    while path[-1] != destination_router:
+        next_hop = routes[path[-1]][destination][0]
+        path.append(next(neighbour for neighbour, address in neighbours[path[-1]] if address == next_hop))
+
+    disabled = set()
+    for number, fault in enumerate(faults, start=1):
+        # The faults are spread over the inner routers of the route. If the route has no inner router
+        # (Eg.: in a full mesh), the fault is injected on the source router.
+        position = min(max(1, number * len(path) // (len(faults) + 1)), len(path) - 2)
+        router = path[position]
+        if fault == 'loop':
+            if position:
+                previous = path[position - 1]
+            else:
+                # Send the traffic to another neighbour, which sends it back
+                previous = next(neighbour for neighbour, _ in neighbours[router] if neighbour != path[1])
+                routes[previous][destination] = [address for neighbour, address in neighbours[previous]
+                                                 if neighbour == router]
+            routes[router][destination] = [address for neighbour, address in neighbours[router]
+                                           if neighbour == previous]
+        elif fault == 'rupture':
+            del routes[router][destination]
+        elif fault == 'netmask':
+            next_hops = routes[router].pop(destination)
+            routes[router][destination.replace('/24', f"/{WRONG_PREFIXLEN}")] = next_hops
+        elif fault == 'shutdown':
+            disabled.add((router, exit_interfaces[(router, routes[router][destination][0])]))
+        else:
+            raise ValueError(f"Unknown fault {fault}, use one of {', '.join(FAULTS)}")
+        logger.debug(f"Injected {fault} on {hostnames[router]}")
+
+    facts = {}
+    for router, hostname in enumerate(hostnames):
+        interfaces = [{'name': interface['name'], 'enabled': (router, interface['name']) not in disabled,
+                       'duplex': 'auto', 'speed': 'auto'} for interface in l3_interfaces[router]]
+        facts[hostname] = {
+            'ansible_net_hostname': hostname,
+            'ansible_net_system': 'ios',
+            'ansible_network_resources': {
+                'hostname': {'hostname': hostname},
+                'interfaces': interfaces,
+                'l2_interfaces': [{'name': interface['name']} for interface in interfaces],
+                'l3_interfaces': l3_interfaces[router],
+                'static_routes': [{'address_families': [{'afi': 'ipv4', 'routes': [
+                    static_route(network, next_hops) for network, next_hops in sorted(routes[router].items())
+                ]}]}] if routes[router] else [],
+            }
+        }
+    return Topology(topology, facts, source, destination, [hostnames[router] for router in path])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate the facts of a synthetic network")
+    parser.add_argument('--topology', choices=TOPOLOGIES, default='ring', help="Topology of the network")
+    parser.add_argument('--routers', type=int, default=10, help="Number of routers")
+    parser.add_argument('--statics', type=int, default=8, help="Number of extra static routes per router")
+    parser.add_argument('--fault', dest='faults', choices=FAULTS, action='append', default=[],
+                        help="Inject a problem into the route (can be repeated)")
+    parser.add_argument('--ecmp', action='store_true', help="Use every equal cost next hop in the routes")
+    parser.add_argument('-o', '--output', required=True, help="Save the facts to this file")
+    args = parser.parse_args()
+    topology = generate_topology(args.topology, args.routers, args.statics, args.faults, args.ecmp)
+    save_facts(topology.facts, args.output)
+    print(f"Source: {topology.source}, destination: {topology.destination}, route: {' -> '.join(topology.path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,23 @@
 import argparse
+import atexit
+import json
 import logging
 import os
 import sys
 from datetime import datetime
 from pathlib import Path
+from typing import List
 
 from colorama import Fore, Style, init  # type: ignore
 
-from ansible_api.facts import gather_ios_facts
+# The analysis modules (networkx) are imported by the code paths which use them, so argument errors and --help
+# do not pay for them. ansible_runner and matplotlib are imported only when Ansible is run or a plot is saved.
+from ansible_api.facts import gather_ios_facts, load_facts, save_facts
+from ansible_api.fact_cache import DEFAULT_CACHE_FILE, FactCache
 from ansible_api.playbook import run_playbook
-from network_analyzer.NetworkAnalyzer import NetworkAnalyzer
+from ansible_api.runner import HOST_TIMEOUT
+from server import DEFAULT_LISTEN
+from utils import trace
 from utils.permission import change_ansible_runner_permissions
 
 logger = logging.getLogger()
@@ -45,9 +53,24 @@ def setup_parser() -> argparse.Namespace:
     """
     parser = argparse.ArgumentParser(description="Szakdolgozat CLI tool")
     parser.add_argument('-p', '--playbook', metavar="playbook", type=str, help="Location of the playbook file to run")
-    parser.add_argument('-s', '--source', type=str, dest="source", required=True, help="Source IP Address with netmask")
+    parser.add_argument('-s', '--source', type=str, dest="source", help="Source IP Address with netmask")
     parser.add_argument(
-        '-d', '--destination', type=str, dest="destination", required=True, help="Destination IP Address with netmask"
+        '-d', '--destination', type=str, dest="destination", help="Destination IP Address with netmask"
+    )
+    parser.add_argument(
+        '--vrf', dest="vrf", type=str, help="VRF of the source and destination network (default: global routing table)"
+    )
+    parser.add_argument(
+        '--exclude-vrf', dest="excludedvrfs", metavar="VRF", action='append',
+        help="VRF which is never analyzed, can be repeated (default: mgmt-intf)"
+    )
+    parser.add_argument(
+        '--exclude-network', dest="excludednetworks", metavar="NETWORK", action='append',
+        help="Network whose interfaces are never used (in any VRF), can be repeated (default: 10.10.20.0/24)"
+    )
+    parser.add_argument(
+        '--all-vrfs', dest="allvrfs", action='store_true',
+        help="Also check the source/destination pair in every other VRF which contains both networks"
     )
     parser.add_argument(
         '--data-dir', metavar="datadir", dest="datadir", type=str,
@@ -57,14 +80,137 @@ def setup_parser() -> argparse.Namespace:
     parser.add_argument('--no-auto-fix', dest="autofix", action="store_false", help="Just report detected errors")
     parser.add_argument(
         '-f', '--filename', dest="filename", default=f"plot_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.png",
-        help="Filename of the plotted network (PNG)"
+        help="Filename of the plotted network, the format is selected by the extension (PNG, SVG, PDF, DOT or JSON)"
+    )
+    parser.add_argument('--no-plot', dest="plot", action='store_false', help="Do not save the plot of the network")
+    parser.add_argument(
+        '--facts-file', dest="factsfile", type=str,
+        help="Load the facts from a saved snapshot instead of gathering them from the devices (offline mode)"
+    )
+    parser.add_argument(
+        '--save-facts', dest="savefacts", type=str,
+        help="Save the gathered facts to a snapshot file (compressed if the filename ends with .gz)"
+    )
+    parser.add_argument(
+        '--fact-cache', dest="factcache", type=str, nargs='?', const=DEFAULT_CACHE_FILE,
+        help="Cache the facts in this file and gather the full facts only from the devices whose configuration "
+             f"fingerprint changed (default file: {DEFAULT_CACHE_FILE})"
+    )
+    parser.add_argument(
+        '--all-pairs', dest="allpairs", action='store_true',
+        help="Check the reachability between every pair of edge networks instead of a single source/destination"
+    )
+    parser.add_argument(
+        '--verify', dest="verify", action='store_true',
+        help="Check the whole address space for forwarding loops and black holes"
+    )
+    parser.add_argument(
+        '--serve', dest="serve", action='store_true',
+        help="Keep the network in memory and serve the JSON API (reachability, loops, fix-plan, refresh)"
+    )
+    parser.add_argument(
+        '--listen', dest="listen", type=str, default=DEFAULT_LISTEN,
+        help="Address of the API server: host:port or unix:/path/to/socket"
+    )
+    parser.add_argument(
+        '--matrix-file', dest="matrixfile", type=str, help="Save the all-pairs reachability matrix to a JSON file"
+    )
+    parser.add_argument(
+        '--stream', dest="stream", action='store_true',
+        help="Build the network while the facts arrive and analyze it as soon as the source and destination routers "
+             "arrived (single source/destination without a facts file or fact cache)"
+    )
+    parser.add_argument(
+        '--host-timeout', dest="hosttimeout", type=float, default=HOST_TIMEOUT,
+        help="Seconds after a host which did not return its facts is left out of a streamed analysis"
+    )
+    parser.add_argument(
+        '--trace', dest="trace", type=str,
+        help="Save the time of each stage and the counters to this file (Chrome trace, JSON lines if it ends with "
+             ".jsonl) and a Prometheus summary next to it (.prom)"
     )
     parser.add_argument(
         '-l', '--log-level', dest="loglevel",
         default="INFO", help="Logging level in CLI (check python.logging for more info)"
     )
-    parser.set_defaults(autofix=True)
-    return parser.parse_args()
+    parser.set_defaults(autofix=True, plot=True)
+    args = parser.parse_args()
+    if not args.allpairs and not args.verify and not args.serve and (args.source is None or args.destination is None):
+        parser.error(
+            "the following arguments are required: -s/--source, -d/--destination (or --all-pairs/--verify/--serve)"
+        )
+    if args.plot:
+        # Checked before any work is done, the plot is saved at the end of the analysis
+        from utils.plot import FIGURE_FORMATS, TEXT_FORMATS, get_graph_format
+        if get_graph_format(args.filename) not in FIGURE_FORMATS + TEXT_FORMATS:
+            parser.error(f"unknown plot format of {args.filename}, use one of "
+                         f"{', '.join(FIGURE_FORMATS + TEXT_FORMATS)} (or no extension for PNG)")
+    if args.excludednetworks:
+        import netaddr  # type: ignore
+        for network in args.excludednetworks:
+            try:
+                netaddr.IPNetwork(network)
+            except (netaddr.AddrFormatError, ValueError):
+                parser.error(f"invalid network for --exclude-network: {network}")
+    return args
+
+
+def save_trace(filename: str) -> None:
+    """
+    Stop tracing and save the trace and its Prometheus summary
+    :param filename: The trace file
+    :return: None
+    """
+    tracer = trace.disable()
+    if tracer is not None:
+        summary_filename = trace.save(tracer, os.path.abspath(filename))
+        print(Fore.GREEN + f"Trace saved to {filename} (summary: {summary_filename})")
+
+
+@trace.traced('main.analyze_all_pairs')
+def analyze_all_pairs(facts: dict, matrix_file: str = None, excluded_networks: List[str] = None) -> None:
+    """
+    Check the reachability between every pair of edge networks and print the problems
+    :param facts: The gathered facts from Ansible
+    :param matrix_file: Save the matrix to this JSON file. If None, the matrix is not saved
+    :param excluded_networks: Networks whose interfaces are not used. If None, NetworkAnalyzer.EXCLUDED_NETWORKS
+    :return: None
+    """
+    from network_analyzer.NetworkAnalyzer import EXCLUDED_NETWORKS
+    from network_analyzer.ReachabilityMatrix import ReachabilityMatrix
+    matrix = ReachabilityMatrix(
+        facts, excluded_networks=list(EXCLUDED_NETWORKS if excluded_networks is None else excluded_networks)
+    )
+    print(Fore.GREEN + f"Edge networks: {len(matrix.edge_networks)}")
+    for state, count in matrix.summary().items():
+        print(Fore.CYAN + f"{state}: {count} pair(s)")
+    for source, destination, state in matrix.problems():
+        print(Fore.YELLOW + f"{source} -> {destination}: {state}")
+    for destination, loops in matrix.loops.items():
+        for loop in loops:
+            print(Fore.MAGENTA + f"Loop towards {destination}: {', '.join(loop)}")
+    if matrix_file:
+        with open(matrix_file, 'w', encoding='utf-8') as file:
+            json.dump(matrix.to_dict(), file, indent=2)
+        print(Fore.GREEN + f"Reachability matrix saved to {matrix_file}")
+
+
+@trace.traced('main.verify_network')
+def verify_network(facts: dict) -> None:
+    """
+    Check every forwarding equivalence class of the network for loops and black holes and print the problems
+    :param facts: The gathered facts from Ansible
+    :return: None
+    """
+    from network_analyzer.ForwardingEngine import ForwardingEngine
+    engine = ForwardingEngine(facts)
+    print(Fore.GREEN + f"Forwarding equivalence classes: {len(engine.classes)}")
+    for forwarding_class, loop in engine.loops():
+        print(Fore.MAGENTA + f"Loop for {', '.join(forwarding_class.cidrs)}: {', '.join(loop)}")
+    for forwarding_class, hostname in engine.black_holes():
+        print(Fore.YELLOW + f"Black hole for {', '.join(forwarding_class.cidrs)}: {hostname}")
+    if engine.is_loop_free():
+        print(Fore.GREEN + "The network is loop-free for every destination")
 
 
 def main() -> None:
@@ -76,6 +222,10 @@ def main() -> None:
     init(autoreset=True)
     args = setup_parser()
     setup_logging(args.loglevel)
+    if args.trace:
+        trace.enable()
+        # The trace is saved however the program exits (Eg.: the server is stopped with Ctrl+C)
+        atexit.register(save_trace, args.trace)
 
     # Set Ansible cfg env variable
     os.environ["ANSIBLE_CONFIG"] = os.path.abspath("../ansible/ansible.cfg")
@@ -87,27 +237,117 @@ def main() -> None:
 
     logger.debug("Program initialization complete")
     print(Fore.CYAN + "Starting Network Analyzer Tool")
-    print(Fore.GREEN + f"Source IP address/network: {args.source}")
-    print(Fore.GREEN + f"Destination IP address/network: {args.destination}")
-
-    # Run the selected playbook if there is a specified playbook
-    # If the current network needs some pre-requisite setup,
-    # you can specify that playbook which will be run before querying the network state
-    # and making assumptions from the received state.
-    if args.playbook:
-        logger.info("Running supplied playbook")
-        run_playbook(playbook_file=os.path.abspath(args.playbook), data_dir=default_data_dir)
-        logger.debug("Supplied playbook finished")
-
-    logger.debug("Running gather_facts playbook")
-    # Run this playbook every time and get facts from this
-    results = gather_ios_facts()
+    if args.serve:
+        print(Fore.GREEN + f"Serving the analyzer API on {args.listen}")
+    elif args.verify:
+        print(Fore.GREEN + "Checking the whole address space")
+    elif args.allpairs:
+        print(Fore.GREEN + "Checking every pair of edge networks")
+    else:
+        print(Fore.GREEN + f"Source IP address/network: {args.source}")
+        print(Fore.GREEN + f"Destination IP address/network: {args.destination}")
+
+    fact_cache = None
+    # Streaming builds the analyzer from the runner events, so the facts are gathered later (see below)
+    stream = args.stream and not (args.factsfile or args.factcache or args.serve or args.allpairs or args.verify)
+    if args.stream and not stream:
+        logger.warning("Streaming is only available for a single source/destination gathered without a fact cache")
+    if args.factsfile:
+        # Offline mode: analyze a saved snapshot without touching the network.
+        # Fixes cannot be applied (or verified) without the devices.
+        logger.info(f"Loading facts from snapshot {args.factsfile}")
+        print(Fore.GREEN + f"Using facts snapshot: {args.factsfile}")
+        with trace.span('main.load_facts'):
+            results = load_facts(os.path.abspath(args.factsfile))
+        if args.autofix:
+            logger.warning("Auto-fix is not available when using a facts snapshot")
+            args.autofix = False
+    else:
+        # Run the selected playbook if there is a specified playbook
+        # If the current network needs some pre-requisite setup,
+        # you can specify that playbook which will be run before querying the network state
+        # and making assumptions from the received state.
+        if args.playbook:
+            logger.info("Running supplied playbook")
+            run_playbook(playbook_file=os.path.abspath(args.playbook), data_dir=default_data_dir)
+            logger.debug("Supplied playbook finished")
+
+        logger.debug("Running gather_facts playbook")
+        # Run this playbook every time and get facts from this
+        with trace.span('main.gather_facts'):
+            if stream:
+                results = None
+            elif args.factcache:
+                fact_cache = FactCache(args.factcache)
+                results = fact_cache.gather()
+            else:
+                results = gather_ios_facts()
+
+    if args.savefacts and results is not None:
+        save_facts(results, os.path.abspath(args.savefacts))
+
+    if args.serve:
+        from server.daemon import AnalyzerService, serve
+        if args.factsfile:
+            # A refresh reloads the snapshot file
+            facts_file = os.path.abspath(args.factsfile)
+            service = AnalyzerService(
+                lambda hosts: {hostname: host_facts for hostname, host_facts in load_facts(facts_file).items()
+                               if hosts is None or hostname in hosts},
+                facts=results
+            )
+        elif fact_cache is not None:
+            service = AnalyzerService(fact_cache.gather, facts=results)
+        else:
+            service = AnalyzerService(lambda hosts: gather_ios_facts(hosts=hosts), facts=results)
+        serve(service, args.listen)
+        return
+
+    if args.allpairs or args.verify:
+        # The all-pairs and verify modes only report the state of the network, they do not fix it.
+        if args.verify:
+            verify_network(results)
+        if args.allpairs:
+            analyze_all_pairs(results, args.matrixfile, args.excludednetworks)
+        print(Fore.CYAN + "Program finished, exiting!")
+        print(Fore.YELLOW + Style.DIM + "Bye!")
+        return
 
     test_case_name = Path(args.playbook).stem if args.playbook else "Network analyzation"
     # Run the network analyzer on the gathered facts
-    analyzer = NetworkAnalyzer(
-        results, source=args.source, destination=args.destination, test_case_name=test_case_name
-    )
+    from network_analyzer.NetworkAnalyzer import EXCLUDED_NETWORKS, EXCLUDED_VRFS, NetworkAnalyzer
+    excluded_vrfs = EXCLUDED_VRFS if args.excludedvrfs is None else args.excludedvrfs
+    excluded_networks = EXCLUDED_NETWORKS if args.excludednetworks is None else args.excludednetworks
+    if stream:
+        def log_partial_state(partial: NetworkAnalyzer, hostname: str) -> None:
+            logger.debug(f"{hostname} arrived ({len(partial.hosts)} hosts): {partial.detect_loop_in_route()}")
+
+        with trace.span('main.stream_analyzer'):
+            analyzer = NetworkAnalyzer.from_stream(
+                args.source, args.destination, test_case_name, host_timeout=args.hosttimeout,
+                on_update=log_partial_state if logger.isEnabledFor(logging.DEBUG) else None,
+                vrf=args.vrf, excluded_vrfs=excluded_vrfs, excluded_networks=excluded_networks
+            )
+        results = analyzer.facts
+        if analyzer.stale_hosts:
+            print(Fore.YELLOW + f"Hosts left out of the analysis: {', '.join(sorted(analyzer.stale_hosts))}")
+        if args.savefacts:
+            save_facts(results, os.path.abspath(args.savefacts))
+    else:
+        with trace.span('main.create_analyzer', hosts=len(results)):
+            analyzer = NetworkAnalyzer(
+                results, source=args.source, destination=args.destination, test_case_name=test_case_name,
+                vrf=args.vrf, excluded_vrfs=excluded_vrfs, fact_cache=fact_cache,
+                excluded_networks=excluded_networks
+            )
+    if args.allvrfs:
+        for vrf, vrf_state in analyzer.check_vrfs().items():
+            if vrf_state['source']['loop'] or vrf_state['destination']['loop']:
+                print(Fore.MAGENTA + f"VRF {vrf or 'global'}: loop")
+            elif not NetworkAnalyzer.is_fixed(vrf_state):
+                print(Fore.YELLOW + f"VRF {vrf or 'global'}: rupture")
+            else:
+                print(Fore.GREEN + f"VRF {vrf or 'global'}: healthy")
     network_state = analyzer.detect_loop_in_route()
     logger.debug(network_state)
 
@@ -175,7 +415,8 @@ def main() -> None:
         logger.info("Finished successfully")
         # Plot the graph. If issues found,
         # highlight the problematic node/edge and also indicate possible solutions as well.
-        analyzer.plot_graph(filename=args.filename)
+        if args.plot:
+            analyzer.plot_graph(filename=args.filename)
         print(Fore.GREEN + "Finished successfully")
         if problem_fixed:
             logger.info("Problems fixed in network")
@@ -193,6 +434,11 @@ def main() -> None:
     else:
         logger.warning("Problems cannot be determined by the program")
         print(Fore.RED + "Problems cannot be determined by the program. Check them manually!")
+    if fact_cache is not None:
+        stats = fact_cache.stats()
+        print(Fore.CYAN + f"Fact cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+                          f"hit rate {stats['hit_rate']:.0%}, {stats['bytes_saved']} bytes not transferred, "
+                          f"{stats['hosts_reused']} parsed host(s) reused")
     print(Fore.CYAN + "Program finished, exiting!")
     print(Fore.YELLOW + Style.DIM + "Bye!")
 
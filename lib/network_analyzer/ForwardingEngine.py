@@ -0,0 +1,292 @@
+import bisect
+import logging
+from typing import Dict, List, Set, Tuple
+
+import netaddr  # type: ignore
+import networkx as nx  # type: ignore
+
+from network_analyzer.Host import Host
+from network_analyzer.InterfaceIndex import InterfaceIndex
+from network_analyzer.exception.exception import InterfaceNotFound
+from utils import trace
+from utils.graph import get_canonical_cycle, get_forwarding_routes
+from utils.ip import parse_network, prefixlen_to_mask
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardingClass:
+    __slots__ = ('start', 'end', 'graph', 'delivering', 'next_hops', 'loops', 'black_holes')
+
+    def __init__(self, start: int, end: int):
+        """
+        Forwarding equivalence class: a range of IPv4 addresses which every host forwards the same way,
+        because every route and interface prefix either contains the whole range or none of it.
+        :param start: The first address of the range (integer)
+        :param end: The address after the last address of the range (integer)
+        """
+        self.start = start
+        self.end = end
+        # Forwarding graph of the hosts for the addresses of this class
+        self.graph = nx.DiGraph()
+        # Hosts which have an enabled interface in the class (the traffic is delivered there)
+        self.delivering: Set[str] = set()
+        # Next-hop addresses of every route consulted for this class (used for incremental updates)
+        self.next_hops: Set[int] = set()
+        self.loops: List[List[str]] = []
+        # Hosts which receive traffic of the class, but can neither deliver nor forward it
+        self.black_holes: List[str] = []
+
+    @property
+    def cidrs(self) -> List[str]:
+        """
+        The range of the class as a list of CIDR networks
+        """
+        first, last = netaddr.IPAddress(self.start), netaddr.IPAddress(self.end - 1)
+        return [str(cidr) for cidr in netaddr.iprange_to_cidrs(first, last)]
+
+    def __repr__(self) -> str:
+        return f"ForwardingClass({netaddr.IPAddress(self.start)}-{netaddr.IPAddress(self.end - 1)})"
+
+
+class ForwardingEngine:
+    def __init__(self, facts: dict, vrf: str = None):
+        """
+        Whole-network verification based on forwarding equivalence classes.
+        The IPv4 address space is split at the boundaries of every route and interface prefix of every host.
+        Addresses between two neighbouring boundaries match the same prefixes everywhere, so one forwarding graph
+        per class is enough to check loops and black holes for every possible destination.
+        Only address ranges covered by at least one prefix are checked.
+        :param facts: The gathered facts from Ansible
+        :param vrf: The checked VRF, None for the global routing table
+        """
+        self.vrf = vrf
+        # Hosts by their name in the inventory (the keys of the facts)
+        self.inventory_hosts: Dict[str, Host] = {}
+        self.interface_index = InterfaceIndex([], vrf)
+        # (first address, address after the last) -> number of prefixes with that range
+        self.prefixes: Dict[Tuple[int, int], int] = {}
+        self.classes: List[ForwardingClass] = []
+        # Start addresses of the classes for bisect
+        self._starts: List[int] = []
+        for hostname, host_facts in facts.items():
+            self._add_host(hostname, Host(host_facts))
+        self._rebuild(set(), set())
+
+    def host_prefixes(self, host: Host) -> Set[Tuple[int, int]]:
+        """
+        Get the address ranges of the route destinations and interface networks of a host in the checked VRF
+        :param host: The host
+        :return: Set of (first address, address after the last) tuples
+        """
+        prefixes = set()
+        # Only the routing table of the checked VRF is used for forwarding (see get_forwarding_routes)
+        for route in host.get_route_table(self.vrf):
+            prefixes.add((route.network, route.network + (1 << (32 - route.prefixlen))))
+        for interface in host.interfaces:
+            if interface.address is not None and interface.vrf == self.vrf:
+                prefixes.add((interface.network, interface.network + (1 << (32 - interface.prefixlen))))
+        return prefixes
+
+    def host_forwarding_items(self, host: Host) -> Set[tuple]:
+        """
+        Get everything of a host which influences the forwarding decisions in the checked VRF
+        :param host: The host
+        :return: Set of ('route', first address, address after the last, next hop) and
+            ('interface', first address, address after the last, IP address, enabled) tuples
+        """
+        items = set()
+        for route in host.get_route_table(self.vrf):
+            items.add(('route', route.network, route.network + (1 << (32 - route.prefixlen)),
+                       parse_network(route.next_hop).ip))
+        for interface in host.interfaces:
+            if interface.address is not None and interface.vrf == self.vrf:
+                items.add(('interface', interface.network, interface.network + (1 << (32 - interface.prefixlen)),
+                           interface.ip, interface.enabled))
+        return items
+
+    def _add_host(self, hostname: str, host: Host) -> None:
+        self.inventory_hosts[hostname] = host
+        self.interface_index.add_host(host)
+        for prefix in self.host_prefixes(host):
+            self.prefixes[prefix] = self.prefixes.get(prefix, 0) + 1
+
+    def _remove_host(self, hostname: str) -> Host:
+        host = self.inventory_hosts.pop(hostname)
+        self.interface_index.remove_host(host)
+        for prefix in self.host_prefixes(host):
+            self.prefixes[prefix] -= 1
+            if not self.prefixes[prefix]:
+                del self.prefixes[prefix]
+        return host
+
+    def atoms(self) -> List[Tuple[int, int]]:
+        """
+        Split the address space covered by the prefixes into equivalence classes
+        :return: Sorted list of (first address, address after the last) ranges
+        """
+        events: Dict[int, int] = {}
+        for (start, end), count in self.prefixes.items():
+            events[start] = events.get(start, 0) + count
+            events[end] = events.get(end, 0) - count
+        atoms = []
+        depth = 0
+        boundaries = sorted(events)
+        for boundary, next_boundary in zip(boundaries, boundaries[1:]):
+            depth += events[boundary]
+            if depth > 0:
+                atoms.append((boundary, next_boundary))
+        return atoms
+
+    @trace.traced()
+    def _rebuild(self, changed_prefixes: Set[Tuple[int, int]], changed_addresses: Set[int],
+                 changed_subnets: Set[Tuple[int, int]] = frozenset()) -> int:
+        """
+        Recompute the classes. The results of a class are kept if its range did not change,
+        it does not overlap a changed prefix and none of its routes points to a changed interface.
+        :param changed_prefixes: Changed route destinations and interface networks
+        :param changed_addresses: IP addresses of the changed interfaces
+        :param changed_subnets: Networks of the changed interfaces (the status of the routes through them can change)
+        :return: The number of recomputed classes
+        """
+        previous = {(forwarding_class.start, forwarding_class.end): forwarding_class
+                    for forwarding_class in self.classes}
+        changed_ranges = sorted(changed_prefixes)
+        classes = []
+        recomputed = 0
+        for start, end in self.atoms():
+            forwarding_class = previous.get((start, end))
+            if forwarding_class is None or forwarding_class.next_hops & changed_addresses or \
+                    self._overlaps(changed_ranges, start, end) or \
+                    any(subnet_start <= next_hop < subnet_end for subnet_start, subnet_end in changed_subnets
+                        for next_hop in forwarding_class.next_hops):
+                forwarding_class = self.compute_class(start, end)
+                recomputed += 1
+            classes.append(forwarding_class)
+        self.classes = classes
+        self._starts = [forwarding_class.start for forwarding_class in classes]
+        logger.debug(f"Recomputed {recomputed} of {len(classes)} forwarding classes")
+        return recomputed
+
+    @staticmethod
+    def _overlaps(ranges: List[Tuple[int, int]], start: int, end: int) -> bool:
+        """
+        Check if a range overlaps any of the sorted ranges
+        """
+        for range_start, range_end in ranges:
+            if range_start >= end:
+                return False
+            if range_end > start:
+                return True
+        return False
+
+    def _delivering_hosts(self, address: int) -> Set[str]:
+        """
+        Get the hosts with an enabled interface whose network contains the address
+        :param address: The integer IP address
+        :return: Set of hostnames
+        """
+        hosts = set()
+        for prefixlen in self.interface_index.prefix_lengths:
+            for host, interface in self.interface_index.subnets.get((address & prefixlen_to_mask(prefixlen),
+                                                                      prefixlen), []):
+                if interface.enabled:
+                    hosts.add(host.hostname)
+        return hosts
+
+    def compute_class(self, start: int, end: int) -> ForwardingClass:
+        """
+        Build the forwarding graph of a class and check it for loops and black holes
+        :param start: The first address of the class
+        :param end: The address after the last address of the class
+        :return: The computed class
+        """
+        forwarding_class = ForwardingClass(start, end)
+        # Every address of the class is forwarded the same way, so the first one represents the class
+        representative = str(netaddr.IPAddress(start))
+        forwarding_class.delivering = self._delivering_hosts(start)
+        graph = forwarding_class.graph
+        for host in self.inventory_hosts.values():
+            if host.hostname in forwarding_class.delivering:
+                continue
+            forwarding_class.next_hops.update(
+                parse_network(route.next_hop).ip for route in host.get_route_table(self.vrf).covering(representative)
+            )
+            try:
+                routes = get_forwarding_routes(self.interface_index, host, representative)
+            except InterfaceNotFound as e:
+                logger.warning(f"{host.hostname} cannot forward {forwarding_class}: {e}")
+                continue
+            for route in routes:
+                match = self.interface_index.find_by_address(route.next_hop)
+                if match is not None:
+                    graph.add_edge(host.hostname, match[0].hostname)
+        for component in nx.strongly_connected_components(graph):
+            node = next(iter(component))
+            if len(component) > 1 or graph.has_edge(node, node):
+                forwarding_class.loops.append(get_canonical_cycle(graph, component))
+        forwarding_class.loops.sort()
+        forwarding_class.black_holes = sorted(
+            node for node in graph if graph.in_degree(node) and not graph.out_degree(node)
+            and node not in forwarding_class.delivering
+        )
+        return forwarding_class
+
+    def update(self, delta: dict) -> int:
+        """
+        Update the engine with the changed facts of some hosts.
+        Only the classes which can be affected by the changed routes and interfaces are recomputed.
+        :param delta: The changed facts (inventory hostname -> facts). If the facts are None, the host is removed.
+        :return: The number of recomputed classes
+        """
+        changed_items = set()
+        for hostname, host_facts in delta.items():
+            old_host = self._remove_host(hostname) if hostname in self.inventory_hosts else None
+            new_host = Host(host_facts) if host_facts is not None else None
+            if new_host is not None:
+                self._add_host(hostname, new_host)
+            old_items = self.host_forwarding_items(old_host) if old_host is not None else set()
+            new_items = self.host_forwarding_items(new_host) if new_host is not None else set()
+            if old_host is not None and new_host is not None and old_host.hostname != new_host.hostname:
+                # Every graph of the host changes if it is renamed
+                changed_items |= old_items | new_items
+            else:
+                changed_items |= old_items ^ new_items
+        changed_prefixes = {(item[1], item[2]) for item in changed_items}
+        changed_addresses = {item[3] for item in changed_items if item[0] == 'interface'}
+        changed_subnets = {(item[1], item[2]) for item in changed_items if item[0] == 'interface'}
+        return self._rebuild(changed_prefixes, changed_addresses, changed_subnets)
+
+    def find_class(self, address: str) -> ForwardingClass:
+        """
+        Get the equivalence class of an IP address
+        :param address: The IP address
+        :return: The class, None if the address is not covered by any prefix
+        """
+        value = int(netaddr.IPAddress(address))
+        position = bisect.bisect_right(self._starts, value) - 1
+        if position >= 0 and value < self.classes[position].end:
+            return self.classes[position]
+        return None
+
+    def loops(self) -> List[Tuple[ForwardingClass, List[str]]]:
+        """
+        Get every forwarding loop in the network
+        :return: List of (class, loop members) tuples
+        """
+        return [(forwarding_class, loop) for forwarding_class in self.classes for loop in forwarding_class.loops]
+
+    def black_holes(self) -> List[Tuple[ForwardingClass, str]]:
+        """
+        Get every host which drops the traffic of a class forwarded to it by another host
+        :return: List of (class, hostname) tuples
+        """
+        return [(forwarding_class, hostname) for forwarding_class in self.classes
+                for hostname in forwarding_class.black_holes]
+
+    def is_loop_free(self) -> bool:
+        """
+        Check if the network forwards every address without loops
+        :return: True if there is no loop for any class, False otherwise
+        """
+        return not any(forwarding_class.loops for forwarding_class in self.classes)
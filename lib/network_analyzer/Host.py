@@ -1,13 +1,44 @@
 import logging
+import re
+from typing import Dict, Set, Union
+
 import netaddr  # type: ignore
 
+from network_analyzer.Interface import Interface
+from network_analyzer.RouteTable import RouteTable, compile_route_tables
+from utils import trace
+
 logger = logging.getLogger(__name__)
 
+# VRF membership lines of an interface section in the running configuration (newer and older IOS syntax)
+VRF_FORWARDING = re.compile(r'^\s+(?:ip )?vrf forwarding (\S+)')
+
+
+def parse_interface_vrfs(config: str) -> Dict[str, str]:
+    """
+    Get the VRF of the interfaces from the running configuration (ansible_net_config fact)
+    :param config: The running configuration
+    :return: Dictionary of interface name -> VRF name. The interfaces in the global routing table are not included.
+    """
+    interface_vrfs = {}
+    interface = None
+    for line in config.splitlines():
+        if line.startswith('interface '):
+            interface = line.split(maxsplit=1)[1].strip()
+        elif not line.startswith(' '):
+            interface = None
+        elif interface is not None:
+            match = VRF_FORWARDING.match(line)
+            if match:
+                interface_vrfs[interface] = match.group(1)
+    return interface_vrfs
+
 
 class Host:
     hostname = 'R0'
     interfaces = None
     routes = None
+    route_tables = None
     
     # Extract useful info from the received facts' dict.
     def __init__(self, facts: dict):
@@ -16,22 +47,81 @@ class Host:
         The network interface resources will be joined and grouped by their interface name into a single object.
         :param facts: The facts gathered from Ansible
         """
+        trace.count('hosts_parsed')
         self.hostname = facts['ansible_net_hostname']
-        self.interfaces = facts['ansible_network_resources']['l3_interfaces']
-        # Merging different interface variables (interface, l2_interface, l3_interface).
-        # All of them should have distinct objects. Only name is the same.
-        for index, interface in enumerate(self.interfaces):
-            raw_interface = list(filter(lambda intf, curr_interface=interface: intf['name'] == curr_interface['name'],
-                                        facts['ansible_network_resources']['interfaces']))[0]
-            l2_interface = list(filter(lambda intf, curr_interface=interface: intf['name'] == curr_interface['name'],
-                                       facts['ansible_network_resources']['l2_interfaces']))[0]
-            merge = {**interface, **raw_interface, **l2_interface}
-            self.interfaces[index] = merge
-            logger.debug(f"Current element: {self.interfaces[index]}")
-        self.routes = facts['ansible_network_resources']['static_routes']
+        resources = facts['ansible_network_resources']
+        # Merging the interface variables (interfaces, l3_interfaces), l2_interfaces are not used.
+        # They have distinct objects, only the name is the same, so they are joined by name in one pass.
+        raw_interfaces = {interface['name']: interface for interface in resources['interfaces']}
+        # The VRF of the interfaces is only known if the running configuration was gathered
+        config = facts.get('ansible_net_config')
+        interface_vrfs = parse_interface_vrfs(config) if config is not None else {}
+        self.interfaces = []
+        for l3_interface in resources['l3_interfaces']:
+            raw_interface = raw_interfaces.get(l3_interface['name'], {})
+            addresses = [ipv4['address'] for ipv4 in l3_interface.get('ipv4', []) if 'address' in ipv4]
+            self.interfaces.append(Interface(
+                name=l3_interface['name'],
+                description=raw_interface.get('description'),
+                enabled=raw_interface.get('enabled', True),
+                address=addresses[0] if addresses else None,
+                vrf=l3_interface.get('vrf', interface_vrfs.get(l3_interface['name']))
+            ))
+            logger.debug(f"Current element: {self.interfaces[-1]}")
+        self.routes = resources['static_routes']
+        # Forwarding tables compiled from the static routes, keyed by VRF (None is the global table)
+        self.route_tables = compile_route_tables(self.routes)
+        if config is None:
+            self.assign_interface_vrfs()
         self.facts = facts
         logger.debug("Host {} loaded".format(str(self.hostname)))
         
+    def assign_interface_vrfs(self) -> None:
+        """
+        Guess the VRF of the interfaces if the facts do not contain the running configuration (Eg.: older snapshots).
+        An interface is put into a VRF if a static route of that VRF has its next hop in the interface network
+        (Eg.: the default route of the management VRF) and no route of the global routing table does.
+        An interface of a VRF without such a route stays in the global routing table, so the networks
+        which must never be used (Eg.: the management network) are excluded from the interface index as well
+        (see NetworkAnalyzer.EXCLUDED_NETWORKS).
+        If the facts contain the VRF of the interfaces (vrf key of the l3 interfaces), nothing is inferred.
+        :return: None
+        """
+        vrf_tables = [table for vrf, table in self.route_tables.items() if vrf is not None]
+        if not vrf_tables or any(interface.vrf is not None for interface in self.interfaces):
+            return
+        for interface in self.interfaces:
+            if interface.address is None or self.route_table.has_next_hop_within(interface.address):
+                continue
+            table = next((table for table in vrf_tables if table.has_next_hop_within(interface.address)), None)
+            if table is not None:
+                interface.vrf = table.vrf
+                logger.debug(f"{self.hostname} {interface.name} is in VRF {table.vrf}")
+
+    @property
+    def vrfs(self) -> Set[Union[str, None]]:
+        """
+        The VRFs of the host which have routes or interfaces (None is the global routing table)
+        """
+        return set(self.route_tables) | {interface.vrf for interface in self.interfaces}
+
+    @property
+    def route_table(self) -> RouteTable:
+        """
+        The compiled global routing table of the host
+        :return: The RouteTable of the global routing table
+        """
+        return self.route_tables[None]
+
+    def get_route_table(self, vrf: Union[str, None]) -> RouteTable:
+        """
+        Get the compiled routing table of a VRF
+        :param vrf: The name of the VRF, None for the global routing table
+        :return: The RouteTable of the VRF (empty if the host does not have routes in the VRF)
+        """
+        table = self.route_tables.get(vrf)
+        return table if table is not None else RouteTable(vrf)
+
     def __str__(self):
         return "[{}] - Interfaces: {}\nRoutes: {}".format(self.hostname, str(self.interfaces), str(self.routes))
 
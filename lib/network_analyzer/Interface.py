@@ -0,0 +1,36 @@
+from utils.ip import parse_network
+
+
+class Interface:
+    __slots__ = ('name', 'description', 'enabled', 'address', 'ip', 'network', 'prefixlen', 'vrf')
+
+    def __init__(self, name: str, description: str = None, enabled: bool = True, address: str = None,
+                 vrf: str = None):
+        """
+        Compact interface record joined from the interfaces, l2_interfaces and l3_interfaces facts.
+        The IPv4 address is parsed once, the address and the network are stored as integers.
+        :param name: The name of the interface (Eg.: GigabitEthernet0/1)
+        :param description: The description of the interface
+        :param enabled: True if the interface is enabled, False if it is shut down
+        :param address: The (first) IPv4 address of the interface in CIDR notation (Eg.: 192.168.10.1/30).
+            None if the interface does not have an IPv4 address
+        :param vrf: The VRF of the interface, None if it is in the global routing table
+        """
+        self.name = name
+        self.vrf = vrf
+        self.description = description
+        self.enabled = enabled
+        self.address = address
+        if address is not None:
+            network = parse_network(address)
+            self.ip = network.ip
+            self.network = network.network
+            self.prefixlen = network.prefixlen
+        else:
+            self.ip = None
+            self.network = None
+            self.prefixlen = None
+
+    def __repr__(self) -> str:
+        vrf = f", vrf {self.vrf}" if self.vrf is not None else ''
+        return f"Interface({self.name}, {self.address}, {'up' if self.enabled else 'down'}{vrf})"
@@ -0,0 +1,201 @@
+import logging
+from typing import Dict, Iterable, List, Tuple, Union
+
+import netaddr  # type: ignore
+
+from network_analyzer.Host import Host
+from network_analyzer.Interface import Interface
+from utils.ip import parse_network, prefixlen_to_mask
+
+logger = logging.getLogger(__name__)
+
+
+class InterfaceIndex:
+    # Interface IP address -> (Host, interface)
+    addresses: Dict[int, Tuple[Host, Interface]] = None
+    # (Network address, prefix length) -> [(Host, interface), ...]
+    subnets: Dict[Tuple[int, int], List[Tuple[Host, Interface]]] = None
+
+    def __init__(self, hosts: List[Host], vrf: str = None,
+                 excluded_networks: Iterable[Union[str, netaddr.IPNetwork]] = ()):
+        """
+        Index of every interface IP address in the network.
+        The index is built once when the hosts are loaded, so looking up the owner of an IP address
+        does not need to go through every interface of every host.
+        It contains an exact address map and a subnet map keyed by the integer network address and prefix length.
+        The subnet map is the L3 link table of the network: every neighbor and common subnet query is answered from it.
+        Only the interfaces of one VRF are indexed, as the same addresses can be used in different VRFs.
+        :param hosts: The hosts whose interfaces should be indexed
+        :param vrf: The VRF of the indexed interfaces, None for the global routing table
+        :param excluded_networks: The interfaces in these networks are not indexed (Eg.: the management network),
+            so they are never used as a link, a next hop or a common subnet
+        """
+        self.vrf = vrf
+        self.excluded_networks = [parse_network(network) for network in excluded_networks]
+        self.addresses = {}
+        self.subnets = {}
+        # Prefix lengths present in the subnet map, longest first.
+        self.prefix_lengths = []
+        for host in hosts:
+            self.add_host(host)
+        logger.debug(f"Interface index built with {len(self.addresses)} addresses and {len(self.subnets)} subnets")
+
+    def add_host(self, host: Host) -> None:
+        """
+        Add every configured IPv4 address of a host in the VRF of the index
+        :param host: The host to add
+        :return: None
+        """
+        for interface in host.interfaces:
+            if interface.address is not None and interface.vrf == self.vrf:
+                self.add_interface(host, interface)
+
+    def add_interface(self, host: Host, interface: Interface) -> None:
+        """
+        Add the IPv4 address of an interface to the index
+        :param host: The host of the interface
+        :param interface: The interface to add (it must have an address)
+        :return: None
+        """
+        if self.is_excluded(interface):
+            logger.debug(f"{host.hostname} {interface.name} is in an excluded network, it is not indexed")
+            return
+        # Keep the first owner if an address is (mistakenly) configured multiple times
+        self.addresses.setdefault(interface.ip, (host, interface))
+        self.subnets.setdefault((interface.network, interface.prefixlen), []).append((host, interface))
+        if interface.prefixlen not in self.prefix_lengths:
+            self.prefix_lengths.append(interface.prefixlen)
+            self.prefix_lengths.sort(reverse=True)
+
+    def is_excluded(self, interface: Interface) -> bool:
+        """
+        Check if the network of an interface is in one of the excluded networks
+        :param interface: The interface to check (it must have an address)
+        :return: True if the interface should not be indexed
+        """
+        return any(interface.prefixlen >= network.prefixlen and interface.network & network.mask == network.network
+                   for network in self.excluded_networks)
+
+    def remove_host(self, host: Host) -> None:
+        """
+        Remove every IPv4 address of a host from the index (Eg.: before replacing it with its updated version)
+        :param host: The host to remove
+        :return: None
+        """
+        for interface in host.interfaces:
+            if interface.address is None or interface.vrf != self.vrf:
+                continue
+            key = (interface.network, interface.prefixlen)
+            members = [member for member in self.subnets.get(key, []) if member[0] is not host]
+            if members:
+                self.subnets[key] = members
+            else:
+                self.subnets.pop(key, None)
+            owner = self.addresses.get(interface.ip)
+            if owner is not None and owner[0] is host:
+                del self.addresses[interface.ip]
+                # Fall back to another owner of the same address if there is one
+                for member in members:
+                    if member[1].ip == interface.ip:
+                        self.addresses[interface.ip] = member
+                        break
+
+    def copy(self) -> 'InterfaceIndex':
+        """
+        Copy the index, so hosts can be added to and removed from the copy without changing this index
+        :return: The new index (the Host and Interface objects are shared)
+        """
+        index = InterfaceIndex([], self.vrf)
+        index.excluded_networks = list(self.excluded_networks)
+        index.addresses = dict(self.addresses)
+        index.subnets = {key: list(members) for key, members in self.subnets.items()}
+        index.prefix_lengths = list(self.prefix_lengths)
+        return index
+
+    def find_by_network(self, network: Union[str, netaddr.IPNetwork]) -> List[Tuple[Host, Interface]]:
+        """
+        Find the interfaces which are connected to exactly the provided network (same network address and netmask)
+        :param network: The network to search for (Eg.: 10.0.1.0/24)
+        :return: List of (Host, interface) tuples, empty if no interface is connected to the network
+        """
+        parsed_network = parse_network(network)
+        return list(self.subnets.get((parsed_network.network, parsed_network.prefixlen), []))
+
+    def find_by_address(self, ip_address: Union[str, netaddr.IPAddress]) -> Union[Tuple[Host, Interface], None]:
+        """
+        Find the host and interface which has exactly the provided IP address
+        :param ip_address: The IP address to search for (Eg.: 192.168.10.1)
+        :return: Tuple with the Host and the interface, None if the IP address is not configured anywhere
+        """
+        return self.addresses.get(parse_network(ip_address).ip)
+
+    def find_by_subnet(self, ip_address: Union[str, netaddr.IPAddress], hostname: str = None) \
+            -> Union[Tuple[Host, Interface], None]:
+        """
+        Find the interface whose connected network contains the provided IP address.
+        The most specific network is returned if more than one contains the IP address.
+        :param ip_address: The IP address which should be contained by the interface network
+        :param hostname: Only search for interfaces on this host. If None, every host will be searched.
+        :return: Tuple with the Host and the interface, None if no interface network contains the IP address
+        """
+        address = parse_network(ip_address).ip
+        for prefixlen in self.prefix_lengths:
+            members = self.subnets.get((address & prefixlen_to_mask(prefixlen), prefixlen))
+            if not members:
+                continue
+            for host, interface in members:
+                if hostname is None or host.hostname == hostname:
+                    return host, interface
+        return None
+
+    def links(self, host: Host) -> List[Tuple[Interface, Host, Interface]]:
+        """
+        Get the L3 neighbors of a host: the interfaces of other hosts connected to the same subnet.
+        Only the subnets of the host are looked up, so this does not depend on the size of the network.
+        :param host: The host whose neighbors should be found
+        :return: List of (local interface, neighbor Host, neighbor interface) tuples,
+            in the order of the local interfaces
+        """
+        links = []
+        for interface in host.interfaces:
+            if interface.address is None:
+                continue
+            for neighbor, neighbor_interface in self.subnets.get((interface.network, interface.prefixlen), []):
+                if neighbor.hostname != host.hostname:
+                    links.append((interface, neighbor, neighbor_interface))
+        return links
+
+    def common_subnets(self, source: Host, destination: Host) -> List[Tuple[Interface, Interface]]:
+        """
+        Get the interface pairs of two hosts which are connected to the same subnet
+        :param source: The first host
+        :param destination: The second host
+        :return: List of (source interface, destination interface) tuples
+        """
+        return [(interface, neighbor_interface) for interface, neighbor, neighbor_interface in self.links(source)
+                if neighbor.hostname == destination.hostname]
+
+
+def build_vrf_indexes(hosts: List[Host], excluded_vrfs: Iterable[str] = (),
+                      excluded_networks: Iterable[Union[str, netaddr.IPNetwork]] = ()) \
+        -> Dict[Union[str, None], InterfaceIndex]:
+    """
+    Build the interface index of every VRF in a single pass over the interfaces of the hosts
+    :param hosts: The hosts whose interfaces should be indexed
+    :param excluded_vrfs: VRFs which should not be indexed (Eg.: the management VRF)
+    :param excluded_networks: Networks which should not be indexed in any VRF (Eg.: the management network)
+    :return: Dictionary of VRF name (None for the global routing table) -> InterfaceIndex.
+        Every VRF which has routes or interfaces on any host is included.
+    """
+    excluded_vrfs = set(excluded_vrfs)
+    excluded_networks = list(excluded_networks)
+    indexes = {}
+    for host in hosts:
+        for vrf in host.vrfs - excluded_vrfs:
+            if vrf not in indexes:
+                indexes[vrf] = InterfaceIndex([], vrf, excluded_networks)
+        for interface in host.interfaces:
+            if interface.address is not None and interface.vrf not in excluded_vrfs:
+                indexes[interface.vrf].add_interface(host, interface)
+    logger.debug(f"Interface indexes built for VRFs {sorted(indexes, key=str)}")
+    return indexes
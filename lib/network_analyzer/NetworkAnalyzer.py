@@ -1,109 +1,458 @@
+import asyncio
+import copy
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Tuple, Union, List
+from typing import Callable, Dict, Iterable, Tuple, Union, List
 
-import matplotlib.pyplot as plt  # type: ignore
 import netaddr  # type: ignore
 import networkx as nx  # type: ignore
 
-from ansible_api.facts import gather_ios_facts
-from ansible_api.task import run_task
+from ansible_api.facts import gather_ios_facts, gather_ios_facts_async, stream_ios_facts
+from ansible_api.change_set import ChangeSet
+from ansible_api.fact_cache import FactCache
+from ansible_api.runner import ANSIBLE_TIMEOUT, HOST_TIMEOUT
+from ansible_api.task import run_change_set, run_change_set_async
 from network_analyzer.Host import Host, SourceHost, DestinationHost
+from network_analyzer.Interface import Interface
+from network_analyzer.InterfaceIndex import InterfaceIndex, build_vrf_indexes
+from network_analyzer.RouteTable import Route
 from network_analyzer.exception.exception import NodeNotFoundException, NetworkSourceDestinationException, \
     NetworkMultipleDefinitionException
-from utils.graph import get_interface_status_from_route, check_interface_status, check_source_destination, \
-    check_loop_type, generate_tmp_graph, check_missing_interface_route, get_interface_ip_within_ip_network, \
-    get_interface_status_from_ip, get_ip_address_from_same_subnet, get_route_match_by_dest
-from utils.ip import compare_cidr_and_ip_address, check_network_contains_network
+from utils import trace
+from utils.graph import get_interface_status_from_route, check_interface_status, \
+    check_loop_type, generate_tmp_graph, find_missing_interface_routes, get_interface_ip_within_ip_network, \
+    get_interface_status_from_ip, get_ip_address_from_same_subnet, get_route_match_by_dest, interface_in_network, \
+    find_loops, get_forwarding_routes, walk_route, RouteWalk
+from utils.ip import check_network_contains_network
+from utils.plot import render_graph
 
 logger = logging.getLogger(__name__)
 
-MANAGEMENT_NETWORK = netaddr.IPNetwork('10.10.20.0/24')
+# VRFs which are not analyzed by default. In our environment, the management VRF only provides access to the devices.
+EXCLUDED_VRFS = ('mgmt-intf',)
+# Networks which are never used by the analysis and the fixes, whatever VRF their interfaces are in.
+# The VRF of an interface is guessed if the running configuration is not in the facts (see Host.assign_interface_vrfs),
+# so the management network is excluded by its address as well.
+EXCLUDED_NETWORKS = ('10.10.20.0/24',)
 
 
 class NetworkAnalyzer:
-    hosts = []
-    graph_from_source = nx.DiGraph()
-    graph_from_destination = nx.DiGraph()
-    source = None
-    destination = None
-
-    errors = []
-
-    def __init__(self, facts: dict, source: str, destination: str, test_case_name: str):
+    def __init__(self, facts: dict, source: str, destination: str, test_case_name: str, vrf: str = None,
+                 excluded_vrfs: Iterable[str] = EXCLUDED_VRFS, fact_cache: FactCache = None,
+                 excluded_networks: Iterable[str] = EXCLUDED_NETWORKS):
         """
         Create a new host for every fact element
         Add the hosts to the hosts directive
+        The graphs are built from the interfaces and routes of one VRF, the other VRFs can be analyzed
+        from the same loaded hosts (see vrf_analyzers).
         :param facts: The gathered facts from Ansible
         :param source: The source network
         :param destination: The destination network
         :param test_case_name: Name of the test case (usually filename)
+        :param vrf: The analyzed VRF, None for the global routing table
+        :param excluded_vrfs: VRFs which are never analyzed (Eg.: the management VRF)
+        :param fact_cache: Refresh the network through this cache and reuse its parsed hosts.
+            If None, the facts of the refreshed hosts are always gathered and parsed.
+        :param excluded_networks: The interfaces in these networks are never used (Eg.: the management network)
+        """
+        self._setup(source, destination, test_case_name, vrf, excluded_vrfs, fact_cache, excluded_networks)
+        self.load_hosts(facts)
+        self.build_graphs()
+        self.freeze_initial_graphs()
+
+    def _setup(self, source: str, destination: str, test_case_name: str, vrf: str,
+               excluded_vrfs: Iterable[str], fact_cache: Union[FactCache, None],
+               excluded_networks: Iterable[str]) -> None:
         """
+        Set the parameters and the empty state of the analyzer (see __init__ for the parameters)
+        """
+        self.fact_cache = fact_cache
+        self.excluded_vrfs = tuple(excluded_vrfs)
+        self.excluded_networks = tuple(excluded_networks)
+        if vrf is not None and vrf in self.excluded_vrfs:
+            raise ValueError(f"VRF {vrf} is excluded from the analysis")
+        self.vrf = vrf
         self.test_case = test_case_name
-        for hostname, host_facts in facts.items():
-            logger.debug(f"Adding host {hostname}")
-            self.hosts.append(Host(host_facts))
-        logger.debug("Hosts loaded")
+        # Every state is kept on the instance, so multiple analyzers can be used in one process
+        # (Eg.: different source/destination pairs or snapshots in the server, or in parallel threads)
+        self.graph_from_source = nx.DiGraph()
+        self.graph_from_destination = nx.DiGraph()
+        # False until the graphs are built from the hosts (see ingest_host_facts)
+        self.graphs_built = False
+        # The facts of some hosts may be missing (Eg.: stale hosts of a streamed gather).
+        # If True, a route towards a missing host ends at the router using it (rupture) instead of an error.
+        self.allow_missing_hosts = False
+        self.source: Union[SourceHost, None] = None
+        self.destination: Union[DestinationHost, None] = None
+        # Hosts reconfigured by the fixes since the last refresh
+        self.modified_hosts = set()
+        # Hosts which did not return their facts in time during a streamed gather (see from_stream)
+        self.stale_hosts = set()
         # Load source and destination network as netaddr
         try:
-            source = netaddr.IPNetwork(source)
-            destination = netaddr.IPNetwork(destination)
+            self.source_network = netaddr.IPNetwork(source)
+            self.destination_network = netaddr.IPNetwork(destination)
         except ValueError as e:
             logger.error("Source or destination network not correct {}".format(str(e)))
+            self.source_network, self.destination_network = source, destination
 
-        self.init_network(source, destination)
-        self.init_graph()
+    def freeze_initial_graphs(self) -> None:
+        """
+        Create a frozen copy of the initial graph.
+        This cannot be changed and can be compared against when the fixes applied.
+        :return: None
+        """
+        self.initial_graph_from_source = nx.freeze(self.graph_from_source.copy())
+        self.initial_graph_from_destination = nx.freeze(self.graph_from_destination.copy())
+
+    @classmethod
+    def create_partial(cls, source: str, destination: str, test_case_name: str, **kwargs) -> 'NetworkAnalyzer':
+        """
+        Create an analyzer without hosts, the hosts are added one by one (see ingest_host_facts).
+        The facts of some hosts may never arrive, a route towards a missing host ends at the router using it.
+        :param source: The source network
+        :param destination: The destination network
+        :param test_case_name: Name of the test case (usually filename)
+        :param kwargs: Other parameters of the analyzer (vrf, excluded_vrfs, fact_cache, excluded_networks)
+        :return: The analyzer without hosts
+        """
+        analyzer = cls.__new__(cls)
+        analyzer._setup(source, destination, test_case_name, kwargs.get('vrf'),
+                        kwargs.get('excluded_vrfs', EXCLUDED_VRFS), kwargs.get('fact_cache'),
+                        kwargs.get('excluded_networks', EXCLUDED_NETWORKS))
+        analyzer.allow_missing_hosts = True
+        analyzer.load_hosts({})
+        return analyzer
+
+    @classmethod
+    @trace.traced('NetworkAnalyzer.from_stream')
+    def from_stream(cls, source: str, destination: str, test_case_name: str, hosts: List[str] = None,
+                    host_timeout: float = HOST_TIMEOUT, on_update: Callable[['NetworkAnalyzer', str], None] = None,
+                    **kwargs) -> 'NetworkAnalyzer':
+        """
+        Gather the facts and build the analyzer while they arrive (see ansible_api.facts.stream_ios_facts).
+        Every host is parsed and indexed as soon as its facts arrive. When the source and destination routers
+        have arrived, the graphs are built and updated with every later host, so the network can be analyzed
+        (on_update) before the slow hosts finish. Hosts which do not return their facts in time are marked stale,
+        the routes towards them end at the router using them (rupture).
+        :param source: The source network
+        :param destination: The destination network
+        :param test_case_name: Name of the test case (usually filename)
+        :param hosts: Only gather the facts of these hosts. If None, facts of every router will be gathered
+        :param host_timeout: Seconds after a host which did not return its facts is marked stale
+        :param on_update: Called with the analyzer and the inventory hostname after every host
+            which arrived once the graphs are built (Eg.: to run detect_loop_in_route on the partial network)
+        :param kwargs: Other parameters of the analyzer (vrf, excluded_vrfs, fact_cache, excluded_networks)
+        :return: The analyzer of the gathered network. The stale and failed hosts are in stale_hosts.
+        :raises: NetworkSourceDestinationException if the source or destination network is not found
+        """
+        analyzer = cls.create_partial(source, destination, test_case_name, **kwargs)
+
+        def on_facts(hostname: str, host_facts: dict) -> None:
+            if analyzer.ingest_host_facts(hostname, host_facts) and on_update is not None:
+                on_update(analyzer, hostname)
 
-        # Create a copy of the initial graph.
-        # This will not be changed and can be compared against when the fixes applied.
-        self.initial_graph_from_source = self.graph_from_source
-        self.initial_graph_from_destination = self.graph_from_destination
+        result = stream_ios_facts(on_facts, hosts=hosts, host_timeout=host_timeout)
+        analyzer.stale_hosts = set(result.stale) | set(result.failed)
+        if analyzer.stale_hosts:
+            logger.warning(f"The analysis does not contain the stale hosts: {sorted(analyzer.stale_hosts)}")
+        if not analyzer.graphs_built:
+            # Raises the error of the missing network, the same as a full build
+            analyzer.build_graphs()
+        analyzer.freeze_initial_graphs()
+        return analyzer
 
-    def _refresh(self, facts: dict) -> None:
+    def ingest_host_facts(self, hostname: str, facts: dict) -> bool:
         """
-        Refresh the current instance.
-        Instead of calling __init__ directly (which is a bad practice), 
-        use this method to re-initialize the instance.
-        :param: facts: The fresh gathered facts from Ansible
+        Add (or update) a single host whose facts arrived (see create_partial).
+        Until the graphs can be built (the source and destination networks arrived),
+        the host is only parsed and indexed and the graphs are built again with every new host.
+        When the graphs are built, later hosts only update them (see apply_fact_delta).
+        :param hostname: The inventory hostname
+        :param facts: The facts of the host
+        :return: True if the graphs are built (the network can be analyzed), False if they are not yet.
+            The initial graphs are not frozen, call freeze_initial_graphs when every host arrived.
         """
-        self.hosts = []
+        if self.graphs_built:
+            self.apply_fact_delta({hostname: facts})
+            return True
+        if hostname in self.inventory_hosts:
+            self.interface_index.remove_host(self.inventory_hosts[hostname])
+        self.facts[hostname] = facts
+        self.inventory_hosts[hostname] = self.parse_host(hostname, facts)
+        self.interface_index.add_host(self.inventory_hosts[hostname])
+        self.hosts = list(self.inventory_hosts.values())
+        self.hosts_by_name = {host.hostname: host for host in self.hosts}
+        try:
+            self.build_graphs()
+        except NetworkSourceDestinationException as e:
+            logger.debug(f"Graphs of the partial network cannot be built yet: {e}")
+            return False
+        logger.info(f"Graphs built from {len(self.hosts)} hosts")
+        return True
+
+    def build_graphs(self) -> None:
+        """
+        Find the source and destination networks and build the graphs from scratch
+        :return: None
+        :raises: NetworkSourceDestinationException if the source or destination network cannot be found,
+            InterfaceNotFound if a next hop of a route cannot be found (unless allow_missing_hosts)
+        """
+        self.init_network(self.source_network, self.destination_network)
         self.graph_from_source = nx.DiGraph()
         self.graph_from_destination = nx.DiGraph()
+        self.init_graph()
+        self.graphs_built = True
+
+    @trace.traced()
+    def load_hosts(self, facts: dict) -> None:
+        """
+        Create a new host for every fact element and index their interfaces.
+        The interface index is rebuilt every time the hosts are loaded.
+        :param facts: The gathered facts from Ansible
+        :return: None
+        """
+        self.facts = dict(facts)
+        # Hosts by their name in the inventory (the keys of the facts)
+        self.inventory_hosts = {}
         for hostname, host_facts in facts.items():
             logger.debug(f"Adding host {hostname}")
-            self.hosts.append(Host(host_facts))
+            self.inventory_hosts[hostname] = self.parse_host(hostname, host_facts)
+        self.hosts = list(self.inventory_hosts.values())
+        self.hosts_by_name = {host.hostname: host for host in self.hosts}
         logger.debug("Hosts loaded")
+        self.interface_index = InterfaceIndex(self.hosts, self.vrf, self.excluded_networks)
+
+    def parse_host(self, hostname: str, facts: dict) -> Host:
+        """
+        Create the Host of the facts, or reuse the Host parsed by the fact cache if the facts did not change
+        :param hostname: The inventory hostname
+        :param facts: The facts of the host
+        :return: The Host object
+        """
+        if self.fact_cache is not None:
+            return self.fact_cache.get_host(hostname, facts)
+        return Host(facts)
+
+    def update_network(self, facts: dict) -> None:
+        """
+        Update the network with freshly gathered facts.
+        Only the hosts whose facts changed will be reloaded (see apply_fact_delta).
+        :param facts: The fresh gathered facts from Ansible
+        :return: None
+        """
+        # The fact cache returns the same object for an unchanged host, so the comparison is usually skipped
+        delta = {hostname: host_facts for hostname, host_facts in facts.items()
+                 if self.facts.get(hostname) is not host_facts and self.facts.get(hostname) != host_facts}
+        logger.debug(f"Changed hosts: {list(delta)}")
+        self.apply_fact_delta(delta)
+
+    @trace.traced()
+    def apply_fact_delta(self, delta: dict) -> None:
+        """
+        Update the network with the changed facts of some hosts instead of rebuilding everything.
+        Only the changed Host objects are recreated. The graph edges are recalculated only for the changed hosts
+        and for the hosts which have a route towards an IP address of a changed host.
+        :param delta: The changed facts (inventory hostname -> facts). If the facts are None, the host is removed.
+        :return: None
+        """
+        if not delta:
+            return
+        old_hosts = [self.inventory_hosts[hostname] for hostname in delta if hostname in self.inventory_hosts]
+        new_hosts = {hostname: self.parse_host(hostname, host_facts) for hostname, host_facts in delta.items()
+                     if host_facts is not None}
+        changed_hosts = old_hosts + list(new_hosts.values())
+        # Edges of other hosts depend on the changed hosts through their next-hop addresses
+        changed_addresses = {interface.ip for host in changed_hosts for interface in host.interfaces
+                             if interface.address is not None}
+        affected = {host.hostname for host in changed_hosts}
+        for address in changed_addresses:
+            affected.update(self.next_hop_users.get(address, ()))
+        logger.debug(f"Hosts affected by the changes: {sorted(affected)}")
+
+        for host in old_hosts:
+            self.interface_index.remove_host(host)
+        for hostname in affected:
+            if hostname in self.hosts_by_name:
+                self.remove_host_edges(self.hosts_by_name[hostname])
+        for hostname, host_facts in delta.items():
+            if host_facts is None:
+                self.inventory_hosts.pop(hostname, None)
+                self.facts.pop(hostname, None)
+            else:
+                self.facts[hostname] = host_facts
+                self.inventory_hosts[hostname] = new_hosts[hostname]
+                self.interface_index.add_host(new_hosts[hostname])
+        self.hosts = list(self.inventory_hosts.values())
+        self.hosts_by_name = {host.hostname: host for host in self.hosts}
+
         self.init_network(self.source.network, self.destination.network)
-        self.init_graph()
+        for hostname in affected:
+            if hostname in self.hosts_by_name:
+                self.add_host_edges(self.hosts_by_name[hostname])
+        # A full rebuild would not contain nodes without edges
+        for graph in (self.graph_from_source, self.graph_from_destination):
+            graph.remove_nodes_from([node for node, degree in list(graph.degree()) if degree == 0])
+        logger.debug(f"Network updated, {len(affected)} hosts recalculated")
+
+    def copy(self) -> 'NetworkAnalyzer':
+        """
+        Copy the analyzer, so the network of the copy can be updated without changing this analyzer.
+        The Host objects are shared, they are replaced (not changed) when the network is updated.
+        :return: The new analyzer
+        """
+        analyzer = self._copy_hosts()
+        analyzer.interface_index = self.interface_index.copy()
+        analyzer.graph_from_source = self.graph_from_source.copy()
+        analyzer.graph_from_destination = self.graph_from_destination.copy()
+        analyzer.host_edges = dict(self.host_edges)
+        analyzer.next_hop_users = {next_hop: set(users) for next_hop, users in self.next_hop_users.items()}
+        return analyzer
+
+    def _copy_hosts(self) -> 'NetworkAnalyzer':
+        """
+        Shallow copy of the analyzer with its own host containers (the Host objects are shared)
+        :return: The new analyzer
+        """
+        analyzer = copy.copy(self)
+        analyzer.facts = dict(self.facts)
+        analyzer.inventory_hosts = dict(self.inventory_hosts)
+        analyzer.hosts = list(self.hosts)
+        analyzer.hosts_by_name = dict(self.hosts_by_name)
+        analyzer.modified_hosts = set()
+        return analyzer
+
+    def for_vrf(self, vrf: Union[str, None], interface_index: InterfaceIndex = None) -> 'NetworkAnalyzer':
+        """
+        Create the analyzer of the same source/destination pair in another VRF, without loading the hosts again
+        :param vrf: The VRF to analyze, None for the global routing table
+        :param interface_index: The interface index of the VRF. If None, it is built from the hosts
+        :return: The analyzer of the VRF
+        :raises: NetworkSourceDestinationException if the source or destination network is not in the VRF
+        """
+        if vrf is not None and vrf in self.excluded_vrfs:
+            raise ValueError(f"VRF {vrf} is excluded from the analysis")
+        analyzer = self._copy_hosts()
+        analyzer.vrf = vrf
+        analyzer.interface_index = interface_index if interface_index is not None \
+            else InterfaceIndex(self.hosts, vrf, self.excluded_networks)
+        analyzer.graph_from_source = nx.DiGraph()
+        analyzer.graph_from_destination = nx.DiGraph()
+        analyzer.init_network(self.source.network, self.destination.network)
+        analyzer.init_graph()
+        analyzer.freeze_initial_graphs()
+        return analyzer
+
+    @trace.traced()
+    def vrf_analyzers(self) -> Dict[Union[str, None], 'NetworkAnalyzer']:
+        """
+        Get the analyzers of every VRF (except the excluded ones) which contains the source and destination network.
+        The interface indexes of the VRFs are built in a single pass over the loaded hosts.
+        :return: Dictionary of VRF name (None for the global routing table) -> analyzer. This analyzer is used
+            for its own VRF.
+        """
+        analyzers = {}
+        for vrf, index in build_vrf_indexes(self.hosts, self.excluded_vrfs, self.excluded_networks).items():
+            if vrf == self.vrf:
+                analyzers[vrf] = self
+                continue
+            try:
+                analyzers[vrf] = self.for_vrf(vrf, index)
+            except (NetworkSourceDestinationException, NetworkMultipleDefinitionException) as e:
+                logger.debug(f"VRF {vrf} is not analyzed: {e}")
+        return analyzers
+
+    @trace.traced()
+    def check_vrfs(self, max_workers: int = None) -> Dict[Union[str, None], dict]:
+        """
+        Check the loops and ruptures of the source/destination pair in every VRF concurrently
+        :param max_workers: Maximum number of threads (see ThreadPoolExecutor)
+        :return: Dictionary of VRF name (None for the global routing table) -> state (see detect_loop_in_route)
+        """
+        analyzers = self.vrf_analyzers()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            states = executor.map(lambda analyzer: analyzer.detect_loop_in_route(), analyzers.values())
+            return dict(zip(analyzers, states))
+
+    @trace.traced()
+    def simulate_change_set(self, change_set: ChangeSet) -> 'NetworkAnalyzer':
+        """
+        Apply a change set to a copy of the network without configuring any device.
+        Only the graph edges of the changed hosts (and the hosts routing through them) are recalculated.
+        :param change_set: The planned changes
+        :return: The analyzer of the simulated network
+        """
+        # The change sets are keyed by the hostname of the devices, the facts by the inventory hostname
+        inventory_hostnames = {host.hostname: hostname for hostname, host in self.inventory_hosts.items()}
+        changed_facts = change_set.apply_to_facts(
+            {host.hostname: self.facts[hostname] for hostname, host in self.inventory_hosts.items()}
+        )
+        simulation = self.copy()
+        simulation.apply_fact_delta({inventory_hostnames[hostname]: host_facts
+                                     for hostname, host_facts in changed_facts.items()})
+        logger.debug(f"Simulated change set on {sorted(changed_facts)}")
+        return simulation
+
+    @staticmethod
+    def is_fixed(network_state: dict) -> bool:
+        """
+        Check if neither direction is affected by a problem
+        :param network_state: The state of the network (see detect_loop_in_route)
+        :return: True if the network is fixed, False otherwise
+        """
+        return network_state['source']['affected'] is False and network_state['destination']['affected'] is False
 
+    @trace.traced()
     def init_graph(self) -> None:
         """
         Create an initial graph of the network
         Go through the network hosts
         :return: None
         """
-        edges_from_source = []
-        edges_from_destination = []
+        # Edges added by each host, so they can be updated one host at a time
+        self.host_edges = {}
+        # Next-hop IP address -> hostnames having a route with that next hop
+        self.next_hop_users = {}
         for host in self.hosts:
-            # Get all routes of a host
-            for table in host.routes:
-                if 'vrf' not in table:
-                    source, destination = self.create_route_edge(host, table)
-                    edges_from_source += source
-                    edges_from_destination += destination
-            for interface in host.interfaces:
-                edge = self.create_pc_edge(host, interface)
-                if edge:
-                    edges_from_source.append(edge)
-                    edges_from_destination.append(tuple(reversed(edge)))
+            self.add_host_edges(host)
+        logger.debug("Network initialization complete")
+
+    def add_host_edges(self, host: Host) -> None:
+        """
+        Create the graph edges of a host (its routes and the PC edges) and add them to the graphs
+        :param host: The Host object
+        :return: None
+        """
+        # Get all routes of a host
+        edges_from_source, edges_from_destination = self.create_route_edge(host)
+        for interface in host.interfaces:
+            edge = self.create_pc_edge(host, interface)
+            if edge:
+                edges_from_source.append(edge)
+                edges_from_destination.append(tuple(reversed(edge)))
         for source, destination in edges_from_source:
             self.graph_from_source.add_edge(source, destination, color='blue', weight=2, style='-',
                                             label='Route from source to destination')
         for source, destination in edges_from_destination:
             self.graph_from_destination.add_edge(source, destination, color='orange', weight=2, style='-',
                                                  label='Route from destination to source')
-        logger.debug("Network initialization complete")
+        self.host_edges[host.hostname] = (edges_from_source, edges_from_destination)
+        for next_hop in host.get_route_table(self.vrf).next_hops:
+            self.next_hop_users.setdefault(next_hop, set()).add(host.hostname)
+
+    def remove_host_edges(self, host: Host) -> None:
+        """
+        Remove the graph edges which were added by a host
+        :param host: The Host object
+        :return: None
+        """
+        edges_from_source, edges_from_destination = self.host_edges.pop(host.hostname, ([], []))
+        self.graph_from_source.remove_edges_from(edges_from_source)
+        self.graph_from_destination.remove_edges_from(edges_from_destination)
+        for next_hop in host.get_route_table(self.vrf).next_hops:
+            self.next_hop_users.get(next_hop, set()).discard(host.hostname)
 
     def init_network(self, source: netaddr.IPNetwork, destination: netaddr.IPNetwork) -> None:
         """
@@ -114,24 +463,18 @@ class NetworkAnalyzer:
         :return: None
         :raises: NetworkSourceDestinationException if the source or destination network cannot be found
         """
-        source_found = False
-        destination_found = False
-        for host in self.hosts:
-            for interface in host.interfaces:
-                net = check_source_destination(interface, source, destination)
-                if net == "source" and source_found:
-                    raise NetworkMultipleDefinitionException(
-                        f"The network {str(destination)} is defined multiple times in the network")
-                elif net == "source":
-                    self.source = SourceHost(source, host.facts)
-                    source_found = True
-                elif net == "destination" and destination_found:
-                    raise NetworkMultipleDefinitionException(
-                        f"The network {str(destination)} is defined multiple times in the network")
-                elif net == "destination":
-                    self.destination = DestinationHost(destination, host.facts)
-                    destination_found = True
-        if source_found and destination_found:
+        # The source/destination network should be configured on exactly one interface
+        source_interfaces = self.interface_index.find_by_network(source)
+        destination_interfaces = self.interface_index.find_by_network(destination)
+        if len(source_interfaces) > 1:
+            raise NetworkMultipleDefinitionException(
+                f"The network {str(source)} is defined multiple times in the network")
+        if len(destination_interfaces) > 1:
+            raise NetworkMultipleDefinitionException(
+                f"The network {str(destination)} is defined multiple times in the network")
+        if source_interfaces and destination_interfaces:
+            self.source = SourceHost(source, source_interfaces[0][0].facts)
+            self.destination = DestinationHost(destination, destination_interfaces[0][0].facts)
             logger.info("Source and destination network found!")
         else:
             raise NetworkSourceDestinationException("Network source or destination not found in the network!")
@@ -154,46 +497,39 @@ class NetworkAnalyzer:
             # Return edge tuple based on direction
             return (host.hostname, dest_host.hostname) if forward is True else (dest_host.hostname, host.hostname)
 
-    def create_route_edge(self, host: Host, table: dict) \
+    def create_route_edge(self, host: Host) \
             -> Tuple[Union[List[Tuple[str, str]], List], Union[List[Tuple[str, str]], List]]:
         """
-        Create a graph edge for a route
+        Create graph edges for the routes of a host
         :param host: The Host object
-        :param table: The route table
         :return: tuple with graph edges (edges from source, edges from destination)
         """
-        # Filter VRF routes. In our environment, VRF routes only represent management network access
-        # which we would like to filter from our real network.
+        # Only the routes of the analyzed VRF are used (see get_forwarding_routes)
         edges_from_source = []
         edges_from_destination = []
-        for route in table['address_families']:
-            # Filter routes based on destination.
-            # If the current route is not destined towards our destination network, ignore it.
-            forward_router_address = route['routes'][0]['next_hops'][0]['forward_router_address']
-            dest = netaddr.IPNetwork(route['routes'][0]['dest'])
-            # Check destination network netmask!
-            # Source or destination network should be contained by current routes destination network
-            # If it is not contained, ignore this route.
-            if check_network_contains_network(self.destination.network, dest) \
-                    or check_network_contains_network(self.source.network, dest):
-                # Need to check if the current route next-hop interface is enabled.
-                # Also need to check if the current route interface is enabled on the other router as well.
-                # If not enabled or netmask is smaller don't add the route
-                # ! Routes returned by Ansible is always there, even if the actual routing table does not contain it !
-                if get_interface_status_from_route(host, forward_router_address) and \
-                        get_interface_status_from_ip(self.hosts, forward_router_address):
-                    if check_network_contains_network(self.destination.network, dest):
-                        edges_from_source.append(self.create_graph_edge(host, forward_router_address, forward=True))
-                        logger.debug(f"Adding forward edge {edges_from_source[-1]} for host {host.hostname}")
-                    if check_network_contains_network(self.source.network, dest):
-                        edges_from_destination.append(
-                            self.create_graph_edge(host, forward_router_address, forward=True)
-                        )
-                        logger.debug(f"Adding reverse edge {edges_from_destination[-1]} for host {host.hostname}")
+        for route in self.get_forwarding_routes(host, self.destination.network):
+            edge = self.create_graph_edge(host, route.next_hop, forward=True)
+            if edge:
+                edges_from_source.append(edge)
+                logger.debug(f"Adding forward edge {edge} for host {host.hostname}")
+        for route in self.get_forwarding_routes(host, self.source.network):
+            edge = self.create_graph_edge(host, route.next_hop, forward=True)
+            if edge:
+                edges_from_destination.append(edge)
+                logger.debug(f"Adding reverse edge {edge} for host {host.hostname}")
         logger.debug(f"Edges for host {host.hostname}: {edges_from_source} {edges_from_destination}")
         return edges_from_source, edges_from_destination
 
-    def create_pc_edge(self, host: Host, interface: dict) -> Union[Tuple[str, str], None]:
+    def get_forwarding_routes(self, host: Host, network: netaddr.IPNetwork) -> List[Route]:
+        """
+        Get the routes which a host uses to forward traffic towards a network (see utils.graph.get_forwarding_routes)
+        :param host: The Host object
+        :param network: The network where the traffic is forwarded to
+        :return: List of routes used for forwarding, empty if the host cannot forward towards the network
+        """
+        return get_forwarding_routes(self.interface_index, host, network, self.allow_missing_hosts)
+
+    def create_pc_edge(self, host: Host, interface: Interface) -> Union[Tuple[str, str], None]:
         """
         Create static PC nodes in the graph. These represent the computers used in network troubleshooting.
         PC-S will be the Source PC (this will be placed at the source network)
@@ -202,26 +538,26 @@ class NetworkAnalyzer:
         :param interface: The interface of the router which might be connected to the PC
         :return: tuple with an edge (router hostname, PC hostname)
         """
-        if 'ipv4' in interface:
-            if netaddr.IPNetwork(interface['ipv4'][0]['address']) == self.source.network:
+        if interface.address is not None:
+            if interface_in_network(interface, self.source.network):
                 return 'PC-S', host.hostname
-            elif netaddr.IPNetwork(interface['ipv4'][0]['address']) == self.destination.network:
+            elif interface_in_network(interface, self.destination.network):
                 return host.hostname, 'PC-D'
         return None
 
+    @trace.traced()
     def detect_loop_in_route(self) -> dict:
         """
         Detect a loop in the routes.
         :return: Return a dictionary of loops in the source->destination and destination->source route
         """
-        # Check if the current graph contains a loop.
+        # Check if the current graph contains a loop reachable from the source (destination) host.
+        # Only the loop closest to the start of the route is checked, it is the first one the traffic enters.
         loops = {}
-        source_loop = None
-        destination_loop = None
-        for loop in nx.simple_cycles(self.graph_from_source):
-            source_loop = loop.copy()
-        for loop in nx.simple_cycles(self.graph_from_destination):
-            destination_loop = loop.copy()
+        source_loops = find_loops(self.graph_from_source, self.source.hostname)
+        destination_loops = find_loops(self.graph_from_destination, self.destination.hostname)
+        source_loop = source_loops[0] if source_loops else None
+        destination_loop = destination_loops[0] if destination_loops else None
         # The source_loop or destination_loop var is empty if there are no loops in the network
         loops['source'] = check_loop_type(
             graph=self.graph_from_source, loop=source_loop,
@@ -242,19 +578,16 @@ class NetworkAnalyzer:
         :param ip_address: The IP address to search for
         :return: The Host object
         """
-        for host in self.hosts:
-            for interface in host.interfaces:
-                # If an interface does not have an IP address, it will not have an 'ipv4' key
-                if 'ipv4' in interface:
-                    # Check if the current IP address (network) is the same as the received ip_address.
-                    if compare_cidr_and_ip_address(interface['ipv4'][0]['address'], ip_address):
-                        return host
+        match = self.interface_index.find_by_address(ip_address)
+        if match is not None:
+            return match[0]
         # Raise error if the current IP address cannot be found in the network.
         raise NodeNotFoundException(f"Not found {ip_address}")
 
+    @trace.traced()
     def plot_graph(self, filename: str) -> None:
         """
-        Plot the graph to a file
+        Plot the graph to a file. The format is selected by the extension (PNG, SVG, PDF, DOT or JSON).
         Used for debugging and creating visualizations for thesis.
         Removed node: should be red
         Added node: should be dotted and green
@@ -274,45 +607,8 @@ class NetworkAnalyzer:
         tmp_graph = nx.compose(source_tmp_graph, destination_tmp_graph)
         logger.debug(f"Temporary graph edges: {tmp_graph.edges(data=True)}")
 
-        # Get the attributes of the nodes
-        colors = nx.get_edge_attributes(tmp_graph, 'color').values()
-        weights = nx.get_edge_attributes(tmp_graph, 'weight').values()
-        styles = nx.get_edge_attributes(tmp_graph, 'style').values()
-
-        logger.debug(f"Colors: {colors}")
-        logger.debug(f"Weights: {weights}")
-        logger.debug(f"Styles: {styles}")
-
-        node_color = {
-            'PC-S': 'tab:green',
-            'PC-D': 'tab:red',
-        }
-
-        node_colors = [node_color.get(node, 'tab:blue') for node in tmp_graph.nodes()]
-
-        node_size = {
-            'PC-S': 1000,
-            'PC-D': 1000,
-        }
-        node_sizes = [node_size.get(node, 800) for node in tmp_graph.nodes()]
-
-        # Add title to plot
-        plt.figure(3, figsize=(6, 6))
-        plt.suptitle(f"Summary of {self.test_case}")
-        plt.title(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-
-        pos = nx.circular_layout(tmp_graph, scale=1)
-        nx.draw_networkx_nodes(
-            tmp_graph, pos=pos, node_color=node_colors, node_size=node_sizes, alpha=1
-        )
-        nx.draw_networkx_edges(
-            tmp_graph, pos=pos, edge_color=colors, width=list(weights), style=list(styles),
-            arrowsize=20, connectionstyle='arc3, rad = 0.1'
-        )
-        nx.draw_networkx_labels(tmp_graph, pos=pos, font_size=10, font_color='whitesmoke')
-
-        # Show the graph
-        plt.savefig(filename)
+        render_graph(tmp_graph, filename, title=f"Summary of {self.test_case}",
+                     subtitle=f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M')}")
         logger.info(f"Plot saved to file {filename}!")
 
     def get_shortest_path(self) -> list:
@@ -322,91 +618,155 @@ class NetworkAnalyzer:
         """
         return nx.shortest_path(self.graph_from_source, self.source.hostname, self.destination.hostname)
 
-    def refresh_network(self) -> None:
+    @trace.traced()
+    def apply_change_set(self, change_set: ChangeSet) -> None:
         """
-        Gather facts and reinitialize network
+        Apply the planned changes of every host in a single Ansible run and mark the hosts as modified.
+        Only the modified hosts are gathered again when the fix is checked.
+        :param change_set: The changes to apply
         :return: None
         """
-        results = gather_ios_facts()
-        self._refresh(results)
+        logger.debug(f"Applying change set: {change_set}")
+        run_change_set(change_set, data_dir=os.path.abspath('../ansible/'))
+        self.modified_hosts.update(change_set.hosts)
 
+    @trace.traced()
+    async def apply_change_set_async(self, change_set: ChangeSet, semaphore: asyncio.Semaphore = None,
+                                     timeout: float = ANSIBLE_TIMEOUT) -> None:
+        """
+        Async variant of apply_change_set (single Ansible run), it does not block the event loop of the caller
+        :param change_set: The changes to apply
+        :param semaphore: Concurrency cap shared with other runs (see ansible_api.runner.limit_concurrency)
+        :param timeout: Seconds after the run is cancelled (AnsibleTimeoutException)
+        :return: None
+        """
+        logger.debug(f"Applying change set: {change_set}")
+        await run_change_set_async(change_set, data_dir=os.path.abspath('../ansible/'), semaphore=semaphore,
+                                   timeout=timeout)
+        self.modified_hosts.update(change_set.hosts)
+
+    @trace.traced()
+    def refresh_network(self, hosts: List[str] = None) -> None:
+        """
+        Gather facts and update the network with the hosts whose facts changed.
+        With a fact cache, only the hosts whose configuration fingerprint changed are gathered.
+        :param hosts: Gather facts only from these hosts (in a single Ansible run).
+            If None, facts are gathered from every host
+        :return: None
+        """
+        if self.fact_cache is not None:
+            results = self.fact_cache.gather(hosts)
+        else:
+            results = gather_ios_facts(hosts=hosts)
+        self._update_refreshed_network(hosts, results)
+
+    @trace.traced()
+    async def refresh_network_async(self, hosts: List[str] = None, semaphore: asyncio.Semaphore = None,
+                                    timeout: float = ANSIBLE_TIMEOUT) -> None:
+        """
+        Async variant of refresh_network, it does not block the event loop of the caller
+        :param hosts: Gather facts only from these hosts (in a single Ansible run).
+            If None, facts are gathered from every host
+        :param semaphore: Concurrency cap shared with other runs (see ansible_api.runner.limit_concurrency)
+        :param timeout: Seconds after the run is cancelled (AnsibleTimeoutException)
+        :return: None
+        """
+        if self.fact_cache is not None:
+            # The fact cache runs its playbooks synchronously
+            results = await asyncio.get_running_loop().run_in_executor(None, self.fact_cache.gather, hosts)
+        else:
+            results = await gather_ios_facts_async(hosts=hosts, semaphore=semaphore, timeout=timeout)
+        self._update_refreshed_network(hosts, results)
+
+    def _update_refreshed_network(self, hosts: Union[List[str], None], results: dict) -> None:
+        """
+        Update the network with the gathered facts
+        :param hosts: The hosts whose facts were requested, None if every host was requested
+        :param results: The gathered facts
+        :return: None
+        """
+        missing = sorted(set(hosts or ()) - set(results))
+        if missing:
+            logger.warning(f"Facts of {missing} were not gathered, the analysis uses their previous facts")
+        self.update_network(results)
+
+    @trace.traced()
     def check_fix(self) -> bool:
         """
         Check the applied fix. It returns True if the fix is applied correctly.
         :return: True if the network is fixed, False otherwise.
         """
-        self.refresh_network()
-        network_state = self.detect_loop_in_route()
-        if network_state['source']['affected'] is False and network_state['destination']['affected'] is False:
-            return True
-        return False
+        # Facts of the hosts which were not reconfigured can not change because of the fix
+        self.refresh_network(sorted(self.modified_hosts) or None)
+        self.modified_hosts.clear()
+        return self.is_fixed(self.detect_loop_in_route())
 
-    def fix_rupture(self) -> bool:
+    @trace.traced()
+    async def check_fix_async(self, semaphore: asyncio.Semaphore = None, timeout: float = ANSIBLE_TIMEOUT) -> bool:
         """
-        Fix ruptures in the network
-        This function will detect multiple types of ruptures.
-        First it will scan for disabled interfaces in the source->destination and destination->source direction.
-        If this fix is not enough (the network still has ruptures) it will try to find missing routes in the network.
+        Async variant of check_fix, the modified hosts are gathered in a single Ansible run
+        :param semaphore: Concurrency cap shared with other runs (see ansible_api.runner.limit_concurrency)
+        :param timeout: Seconds after the run is cancelled (AnsibleTimeoutException)
         :return: True if the network is fixed, False otherwise.
         """
-        logger.debug("Init fixing rupture")
+        await self.refresh_network_async(sorted(self.modified_hosts) or None, semaphore, timeout)
+        self.modified_hosts.clear()
+        return self.is_fixed(self.detect_loop_in_route())
+
+    def plan_interface_fix(self) -> ChangeSet:
+        """
+        Plan the first fix of a rupture: enable the disabled interfaces
+        which are used in the source->destination or destination->source direction.
+        :return: The change set enabling the interfaces (empty if every used interface is enabled)
+        """
         # Check if configured interfaces are up
         # Collect down interfaces (which has in IP address configured)
         all_down_interfaces = {}
         for host in self.hosts:
-            down_interfaces = check_interface_status(host, self.source.network, self.destination.network)
+            down_interfaces = check_interface_status(host, self.source.network, self.destination.network, self.vrf)
             if down_interfaces:
                 all_down_interfaces[host.hostname] = down_interfaces
         logger.debug(f"Down interfaces: {all_down_interfaces}")
         # Enable all filtered down interface
-        enabled_at_least_one_interface = False
+        change_set = ChangeSet()
         for hostname, down_interfaces in all_down_interfaces.items():
             logger.debug(f"Enabling interfaces {down_interfaces} on host {hostname}")
-            run_task(
-                role='cisco-config-interfaces', hosts=hostname,
-                role_vars={'interfaces': down_interfaces}, data_dir=os.path.abspath('../ansible/')
-            )
-            enabled_at_least_one_interface = True
-        if enabled_at_least_one_interface:
-            logger.debug("Enabled at least one interface")
-            # Check if the enabling helped to solve the rupture.
-            # We need to gather ios facts again and recreate the NetworkAnalyzer instance.
-            fixed = self.check_fix()
-            if fixed:
-                logger.info("Interfaces enabled - network fixed")
-                return True
-        logger.info("Continuing with fixes - enabling interfaces was not enough")
+            change_set.add_interfaces(hostname, down_interfaces)
+        return change_set
+
+    def plan_route_fix(self) -> ChangeSet:
+        """
+        Plan the second fix of a rupture: add the missing routes and replace the routes with incorrect netmask
+        at the last node before the rupture in both directions.
+        :return: The change set of the route changes (empty if no fix was found)
+        """
         missing_routes = {}
-        # Check if there are missing routes
+        # Check if there are missing routes, one walk in each direction
         # Forward route
-        rupture_node_source = self.traverse_route(self.graph_from_source, self.source.hostname, 'PC-D')
-        reverse_rupture_node_source = self.traverse_route(self.graph_from_source.reverse(copy=True),
-                                                          self.destination.hostname, 'PC-S')
-        missing_routes['source'] = (rupture_node_source, reverse_rupture_node_source)
-        logger.debug(f"Rupture in forward route: Between {rupture_node_source} and {reverse_rupture_node_source}")
+        missing_routes['source'] = self.locate_rupture(self.graph_from_source, self.source.hostname, 'PC-D')
+        logger.debug(f"Rupture in forward route: Between {missing_routes['source']}")
 
         # Reverse route
-        rupture_node_destination = self.traverse_route(self.graph_from_destination, self.destination.hostname, 'PC-S')
-        reverse_rupture_node_destination = self.traverse_route(self.graph_from_destination.reverse(copy=True),
-                                                               self.source.hostname, 'PC-D')
-        missing_routes['destination'] = (rupture_node_destination, reverse_rupture_node_destination)
-        logger.debug(
-            f"Rupture in reverse route: Between {rupture_node_destination} and {reverse_rupture_node_destination}"
-        )
-        fixed_route = False
+        missing_routes['destination'] = self.locate_rupture(self.graph_from_destination, self.destination.hostname,
+                                                            'PC-S')
+        logger.debug(f"Rupture in reverse route: Between {missing_routes['destination']}")
+        # Route changes of both directions are applied together
+        change_set = ChangeSet()
         logger.debug(f"Missing routes: {missing_routes}")
+        # The interfaces and routes of the last nodes of both directions are checked in one sweep
+        rupture_hosts = {edges[0]: self.get_host_from_hostname(edges[0])
+                         for edges in missing_routes.values() if None not in edges}
+        interface_routes = find_missing_interface_routes(list(rupture_hosts.values()), self.source.network,
+                                                         self.destination.network, self.vrf)
         for direction, edges in missing_routes.items():
             if None not in edges:
                 logger.debug(f"Missing route in {direction} between {edges}")
-                source_host = self.get_host_from_hostname(edges[0])
                 destination_host = self.get_host_from_hostname(edges[1])
-                source_ips_without_route, routes_with_incorrect_netmask = check_missing_interface_route(
-                    source_host, self.source.network, self.destination.network
-                )
+                source_ips_without_route, routes_with_incorrect_netmask = interface_routes[edges[0]]
                 logger.debug(f"Source missing routes: {source_ips_without_route}")
                 logger.debug(f"Routes with incorrect netmask: {routes_with_incorrect_netmask}")
 
-                next_hop_addr = get_interface_ip_within_ip_network(destination_host,
+                next_hop_addr = get_interface_ip_within_ip_network(self.interface_index, destination_host,
                                                                    source_ips_without_route)
                 replaced_routes = []
                 for route, next_hop in routes_with_incorrect_netmask:
@@ -444,35 +804,64 @@ class NetworkAnalyzer:
                 logger.debug(f"Replaced routes: {replaced_routes}")
                 if replaced_routes:
                     logger.info("Replacing routes with incorrect netmask")
-                    run_task(
-                        role='cisco-config-static_routes', hosts=source_host.hostname,
-                        role_vars={'routes': replaced_routes},
-                        data_dir=os.path.abspath('../ansible/')
-                    )
-                    fixed_route = True
+                    change_set.add_routes(edges[0], replaced_routes, vrf=self.vrf)
                 if next_hop_addr:
                     logger.debug(f"Destination missing routes: {next_hop_addr}")
-                    run_task(
-                        role='cisco-config-static_routes', hosts=source_host.hostname,
-                        role_vars={'routes': [
-                            {
-                                'dest_address': str(
-                                    self.destination.network.cidr if direction == 'source'
-                                    else self.source.network.cidr),
-                                'next_hop': str(netaddr.IPNetwork(next_hop_addr).ip)
-                            }
-                        ]},
-                        data_dir=os.path.abspath('../ansible/')
-                    )
-                    fixed_route = True
+                    change_set.add_routes(edges[0], [
+                        {
+                            'dest_address': str(
+                                self.destination.network.cidr if direction == 'source'
+                                else self.source.network.cidr),
+                            'next_hop': str(netaddr.IPNetwork(next_hop_addr).ip)
+                        }
+                    ], vrf=self.vrf)
                 else:
                     logger.debug("No next hop address found. Cannot be fixed!")
-        if fixed_route:
-            fixed = self.check_fix()
-            if fixed:
-                logger.info("Missing route fixed")
-                return True
-        return False
+        return change_set
+
+    @trace.traced()
+    def plan_rupture_fix(self) -> Tuple[ChangeSet, bool]:
+        """
+        Plan the fix of a rupture and check it in a simulation.
+        First the disabled interfaces are enabled. If this is not enough in the simulation,
+        the route fixes are planned on the simulated network and added to the same change set.
+        :return: Tuple of the change set and True if the simulated network is fixed with it
+        """
+        change_set = self.plan_interface_fix()
+        simulation = self.simulate_change_set(change_set) if change_set else self
+        if change_set and self.is_fixed(simulation.detect_loop_in_route()):
+            logger.info("Enabling interfaces fixes the network in the simulation")
+            return change_set, True
+        logger.debug("Continuing with fixes - enabling interfaces is not enough")
+        route_change_set = simulation.plan_route_fix()
+        if not route_change_set:
+            return change_set, False
+        change_set.update(route_change_set)
+        return change_set, self.is_fixed(self.simulate_change_set(change_set).detect_loop_in_route())
+
+    @trace.traced()
+    def fix_rupture(self) -> bool:
+        """
+        Fix ruptures in the network
+        This function will detect multiple types of ruptures.
+        First it will scan for disabled interfaces in the source->destination and destination->source direction.
+        If this fix is not enough (the network still has ruptures) it will try to find missing routes in the network.
+        The fix is simulated first and only applied if it fixes the simulated network.
+        :return: True if the network is fixed, False otherwise.
+        """
+        logger.debug("Init fixing rupture")
+        change_set, simulated = self.plan_rupture_fix()
+        if not change_set:
+            logger.warning("No possible fix found!")
+            return False
+        if not simulated:
+            logger.warning(f"The planned fix does not fix the simulated network, it is not applied: {change_set}")
+            return False
+        self.apply_change_set(change_set)
+        fixed = self.check_fix()
+        if fixed:
+            logger.info("Rupture fixed")
+        return fixed
 
     def get_host_from_hostname(self, hostname: str) -> Host:
         """
@@ -480,90 +869,177 @@ class NetworkAnalyzer:
         :param hostname: The hostname of the host
         :return: The Host object
         """
-        for host in self.hosts:
-            if host.hostname == hostname:
-                return host
+        return self.hosts_by_name.get(hostname)
 
     def traverse_route(self, graph: nx.DiGraph, source_node: str, dest_node: str) -> Union[str, None]:
         """
         Traverse the graph from source to destination node and find the last node in the route.
         If the destination node is found, None will be returned.
-        Otherwise, the last node name will be returned
+        Otherwise, the last node name will be returned (the last node before a loop if the route loops)
         :param graph: The graph to traverse
         :param source_node: The source where the traverse should be started
         :param dest_node: The destination which should be reached
         :return: Last node or None
         """
-        logger.debug(f"Traversing {source_node}")
-        neighbor = [n for n in graph.neighbors(source_node)]
-        if not neighbor:
-            logger.debug("Last node with neighbor found!")
-            return source_node
-        if neighbor[0] == dest_node:
-            logger.debug(f"Found destination ({neighbor[0]}), no route missing!")
-            return None
-        return self.traverse_route(graph, neighbor[0], dest_node)
+        return self.get_last_node(walk_route(graph, source_node, dest_node), dest_node)
 
-    def check_and_fix_loop(self, last_node_in_loop: str, last_node_from_dest: str,
-                           destination_network: Union[netaddr.IPNetwork, str]) -> bool:
+    @staticmethod
+    def get_last_node(walk: RouteWalk, dest_node: str) -> Union[str, None]:
         """
-        Helper function to check a node if it is where the loop is sourced from.
-        Fix the route if this is the correct node, return False if it is not the right node
+        Get the last node of a walked route (see traverse_route)
+        :param walk: The walked route
+        :param dest_node: The destination which should be reached
+        :return: Last node or None
+        """
+        logger.debug(f"Traversed {' -> '.join(walk.hops)}")
+        if walk.rupture is not None:
+            logger.debug(f"Last node with neighbor found: {walk.rupture}")
+            return walk.rupture
+        if walk.loop_entry is not None:
+            logger.debug(f"Route loops at {walk.loop_entry}, last node before the loop: {walk.hops[-1]}")
+            return walk.hops[-1]
+        logger.debug(f"Found destination ({dest_node}), no route missing!")
+        return None
+
+    def locate_rupture(self, graph: nx.DiGraph, source_node: str,
+                       dest_node: str) -> Tuple[Union[str, None], Union[str, None]]:
+        """
+        Find where a route breaks and the neighbor where it should continue, with a single walk of the route.
+        The neighbor is connected to the last node, it is not on the walked route and it has a next hop
+        which does not send the traffic back. A neighbor without predecessor is preferred:
+        that is where the other part of the broken route starts.
+        :param graph: The graph to walk
+        :param source_node: The source where the walk should be started
+        :param dest_node: The destination which should be reached
+        :return: Tuple of the last node and the neighbor, (None, None) if the destination is reached.
+            The neighbor is None if no neighbor forwards the traffic.
+        """
+        walk = walk_route(graph, source_node, dest_node)
+        last_node = self.get_last_node(walk, dest_node)
+        if last_node is None:
+            return None, None
+        route = set(walk.hops)
+        candidates = []
+        for _, neighbor, _ in self.interface_index.links(self.get_host_from_hostname(last_node)):
+            hostname = neighbor.hostname
+            if hostname not in route and graph.has_node(hostname) and \
+                    next(iter(graph.successors(hostname)), last_node) != last_node:
+                candidates.append(hostname)
+        candidates.sort(key=lambda hostname: graph.in_degree(hostname) > 0)
+        return last_node, candidates[0] if candidates else None
+
+    def plan_loop_fix(self, last_node_in_loop: str, last_node_from_dest: str,
+                      destination_network: Union[netaddr.IPNetwork, str]) -> ChangeSet:
+        """
+        Plan the fix of a loop at a node: redirect its route towards the destination network
+        to the node where the traffic should leave the loop.
         :param last_node_in_loop: The last node in the loop
         :param last_node_from_dest: The last node from the destination
         :param destination_network: The destination network which needs to be reached.
-        :return: True if the route was fixed with this node, False if not, needs to check other nodes
+        :return: The change set replacing the route (empty if the nodes do not share a subnet)
         """
         logger.debug(f"Last node in loop: {last_node_in_loop}")
         common_ips = get_ip_address_from_same_subnet(
+            self.interface_index,
             self.get_host_from_hostname(last_node_in_loop),
             self.get_host_from_hostname(last_node_from_dest)
         )
         logger.debug(f"Common IPs: {common_ips}")
-        possible_ip = tuple()
-        for source, dest in common_ips:
-            if not check_network_contains_network(source, MANAGEMENT_NETWORK) and \
-                    not check_network_contains_network(dest, MANAGEMENT_NETWORK):
-                logger.info(f"Found possible fix: {source} -> {dest}")
-                possible_ip = (source, dest)
-                break
+        # The interface index does not contain the excluded networks (Eg.: the management network),
+        # so they are never used as the new next hop
+        possible_ip = common_ips[0] if common_ips else tuple()
+        if possible_ip:
+            logger.info(f"Found possible fix: {possible_ip[0]} -> {possible_ip[1]}")
+        change_set = ChangeSet()
         if possible_ip:
             # Get route which is towards destination network (or contained in it)
             # Rewrite that rule (without changing the destination) with its new next_hop ip
             original_dest, wrong_next_hop = get_route_match_by_dest(
                 self.get_host_from_hostname(last_node_in_loop),
-                destination_network
+                destination_network,
+                self.vrf
             )
+            # The wrong route is deleted and the new one is added in the same run
             logger.debug(f"Removing route from {last_node_in_loop} - {wrong_next_hop} towards {original_dest}")
-            run_task(
-                role='cisco-config-static_routes', hosts=last_node_in_loop,
-                role_vars={'routes': [
-                    {
-                        'dest_address': str(original_dest),
-                        'next_hop': str(wrong_next_hop),
-                        'state': 'deleted'
-                    }
-                ]},
-                data_dir=os.path.abspath('../ansible/')
-            )
             logger.debug(f"Adding route to {last_node_in_loop} - {possible_ip[1]} towards {original_dest}")
-            run_task(
-                role='cisco-config-static_routes', hosts=last_node_in_loop,
-                role_vars={'routes': [
-                    {
-                        'dest_address': str(original_dest),
-                        'next_hop': str(netaddr.IPNetwork(possible_ip[1]).ip),
-                        'state': 'merged'
-                    }
-                ]},
-                data_dir=os.path.abspath('../ansible/')
-            )
+            change_set.add_routes(last_node_in_loop, [
+                {
+                    'dest_address': str(original_dest),
+                    'next_hop': str(wrong_next_hop),
+                    'state': 'deleted'
+                },
+                {
+                    'dest_address': str(original_dest),
+                    'next_hop': str(netaddr.IPNetwork(possible_ip[1]).ip),
+                    'state': 'merged'
+                }
+            ], vrf=self.vrf)
+        else:
+            logger.info(f"Possible IP pair not found with {last_node_from_dest} - {last_node_in_loop}")
+        return change_set
+
+    def check_and_fix_loop(self, last_node_in_loop: str, last_node_from_dest: str,
+                           destination_network: Union[netaddr.IPNetwork, str]) -> bool:
+        """
+        Helper function to check a node if it is where the loop is sourced from.
+        Fix the route if this is the correct node, return False if it is not the right node.
+        The fix is only applied if it fixes the simulated network.
+        :param last_node_in_loop: The last node in the loop
+        :param last_node_from_dest: The last node from the destination
+        :param destination_network: The destination network which needs to be reached.
+        :return: True if the route was fixed with this node, False if not, needs to check other nodes
+        """
+        change_set = self.plan_loop_fix(last_node_in_loop, last_node_from_dest, destination_network)
+        if change_set:
+            if not self.is_fixed(self.simulate_change_set(change_set).detect_loop_in_route()):
+                logger.info(f"Fixing the route of {last_node_in_loop} does not fix the simulated network")
+                return False
+            self.apply_change_set(change_set)
             if self.check_fix():
                 logger.info("Loop fixed")
                 return True
-        logger.info(f"Possible IP pair not found with {last_node_from_dest} - {last_node_in_loop}")
         return False
 
+    def loop_fix_candidates(self, state: dict) -> List[ChangeSet]:
+        """
+        Plan the possible fixes of the loops in the order fix_loop tries them
+        :param state: The state of the network (see detect_loop_in_route)
+        :return: List of change sets, one for every loop member which shares a subnet with the exit node
+        """
+        candidates = []
+        if state['source']['loop']:
+            last_node_from_dest = self.traverse_route(self.graph_from_source.reverse(copy=False), 'PC-D', 'PC-S')
+            for last_node_in_loop in reversed(state['source']['members']):
+                candidates.append(self.plan_loop_fix(last_node_in_loop, last_node_from_dest, self.destination.network))
+        if state['destination']['loop']:
+            last_node_from_source = self.traverse_route(
+                self.graph_from_destination.reverse(copy=False), 'PC-S', 'PC-D')
+            for last_node_in_loop in reversed(state['destination']['members']):
+                candidates.append(self.plan_loop_fix(last_node_in_loop, last_node_from_source, self.source.network))
+        return [change_set for change_set in candidates if change_set]
+
+    @trace.traced()
+    def plan_fix(self) -> dict:
+        """
+        Plan the fixes of the current problems without applying them (dry run).
+        A rupture is planned as a single change set (see plan_rupture_fix).
+        Every loop fix candidate is returned in the order fix_loop tries them.
+        Every change set is simulated, only the ones fixing the simulated network would be applied.
+        :return: Dictionary with the network state, the list of planned change sets
+            and whether each change set fixes the simulated network
+        """
+        state = self.detect_loop_in_route()
+        change_sets = []
+        if state['source']['loop'] or state['destination']['loop']:
+            change_sets = self.loop_fix_candidates(state)
+        elif state['source']['affected'] or state['destination']['affected']:
+            change_set, _ = self.plan_rupture_fix()
+            change_sets = [change_set] if change_set else []
+        simulated = [self.is_fixed(self.simulate_change_set(change_set).detect_loop_in_route())
+                     for change_set in change_sets]
+        return {'state': state, 'change_sets': change_sets, 'simulated': simulated}
+
+    @trace.traced()
     def fix_loop(self) -> bool:
         """
         Fix the loop in the network. This works after the loop type is determined.
@@ -574,7 +1050,7 @@ class NetworkAnalyzer:
         if state['source']['loop']:
             logger.debug("Loop from source to destination detected")
             last_node_from_dest = self.traverse_route(
-                self.graph_from_source.reverse(copy=True), 'PC-D', 'PC-S')
+                self.graph_from_source.reverse(copy=False), 'PC-D', 'PC-S')
             logger.debug(f"Last node from destination: {last_node_from_dest}")
             for last_node_in_loop in reversed(state['source']['members']):
                 if self.check_and_fix_loop(last_node_in_loop, last_node_from_dest, self.destination.network):
@@ -583,7 +1059,7 @@ class NetworkAnalyzer:
         if state['destination']['loop']:
             logger.debug("Loop from destination to source detected")
             last_node_from_source = self.traverse_route(
-                self.graph_from_destination.reverse(copy=True), 'PC-S', 'PC-D')
+                self.graph_from_destination.reverse(copy=False), 'PC-S', 'PC-D')
             logger.debug(f"Last node from source: {last_node_from_source}")
             for last_node_in_loop in reversed(state['destination']['members']):
                 if self.check_and_fix_loop(last_node_in_loop, last_node_from_source, self.source.network):
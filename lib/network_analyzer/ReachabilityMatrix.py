@@ -0,0 +1,180 @@
+import logging
+from typing import Dict, List, Set
+
+import netaddr  # type: ignore
+import networkx as nx  # type: ignore
+
+from network_analyzer.Host import Host
+from network_analyzer.InterfaceIndex import InterfaceIndex
+from network_analyzer.exception.exception import InterfaceNotFound
+from utils import trace
+from utils.graph import find_loops, get_forwarding_routes
+from utils.ip import batch_network_contains_network, parse_network_array
+
+logger = logging.getLogger(__name__)
+
+# States of an ordered (source, destination) pair
+STATE_REACHABLE = 'reachable'
+STATE_RUPTURE = 'rupture'
+# The destination cannot be reached, because the traffic enters a loop
+STATE_LOOP = 'loop'
+# The destination can be reached, but some traffic (Eg.: ECMP) can enter a loop
+STATE_LOOP_UNAFFECTED = 'loop-unaffected'
+
+
+class ReachabilityMatrix:
+    def __init__(self, facts: dict, excluded_networks: List[netaddr.IPNetwork] = None, vrf: str = None):
+        """
+        Reachability between every pair of edge networks of the network, computed from a single fact load.
+        Edge networks are the interface networks connected to exactly one router (Eg.: the LANs of the PCs).
+        One forwarding graph is built for every destination edge network and shared by every source network,
+        so the routes of the hosts are looked up once per destination instead of once per pair.
+        :param facts: The gathered facts from Ansible
+        :param excluded_networks: Interface networks in these networks are not indexed, so they are neither
+            edge networks nor links (Eg.: the management network, see NetworkAnalyzer.EXCLUDED_NETWORKS)
+        :param vrf: The checked VRF, None for the global routing table (the interfaces of other VRFs,
+            Eg.: the management network, are not edge networks)
+        """
+        self.hosts = [Host(host_facts) for host_facts in facts.values()]
+        self.vrf = vrf
+        self.excluded_networks = excluded_networks or []
+        self.interface_index = InterfaceIndex(self.hosts, vrf, self.excluded_networks)
+        # Edge network (CIDR) -> hostname of the router connected to it
+        self.edge_networks = self.find_edge_networks()
+        # Destination network -> forwarding graph of the hosts towards that network
+        self.graphs: Dict[str, nx.DiGraph] = {}
+        # Destination network -> source network -> state
+        self.matrix: Dict[str, Dict[str, str]] = {}
+        # Destination network -> loops in its forwarding graph reachable from any edge network
+        self.loops: Dict[str, List[List[str]]] = {}
+        self.build()
+
+    def find_edge_networks(self) -> Dict[str, str]:
+        """
+        Find the interface networks which are connected to exactly one router
+        :return: Dictionary of network (CIDR) -> hostname
+        """
+        candidates = {f"{netaddr.IPAddress(network)}/{prefixlen}": members[0][0].hostname
+                      for (network, prefixlen), members in self.interface_index.subnets.items() if len(members) == 1}
+        if candidates and self.excluded_networks:
+            # Every candidate is checked against every excluded network in one call
+            excluded = batch_network_contains_network(
+                *parse_network_array(candidates), *parse_network_array(self.excluded_networks)
+            ).any(axis=1)
+            edge_networks = {cidr: hostname for (cidr, hostname), is_excluded in zip(candidates.items(), excluded)
+                             if not is_excluded}
+        else:
+            edge_networks = candidates
+        logger.info(f"Found {len(edge_networks)} edge networks")
+        return edge_networks
+
+    def build_forwarding_graph(self, destination: str) -> nx.DiGraph:
+        """
+        Build the graph of the forwarding decisions of every host towards a destination network.
+        The router connected to the destination network delivers the traffic, so it has no outgoing edges.
+        :param destination: The destination network
+        :return: Graph of hostnames, an edge points from a host to its next hop host
+        """
+        graph = nx.DiGraph()
+        graph.add_nodes_from(host.hostname for host in self.hosts)
+        delivering_host = self.edge_networks[destination]
+        for host in self.hosts:
+            if host.hostname == delivering_host:
+                continue
+            try:
+                routes = get_forwarding_routes(self.interface_index, host, destination)
+            except InterfaceNotFound as e:
+                logger.warning(f"{host.hostname} cannot forward towards {destination}: {e}")
+                continue
+            for route in routes:
+                match = self.interface_index.find_by_address(route.next_hop)
+                if match is not None:
+                    graph.add_edge(host.hostname, match[0].hostname)
+        return graph
+
+    @trace.traced()
+    def build(self) -> None:
+        """
+        Compute the state of every ordered pair of edge networks.
+        For each destination the hosts are classified once: a host reaches the destination if the delivering router
+        is reachable from it, and it is affected by a loop if a cycle of the forwarding graph is reachable from it.
+        :return: None
+        """
+        for destination in self.edge_networks:
+            graph = self.build_forwarding_graph(destination)
+            self.graphs[destination] = graph
+            reaching = self._reaching(graph, {self.edge_networks[destination]})
+            cyclic = {node for component in nx.strongly_connected_components(graph)
+                      for node in component if len(component) > 1 or graph.has_edge(node, node)}
+            looping = self._reaching(graph, cyclic)
+            row = {}
+            for source, hostname in self.edge_networks.items():
+                if source == destination:
+                    continue
+                if hostname in looping:
+                    row[source] = STATE_LOOP_UNAFFECTED if hostname in reaching else STATE_LOOP
+                else:
+                    row[source] = STATE_REACHABLE if hostname in reaching else STATE_RUPTURE
+            self.matrix[destination] = row
+            if cyclic:
+                loops = []
+                for hostname in sorted({self.edge_networks[source] for source in row} & looping):
+                    loops.extend(loop for loop in find_loops(graph, hostname) if loop not in loops)
+                self.loops[destination] = loops
+
+    @staticmethod
+    def _reaching(graph: nx.DiGraph, targets: Set[str]) -> Set[str]:
+        """
+        Get every node which has a path to one of the target nodes (including the targets)
+        :param graph: The graph to search
+        :param targets: The target nodes
+        :return: Set of nodes
+        """
+        reaching = set(targets)
+        stack = list(targets)
+        while stack:
+            node = stack.pop()
+            for predecessor in graph.predecessors(node):
+                if predecessor not in reaching:
+                    reaching.add(predecessor)
+                    stack.append(predecessor)
+        return reaching
+
+    def state(self, source: str, destination: str) -> str:
+        """
+        Get the state of the traffic from a source edge network towards a destination edge network
+        :param source: The source network (CIDR)
+        :param destination: The destination network (CIDR)
+        :return: One of the STATE_* constants
+        """
+        return self.matrix[str(netaddr.IPNetwork(destination).cidr)][str(netaddr.IPNetwork(source).cidr)]
+
+    def problems(self) -> List[tuple]:
+        """
+        Get the ordered pairs which are not reachable without problems
+        :return: List of (source, destination, state) tuples
+        """
+        return [(source, destination, state) for destination, row in self.matrix.items()
+                for source, state in row.items() if state != STATE_REACHABLE]
+
+    def summary(self) -> Dict[str, int]:
+        """
+        Count the ordered pairs in each state
+        :return: Dictionary of state -> number of pairs
+        """
+        counts = {STATE_REACHABLE: 0, STATE_RUPTURE: 0, STATE_LOOP: 0, STATE_LOOP_UNAFFECTED: 0}
+        for row in self.matrix.values():
+            for state in row.values():
+                counts[state] += 1
+        return counts
+
+    def to_dict(self) -> dict:
+        """
+        Get the matrix in a JSON serializable format
+        :return: Dictionary with the edge networks, the states (source -> destination -> state) and the loops
+        """
+        states = {source: {} for source in self.edge_networks}
+        for destination, row in self.matrix.items():
+            for source, state in row.items():
+                states[source][destination] = state
+        return {'edge_networks': self.edge_networks, 'states': states, 'loops': self.loops}
@@ -0,0 +1,152 @@
+import bisect
+import logging
+from typing import Dict, List, Union
+
+import netaddr  # type: ignore
+
+from utils import trace
+from utils.ip import parse_network
+
+logger = logging.getLogger(__name__)
+
+IPV4_MAX_PREFIXLEN = 32
+
+
+class Route:
+    __slots__ = ('dest', 'next_hop', 'network', 'prefixlen', 'vrf')
+
+    def __init__(self, dest: str, next_hop: str, vrf: str = None):
+        """
+        A single static route (destination and one of its next hops) compiled from the facts.
+        :param dest: The destination network in CIDR notation (Eg.: 10.0.1.0/24)
+        :param next_hop: The forward router address of the route
+        :param vrf: The VRF of the route, None if it is in the global routing table
+        """
+        network = parse_network(dest)
+        self.dest = dest
+        self.next_hop = next_hop
+        self.network = network.network
+        self.prefixlen = network.prefixlen
+        self.vrf = vrf
+
+    def __repr__(self) -> str:
+        return f"Route({self.dest} via {self.next_hop})"
+
+
+class RouteTable:
+    def __init__(self, vrf: str = None):
+        """
+        Compiled forwarding table of a host.
+        Routes are stored in a binary radix trie over the integer destination prefixes,
+        so longest prefix match and covering route queries take at most 32 steps regardless of the number of routes.
+        Every trie node is a list of [zero child, one child, routes ending in this node].
+        :param vrf: The VRF of the table, None if it is the global routing table
+        """
+        self.vrf = vrf
+        self._root = [None, None, []]
+        # Sorted next-hop addresses for range queries (Eg.: is there a route through this interface?)
+        self._next_hops = []
+        self._size = 0
+
+    def add(self, route: Route) -> None:
+        """
+        Insert a route into the trie
+        :param route: The route to add
+        :return: None
+        """
+        node = self._root
+        for depth in range(route.prefixlen):
+            bit = (route.network >> (IPV4_MAX_PREFIXLEN - 1 - depth)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, []]
+            node = node[bit]
+        node[2].append(route)
+        bisect.insort(self._next_hops, parse_network(route.next_hop).ip)
+        self._size += 1
+
+    def covering(self, network: Union[str, netaddr.IPNetwork, netaddr.IPAddress]) -> List[Route]:
+        """
+        Get every route whose destination contains the provided network, the least specific first
+        :param network: The network (or IP address) which should be contained by the routes
+        :return: List of routes containing the network
+        """
+        network = parse_network(network)
+        node = self._root
+        routes = list(node[2])
+        for depth in range(network.prefixlen):
+            node = node[(network.network >> (IPV4_MAX_PREFIXLEN - 1 - depth)) & 1]
+            if node is None:
+                break
+            routes.extend(node[2])
+        trace.count('route_lookups')
+        trace.count('routes_scanned', len(routes))
+        return routes
+
+    def longest_match(self, network: Union[str, netaddr.IPNetwork, netaddr.IPAddress]) -> List[Route]:
+        """
+        Get the most specific routes containing the provided network (longest prefix match).
+        Multiple routes are returned only if the same destination has more than one next hop.
+        :param network: The network (or IP address) to match
+        :return: List of the matching routes, empty if there is no route containing the network
+        """
+        network = parse_network(network)
+        node = self._root
+        routes = node[2]
+        for depth in range(network.prefixlen):
+            node = node[(network.network >> (IPV4_MAX_PREFIXLEN - 1 - depth)) & 1]
+            if node is None:
+                break
+            if node[2]:
+                routes = node[2]
+        trace.count('route_lookups')
+        trace.count('routes_scanned', len(routes))
+        return list(routes)
+
+    def has_next_hop_within(self, network: Union[str, netaddr.IPNetwork]) -> bool:
+        """
+        Check if any route of the table has its next hop in the provided network
+        :param network: The network where the next hop should be (Eg.: an interface network)
+        :return: True if there is a route through the network, False if there is not
+        """
+        network = parse_network(network)
+        position = bisect.bisect_left(self._next_hops, network.network)
+        return position < len(self._next_hops) and self._next_hops[position] <= network.last
+
+    @property
+    def next_hops(self) -> List[int]:
+        """
+        The next-hop addresses of every route in the table as integers (sorted)
+        """
+        return self._next_hops
+
+    def __iter__(self):
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            yield from node[2]
+            stack.extend(child for child in node[:2] if child is not None)
+
+    def __len__(self) -> int:
+        return self._size
+
+
+def compile_route_tables(static_routes: List[dict]) -> Dict[Union[str, None], RouteTable]:
+    """
+    Compile the static_routes facts of a host into route tables, one for each VRF.
+    The global routing table is stored with the None key.
+    :param static_routes: The static_routes network resource gathered by Ansible
+    :return: Dictionary of VRF name -> RouteTable
+    """
+    tables = {None: RouteTable()}
+    for table in static_routes:
+        vrf = table.get('vrf')
+        route_table = tables.setdefault(vrf, RouteTable(vrf))
+        for address_family in table.get('address_families', []):
+            if address_family.get('afi', 'ipv4') != 'ipv4':
+                continue
+            for route in address_family.get('routes', []):
+                for next_hop in route.get('next_hops', []):
+                    # Routes pointing only to an exit interface do not have a next hop address
+                    if 'forward_router_address' in next_hop:
+                        route_table.add(Route(route['dest'], next_hop['forward_router_address'], vrf))
+    return tables
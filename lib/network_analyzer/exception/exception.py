@@ -21,3 +21,8 @@ class PlaybookRunException(Exception):
 class InterfaceNotFound(Exception):
     def __init__(self, message):
         super().__init__(message)
+
+
+class AnsibleTimeoutException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
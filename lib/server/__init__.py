@@ -0,0 +1,2 @@
+# Default address of the analyzer API server (see server.daemon)
+DEFAULT_LISTEN = '127.0.0.1:8650'
@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from network_analyzer.ForwardingEngine import ForwardingEngine
+from network_analyzer.NetworkAnalyzer import EXCLUDED_NETWORKS, NetworkAnalyzer
+from network_analyzer.ReachabilityMatrix import ReachabilityMatrix
+from network_analyzer.exception.exception import NetworkSourceDestinationException, \
+    NetworkMultipleDefinitionException
+from server import DEFAULT_LISTEN
+
+logger = logging.getLogger(__name__)
+
+UNIX_SOCKET_PREFIX = 'unix:'
+
+
+class NetworkSnapshot:
+    def __init__(self, facts: dict, version: int):
+        """
+        Immutable view of the network built from one fact load.
+        Requests only read the snapshot, so they can be served concurrently without locking.
+        The analyzers of the source/destination pairs are built on the first request and cached.
+        :param facts: The gathered facts from Ansible (must not be changed after the snapshot is created)
+        :param version: Sequence number of the snapshot
+        """
+        self.facts = facts
+        self.version = version
+        self.created = datetime.now().isoformat(timespec='seconds')
+        self.matrix = ReachabilityMatrix(facts, excluded_networks=list(EXCLUDED_NETWORKS))
+        self.engine = ForwardingEngine(facts)
+        self._analyzers: Dict[Tuple[str, str, str], NetworkAnalyzer] = {}
+        self._analyzers_lock = threading.Lock()
+
+    def get_analyzer(self, source: str, destination: str, vrf: str = None) -> NetworkAnalyzer:
+        """
+        Get the analyzer of a source/destination pair
+        :param source: The source network
+        :param destination: The destination network
+        :param vrf: The VRF of the networks, None for the global routing table
+        :return: The analyzer (shared by the requests of the snapshot, only read it)
+        """
+        key = (source, destination, vrf)
+        with self._analyzers_lock:
+            if key not in self._analyzers:
+                self._analyzers[key] = NetworkAnalyzer(
+                    self.facts, source=source, destination=destination, test_case_name="Network analyzer server",
+                    vrf=vrf
+                )
+            return self._analyzers[key]
+
+    def status(self) -> dict:
+        return {
+            'version': self.version,
+            'created': self.created,
+            'hosts': len(self.facts),
+            'edge_networks': len(self.matrix.edge_networks),
+            'forwarding_classes': len(self.engine.classes),
+        }
+
+
+class AnalyzerService:
+    def __init__(self, load_facts: Callable[[List[str]], dict], facts: dict = None):
+        """
+        Keep the current network snapshot in memory and refresh it in the background.
+        A refresh builds the next snapshot while the requests are still served from the current one,
+        then the snapshot reference is swapped.
+        :param load_facts: Function returning the facts of the given hosts (every host if the list is None)
+        :param facts: The facts of the first snapshot. If None, they are loaded with load_facts
+        """
+        self.load_facts = load_facts
+        self.snapshot = NetworkSnapshot(facts if facts is not None else load_facts(None), version=1)
+        self._refresh_lock = threading.Lock()
+        self.refresh_error = None
+
+    def refresh(self, hosts: List[str] = None) -> bool:
+        """
+        Start building a new snapshot in the background.
+        :param hosts: Only reload the facts of these hosts, the others are kept from the current snapshot
+        :return: True if the refresh was started, False if another refresh is still running
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._refresh, args=(hosts,), name="snapshot-refresh", daemon=True).start()
+        return True
+
+    def _refresh(self, hosts: List[str]) -> None:
+        try:
+            current = self.snapshot
+            facts = dict(current.facts) if hosts else {}
+            facts.update(self.load_facts(hosts))
+            self.snapshot = NetworkSnapshot(facts, version=current.version + 1)
+            self.refresh_error = None
+            logger.info(f"Snapshot {self.snapshot.version} ready")
+        except Exception as e:
+            logger.exception("Snapshot refresh failed")
+            self.refresh_error = str(e)
+        finally:
+            self._refresh_lock.release()
+
+    @property
+    def refreshing(self) -> bool:
+        return self._refresh_lock.locked()
+
+
+class AnalyzerRequestHandler(BaseHTTPRequestHandler):
+    service: AnalyzerService = None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        # Every request works on the same snapshot, even if a refresh swaps it in the meantime
+        snapshot = self.service.snapshot
+        try:
+            if url.path == '/status':
+                self.send_json(200, {
+                    **snapshot.status(),
+                    'refreshing': self.service.refreshing,
+                    'refresh_error': self.service.refresh_error
+                })
+            elif url.path == '/reachability':
+                self.send_json(200, self.reachability(snapshot, query))
+            elif url.path == '/loops':
+                self.send_json(200, self.loops(snapshot))
+            elif url.path == '/fix-plan':
+                analyzer = snapshot.get_analyzer(query['source'], query['destination'], query.get('vrf'))
+                plan = analyzer.plan_fix()
+                self.send_json(200, {
+                    'version': snapshot.version, 'state': plan['state'],
+                    'change_sets': [change_set.changes for change_set in plan['change_sets']],
+                    'simulated': plan['simulated']
+                })
+            else:
+                self.send_json(404, {'error': f"Unknown endpoint {url.path}"})
+        except KeyError as e:
+            self.send_json(400, {'error': f"Missing or unknown parameter {e}"})
+        except (NetworkSourceDestinationException, NetworkMultipleDefinitionException, ValueError) as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            logger.exception(f"Request {self.path} failed")
+            self.send_json(500, {'error': str(e)})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != '/refresh':
+            self.send_json(404, {'error': f"Unknown endpoint {url.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+            if not isinstance(body, dict):
+                raise ValueError("The request body must be a JSON object")
+            hosts = body.get('hosts')
+            if hosts is not None and (not isinstance(hosts, list) or
+                                      not all(isinstance(hostname, str) for hostname in hosts)):
+                raise ValueError("hosts must be a list of hostnames")
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too
+            self.send_json(400, {'error': str(e)})
+            return
+        if self.service.refresh(hosts):
+            self.send_json(202, {'refreshing': True, 'version': self.service.snapshot.version})
+        else:
+            self.send_json(409, {'error': "A refresh is already running"})
+
+    @staticmethod
+    def reachability(snapshot: NetworkSnapshot, query: dict) -> dict:
+        """
+        Get the state of one source/destination pair, or the whole matrix if no pair is given
+        """
+        if 'source' not in query and 'destination' not in query:
+            return {'version': snapshot.version, 'summary': snapshot.matrix.summary(), **snapshot.matrix.to_dict()}
+        analyzer = snapshot.get_analyzer(query['source'], query['destination'], query.get('vrf'))
+        state = analyzer.detect_loop_in_route()
+        result = {'version': snapshot.version, 'state': state}
+        if not state['source']['affected']:
+            result['path'] = analyzer.get_shortest_path()
+        return result
+
+    @staticmethod
+    def loops(snapshot: NetworkSnapshot) -> dict:
+        """
+        Get the loops and black holes of the whole network
+        """
+        return {
+            'version': snapshot.version,
+            'loop_free': snapshot.engine.is_loop_free(),
+            'loops': [{'destinations': forwarding_class.cidrs, 'members': loop}
+                      for forwarding_class, loop in snapshot.engine.loops()],
+            'black_holes': [{'destinations': forwarding_class.cidrs, 'host': hostname}
+                            for forwarding_class, hostname in snapshot.engine.black_holes()],
+        }
+
+    def send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket clients do not have an address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(service: AnalyzerService, listen: str = DEFAULT_LISTEN) -> None:
+    """
+    Serve the JSON API until interrupted
+    :param service: The analyzer service with the current snapshot
+    :param listen: host:port for HTTP over TCP, or unix:/path/to/socket for a Unix socket
+    :return: None
+    """
+    handler = type('Handler', (AnalyzerRequestHandler,), {'service': service})
+    if listen.startswith(UNIX_SOCKET_PREFIX):
+        path = listen[len(UNIX_SOCKET_PREFIX):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = ThreadingUnixHTTPServer(path, handler)
+    else:
+        host, _, port = listen.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+    logger.info(f"Serving the analyzer API on {listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Server stopped")
+    finally:
+        server.server_close()
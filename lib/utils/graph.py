@@ -1,89 +1,135 @@
 import logging
-from typing import Union, List, Tuple, Any
+from itertools import chain
+from typing import Dict, Union, List, NamedTuple, Tuple, Set
 
 import netaddr
 import networkx as nx
 from networkx.classes.reportviews import OutEdgeView
 
 from network_analyzer.Host import Host
+from network_analyzer.Interface import Interface
+from network_analyzer.InterfaceIndex import InterfaceIndex
+from network_analyzer.RouteTable import Route
 from network_analyzer.exception.exception import InterfaceNotFound
-from utils.CompareTuple import compare_list_tuples
-from utils.ip import check_network_contains_ip, check_network_contains_network, compare_cidr_and_ip_address, \
-    check_network_is_in_supernet
+from utils import trace
+from utils.ip import check_network_contains_ip, check_network_contains_network, check_network_is_in_supernet, \
+    parse_network, prefixlen_to_mask, IPV4_MAX_PREFIXLEN, parse_network_array, batch_network_contains_ip, \
+    batch_network_contains_network, batch_network_is_in_supernet
 
 logger = logging.getLogger(__name__)
 
+# Number of hosts checked together by find_missing_interface_routes
+SWEEP_BLOCK_HOSTS = 64
 
-def get_interface_status_from_route(host: Host, ip_address: str) -> bool:
+
+def get_interface_status_from_route(index: InterfaceIndex, host: Host, ip_address: str) -> bool:
     """
     Check an interface enabled status based on host IP addresses.
     Returns the interface status in a host based on the IP address of the next-hop interface.
     The IP address will be checked if the current interface network contains that IP address.
     If the IP address does not match any interface on the current host, InterfaceNotFound error will be raised
+    :param index: The interface index of the network
     :param host: The host object with interfaces
     :param ip_address: The IP address to check
     :return: True if the interface of that IP address is enabled, False if it is disabled
     :raises: InterfaceNotFound if the IP address does not match any interface on the host
     """
     logger.debug(f"Searching interfaceRoute for IP address {ip_address}")
-    for interface in host.interfaces:
-        if 'ipv4' in interface:
-            if check_network_contains_ip(ip_address, interface['ipv4'][0]['address']):
-                return interface['enabled']
-    raise InterfaceNotFound(f"Can't find interface for IP address {ip_address}")
+    match = index.find_by_subnet(ip_address, hostname=host.hostname)
+    if match is None:
+        raise InterfaceNotFound(f"Can't find interface for IP address {ip_address}")
+    return match[1].enabled
 
 
-def get_interface_status_from_ip(hosts: List[Host], ip_address: str) -> bool:
+def get_interface_status_from_ip(index: InterfaceIndex, ip_address: str) -> bool:
     """
     Get the interface status (if it is enabled or not) from an IP address
     If an IP address provided is not found in the hosts, InterfaceNotFound error will be raised
-    :param hosts: The list of hosts to check
+    :param index: The interface index of the network
     :param ip_address: The IP address to find and check
     :return: True if the interface is enabled, False if it is disabled
     """
     logger.debug(f"Searching interfaceIp for IP address {ip_address}")
-    for host in hosts:
-        for interface in host.interfaces:
-            if 'ipv4' in interface:
-                if compare_cidr_and_ip_address(interface['ipv4'][0]['address'], ip_address):
-                    return interface['enabled']
-    raise InterfaceNotFound(f"Can't find interface for IP address {ip_address}")
+    match = index.find_by_address(ip_address)
+    if match is None:
+        raise InterfaceNotFound(f"Can't find interface for IP address {ip_address}")
+    return match[1].enabled
 
 
-def get_route_from_interface(host: Host, interface: dict, source: netaddr.IPNetwork, destination: netaddr.IPNetwork) \
-        -> bool:
+def get_route_from_interface(host: Host, interface: Interface, source: netaddr.IPNetwork,
+                             destination: netaddr.IPNetwork, vrf: str = None) -> bool:
     """
     Get the route from a host based on the interface
     :param destination: The destination network/IP address
     :param source: The source network/IP address
     :param host: The host object
     :param interface: The interface object
+    :param vrf: The VRF of the routes, None for the global routing table
     :return: The route object if found, None if not found
     """
-    for table in host.routes:
-        if 'vrf' not in table:
-            for route in table['address_families']:
-                if check_network_contains_ip(route['routes'][0]['next_hops'][0]['forward_router_address'],
-                                             interface['ipv4'][0]['address']):
-                    if check_network_contains_network(str(source), route['routes'][0]['dest']) or \
-                            check_network_contains_network(str(destination), route['routes'][0]['dest']):
-                        return True
+    route_table = host.get_route_table(vrf)
+    for route in route_table.covering(source) + route_table.covering(destination):
+        # Default routes are not taken into account (see check_network_contains_network)
+        if route.prefixlen and check_network_contains_ip(route.next_hop, interface.address):
+            return True
     return False
 
 
-def check_interface_status(host: Host, source: netaddr.IPNetwork, destination: netaddr.IPNetwork) -> list:
+def get_forwarding_routes(index: InterfaceIndex, host: Host, network: netaddr.IPNetwork,
+                          allow_missing_next_hops: bool = False) -> List[Route]:
+    """
+    Get the routes which a host uses to forward traffic towards a network (longest prefix match).
+    The network should be contained by the destination network of the route, default routes are ignored.
+    If there are more next hops for the most specific destination, all of them will be returned.
+    The routes of the VRF of the interface index are used.
+    :param index: The interface index of the network
+    :param host: The Host object
+    :param network: The network where the traffic is forwarded to
+    :param allow_missing_next_hops: If True, a route whose next hop is not on any known host (Eg.: its facts are
+        missing) is used, but it is not returned, so the host is a rupture point. If False, InterfaceNotFound is raised.
+    :return: List of routes used for forwarding, empty if the host cannot forward towards the network
+    """
+    routes = []
+    used_prefixlen = None
+    for route in reversed(host.get_route_table(index.vrf).covering(network)):
+        if not route.prefixlen or (used_prefixlen is not None and route.prefixlen < used_prefixlen):
+            break
+        # Need to check if the current route next-hop interface is enabled.
+        # Also need to check if the current route interface is enabled on the other router as well.
+        # If not enabled don't use the route, the router falls back to a less specific one.
+        # ! Routes returned by Ansible is always there, even if the actual routing table does not contain it !
+        if not get_interface_status_from_route(index, host, route.next_hop):
+            continue
+        try:
+            enabled = get_interface_status_from_ip(index, route.next_hop)
+        except InterfaceNotFound:
+            if not allow_missing_next_hops:
+                raise
+            # The state of the next hop is unknown, the router does not fall back to a less specific route
+            logger.debug(f"Next hop {route.next_hop} of {host.hostname} is missing, the route ends here")
+            used_prefixlen = route.prefixlen
+            continue
+        if enabled:
+            routes.append(route)
+            used_prefixlen = route.prefixlen
+    return routes
+
+
+def check_interface_status(host: Host, source: netaddr.IPNetwork, destination: netaddr.IPNetwork,
+                           vrf: str = None) -> list:
     """
     Get all interface statuses from a host
     :param destination: The source network which needs to be enabled
     :param source: The destination network which needs to be enabled
     :param host: The host object
+    :param vrf: Only the interfaces and routes of this VRF are checked, None for the global routing table
     :return: list of interface statuses
     """
     down_interfaces = []
     for interface in host.interfaces:
-        if 'ipv4' in interface and not interface['enabled']:
-            if get_route_from_interface(host, interface, source, destination):
-                down_interfaces.append({'name': interface['name'], 'description': interface['description']})
+        if interface.address is not None and not interface.enabled and interface.vrf == vrf:
+            if get_route_from_interface(host, interface, source, destination, vrf):
+                down_interfaces.append({'name': interface.name, 'description': interface.description or ''})
     return down_interfaces
 
 
@@ -95,10 +141,14 @@ def get_graph_difference(new_graph: nx.DiGraph, old_graph: nx.DiGraph) -> nx.DiG
     :param old_graph: The older/initial graph which will be compared to the newer one.
     :return: A new graph with the difference (edges/nodes) between the two graphs
     """
-    return nx.difference(new_graph, old_graph)
+    # nx.difference requires equal node sets, but nodes can appear or disappear between two fact loads
+    difference = nx.DiGraph()
+    difference.add_nodes_from(new_graph)
+    difference.add_edges_from(edge for edge in new_graph.edges if not old_graph.has_edge(*edge))
+    return difference
 
 
-def check_source_destination(interface: dict, source: netaddr.IPNetwork, destination: netaddr.IPNetwork) \
+def check_source_destination(interface: Interface, source: netaddr.IPNetwork, destination: netaddr.IPNetwork) \
         -> Union[str, None]:
     """
     Check for source and destination network/IP address.
@@ -109,17 +159,27 @@ def check_source_destination(interface: dict, source: netaddr.IPNetwork, destina
     :return: str based on the result. Will return 'source' if this is a source route, 'destination' if this is a
     destination route, None if this is not a source or destination route.
     """
-    if 'ipv4' in interface:
-        ip_addr = netaddr.IPNetwork(interface['ipv4'][0]['address'])
+    if interface.address is not None:
         # Comparing received address (eg: 192.168.1.1/24) with network address from config: 192.168.1.0/24
-        if ip_addr == source:
+        if interface_in_network(interface, source):
             return "source"
         # Comparing received address (eg: 192.168.1.1/24) with network address from config: 192.168.1.0/24
-        elif ip_addr == destination:
+        elif interface_in_network(interface, destination):
             return "destination"
     return None
 
 
+def interface_in_network(interface: Interface, network: netaddr.IPNetwork) -> bool:
+    """
+    Check if the interface address is in exactly the provided network (same network address and netmask)
+    :param interface: The interface to check
+    :param network: The network to compare with
+    :return: True if the interface is connected to the network, False if it is not
+    """
+    parsed_network = parse_network(network)
+    return interface.network == parsed_network.network and interface.prefixlen == parsed_network.prefixlen
+
+
 def get_new_edges(initial_graph: nx.DiGraph, current_graph: nx.DiGraph) -> OutEdgeView:
     """
     Get which edges were added to the current graph, compared to the initial state
@@ -166,6 +226,119 @@ def check_loop_type(graph: nx.DiGraph, loop: List[str], source: str, destination
             return {"loop": False, "affected": True}
 
 
+@trace.traced()
+def find_loops(graph: nx.DiGraph, start: str) -> List[List[str]]:
+    """
+    Find the forwarding loops reachable from a node, based on strongly connected components (linear time).
+    Every strongly connected component with more than one node (or with a self loop) contains at least one cycle,
+    one canonical cycle is returned for each of them (see get_canonical_cycle), starting with the loop entry node.
+    :param graph: The graph to check
+    :param start: The node where the traffic enters the graph (Eg.: the source host)
+    :return: List of loops, the loop closest to the start node first. Empty if no loop is reachable
+    """
+    if start not in graph:
+        return []
+    distances = nx.single_source_shortest_path_length(graph, start)
+    reachable = graph.subgraph(distances)
+    loops = []
+    for component in nx.strongly_connected_components(reachable):
+        if len(component) == 1:
+            node = next(iter(component))
+            if not graph.has_edge(node, node):
+                continue
+        loop = get_canonical_cycle(graph, component)
+        # Rotate the loop to start at the node where the traffic enters it
+        entry = loop.index(min(loop, key=lambda member: (distances[member], member)))
+        loops.append(loop[entry:] + loop[:entry])
+    loops.sort(key=lambda loop: (distances[loop[0]], loop[0]))
+    return loops
+
+
+def get_canonical_cycle(graph: nx.DiGraph, component: Set[str]) -> List[str]:
+    """
+    Get a deterministic cycle of a strongly connected component.
+    The walk starts at the smallest node and always steps to the smallest successor inside the component,
+    until a node is visited again. The cycle is rotated to start with its smallest node.
+    :param graph: The graph of the component
+    :param component: The nodes of the strongly connected component
+    :return: The nodes of the cycle in the order of the edges
+    """
+    node = min(component)
+    path = []
+    position = {}
+    while node not in position:
+        position[node] = len(path)
+        path.append(node)
+        node = min(successor for successor in graph.successors(node) if successor in component)
+    cycle = path[position[node]:]
+    first = cycle.index(min(cycle))
+    return cycle[first:] + cycle[:first]
+
+
+class RouteWalk(NamedTuple):
+    # The nodes of the route following the first next hop of every node (including the destination if reached)
+    hops: List[str]
+    # The destination can be reached on any branch (following every next hop), None if the branches are not explored
+    reached: Union[bool, None]
+    # The last node of the route if it has no next hop (None if the route reaches the destination or loops)
+    rupture: Union[str, None]
+    # The first node visited twice by the route (None if the route does not loop)
+    loop_entry: Union[str, None]
+    # Every node without next hop reachable on any branch (except the destination)
+    dead_ends: List[str]
+
+
+def walk_route(graph: nx.DiGraph, source: str, destination: str, explore: bool = False) -> RouteWalk:
+    """
+    Walk a route from the source node towards the destination node without recursion.
+    The route follows the first next hop of every node until it reaches the destination, a node without
+    next hop (rupture) or a node it already visited (loop).
+    :param graph: The graph to walk
+    :param source: The node where the walk starts
+    :param destination: The node which should be reached
+    :param explore: Explore every branch too, with a visited set, to check if the destination is reachable
+        over any next hop and to find the dead ends. This visits every node reachable from the source.
+    :return: The hops of the route, its rupture point and loop entry, the reachability and the dead ends
+    """
+    hops = []
+    position = set()
+    rupture = loop_entry = None
+    node = source
+    while True:
+        hops.append(node)
+        position.add(node)
+        next_hop = next(iter(graph.successors(node)), None)
+        if next_hop is None:
+            rupture = node
+            break
+        if next_hop == destination:
+            hops.append(destination)
+            break
+        if next_hop in position:
+            loop_entry = next_hop
+            break
+        node = next_hop
+    if not explore:
+        return RouteWalk(hops, None, rupture, loop_entry, [])
+
+    reached = False
+    dead_ends = []
+    visited = {source}
+    stack = [source]
+    while stack:
+        node = stack.pop()
+        successors = list(graph.successors(node))
+        if not successors:
+            dead_ends.append(node)
+        for successor in successors:
+            if successor == destination:
+                reached = True
+            elif successor not in visited:
+                visited.add(successor)
+                stack.append(successor)
+    return RouteWalk(hops, reached, rupture, loop_entry, sorted(dead_ends))
+
+
 def generate_tmp_graph(name: str, graph: nx.DiGraph, initial_graph: nx.DiGraph) -> nx.DiGraph:
     """
     Generate a temporary graph from an initial graph and the current graph.
@@ -176,7 +349,8 @@ def generate_tmp_graph(name: str, graph: nx.DiGraph, initial_graph: nx.DiGraph)
     :param initial_graph: The initial graph
     :return: The new graph with the new and removed edges marked
     """
-    tmp_graph = graph
+    # Work on a copy, the marked edges must not end up in the graph used by the analysis
+    tmp_graph = graph.copy()
     new_edges = get_new_edges(initial_graph, graph)
     removed_edges = get_removed_edges(initial_graph, graph)
     tmp_graph.add_edges_from(new_edges, color='green', weight=2, style='--', label='Added edge')
@@ -188,8 +362,8 @@ def generate_tmp_graph(name: str, graph: nx.DiGraph, initial_graph: nx.DiGraph)
     return tmp_graph
 
 
-def check_missing_interface_route(host: Host, source: netaddr.IPNetwork, destination: netaddr.IPNetwork) \
-        -> Tuple[list, set]:
+def check_missing_interface_route(host: Host, source: netaddr.IPNetwork, destination: netaddr.IPNetwork,
+                                  vrf: str = None) -> Tuple[list, set]:
     """
     Check if there is a corresponding route for each interface in a given host.
     This will also include routes which is there, but probably the netmask is wrong.
@@ -198,78 +372,157 @@ def check_missing_interface_route(host: Host, source: netaddr.IPNetwork, destina
     :param source: The source network which will be checked against routes.
     Sources will be checked to ensure 2-way routing
     :param destination: The destination network which is checked against the routes
+    :param vrf: Only the interfaces and routes of this VRF are checked, None for the global routing table
     :return: A tuple with a list of missing routes and a set of routes with incorrect netmask
     """
     missing_routes = []
-    invalid_netmask = []
+    route_table = host.get_route_table(vrf)
     for interface in host.interfaces:
-        if 'ipv4' in interface:
-            addr = interface['ipv4'][0]['address']
-            found = False
-            for table in host.routes:
-                for route in table['address_families']:
-                    next_hop = route['routes'][0]['next_hops'][0]['forward_router_address']
-                    destination_route = route['routes'][0]['dest']
-                    if check_network_contains_ip(next_hop, addr):
-                        logger.debug(f"Found route {destination_route} for {addr} in {host.hostname}")
-                        found = True
-                    if check_network_is_in_supernet(source.network, destination_route) or \
-                            check_network_is_in_supernet(destination.network, destination_route):
-                        if not check_network_contains_network(destination, destination_route) and \
-                                not check_network_contains_network(source, destination_route):
-                            logger.debug(f"Invalid netmask for {destination_route} in {host.hostname}")
-                            invalid_netmask.append((destination_route, next_hop))
-            if not found:
+        if interface.address is not None and interface.vrf == vrf:
+            addr = interface.address
+            if route_table.has_next_hop_within(addr):
+                logger.debug(f"Found route for {addr} in {host.hostname}")
+            else:
                 logger.debug(f"Missing route for {addr} in {host.hostname}")
                 missing_routes.append(addr)
-    return missing_routes, set(invalid_netmask)
+    return missing_routes, get_routes_with_invalid_netmask(host, source, destination, vrf)
 
 
-def get_interface_ip_within_ip_network(host: Host, ip_addresses: List[str]) -> Union[str, None]:
+def find_missing_interface_routes(hosts: List[Host], source: netaddr.IPNetwork, destination: netaddr.IPNetwork,
+                                  vrf: str = None) -> Dict[str, Tuple[list, set]]:
+    """
+    Batch variant of check_missing_interface_route, every host is checked with a few array operations.
+    The next hops of the routes are checked against the interface networks of the same host
+    (batch_network_contains_ip), an interface is covered if a route goes through it.
+    The invalid netmask check is done on the candidate routes of every host at once as well.
+    :param hosts: The hosts to check
+    :param source: The source network which will be checked against routes
+    :param destination: The destination network which is checked against the routes
+    :param vrf: Only the interfaces and routes of this VRF are checked, None for the global routing table
+    :return: Dictionary of hostname -> (list of missing routes, set of routes with incorrect netmask)
+    """
+    import numpy as np
+    tables = [host.get_route_table(vrf) for host in hosts]
+    # Flat lists with the number of items per host (no tuple per item, the fleet can have millions of them)
+    host_interfaces = [[interface for interface in host.interfaces
+                        if interface.address is not None and interface.vrf == vrf] for host in hosts]
+    interfaces = list(chain.from_iterable(host_interfaces))
+    interface_hosts = np.repeat(np.arange(len(hosts), dtype=np.uint64), [len(items) for items in host_interfaces])
+    route_hosts = np.repeat(np.arange(len(hosts), dtype=np.uint64), [len(table.next_hops) for table in tables])
+
+    # The index of the host is put above the 32 bits of the addresses and the netmasks cover it,
+    # so a next hop is only contained by the interface networks of its own host
+    host_shift = np.uint64(IPV4_MAX_PREFIXLEN)
+    next_hops = np.fromiter(chain.from_iterable(table.next_hops for table in tables), dtype=np.uint64,
+                            count=len(route_hosts))
+    next_hops |= route_hosts << host_shift
+    interface_networks = (interface_hosts << host_shift) | np.fromiter(
+        (interface.network for interface in interfaces), dtype=np.uint64, count=len(interfaces))
+    interface_masks = (np.uint64(~np.uint32(0)) << host_shift) | np.fromiter(
+        (prefixlen_to_mask(interface.prefixlen) for interface in interfaces), dtype=np.uint64,
+        count=len(interfaces))
+    # The hosts are checked in blocks, so the matrices grow with the size of the block instead of the whole fleet
+    covered = np.zeros(len(interfaces), dtype=bool)
+    for first in range(0, len(hosts), SWEEP_BLOCK_HOSTS):
+        block = np.array([first, first + SWEEP_BLOCK_HOSTS], dtype=np.uint64)
+        route_start, route_end = np.searchsorted(route_hosts, block)
+        interface_start, interface_end = np.searchsorted(interface_hosts, block)
+        covered[interface_start:interface_end] = batch_network_contains_ip(
+            next_hops[route_start:route_end], interface_networks[interface_start:interface_end],
+            interface_masks[interface_start:interface_end]
+        ).any(axis=0)
+
+    # Same as get_routes_with_invalid_netmask: the route contains the network address of the source or
+    # destination network, but it does not contain the whole network (the netmask is too long).
+    # Only the routes containing the network addresses are candidates, they are looked up in the route tables.
+    routes = [(index, route) for index, table in enumerate(tables)
+              for route in table.covering(source.network) + table.covering(destination.network)]
+    route_networks = np.fromiter((route.network for _, route in routes), dtype=np.uint32, count=len(routes))
+    route_masks = np.fromiter((prefixlen_to_mask(route.prefixlen) for _, route in routes), dtype=np.uint32,
+                              count=len(routes))
+    in_supernet = batch_network_is_in_supernet(
+        *parse_network_array([source.network, destination.network]), route_networks, route_masks
+    ).any(axis=0)
+    contains = batch_network_contains_network(
+        *parse_network_array([source, destination]), route_networks, route_masks
+    ).any(axis=0)
+    invalid_netmask = in_supernet & ~contains
+
+    results = {host.hostname: ([], set()) for host in hosts}
+    for position in np.flatnonzero(~covered).tolist():
+        hostname = hosts[int(interface_hosts[position])].hostname
+        logger.debug(f"Missing route for {interfaces[position].address} in {hostname}")
+        results[hostname][0].append(interfaces[position].address)
+    for (index, route), is_invalid in zip(routes, invalid_netmask):
+        if is_invalid:
+            logger.debug(f"Invalid netmask for {route.dest} in {hosts[index].hostname}")
+            results[hosts[index].hostname][1].add((route.dest, route.next_hop))
+    return results
+
+
+def get_routes_with_invalid_netmask(host: Host, source: netaddr.IPNetwork, destination: netaddr.IPNetwork,
+                                    vrf: str = None) -> Set[Tuple[str, str]]:
     """
-    Get the IP of an interface if it is contained within the supplied IP Network
+    Get the routes of a host which are towards the source or destination network, but with an incorrect netmask.
+    Only the routes containing the source or destination network address are candidates,
+    these are looked up in the route tables instead of checking every route.
+    :param host: The host to check
+    :param source: The source network
+    :param destination: The destination network
+    :param vrf: The VRF of the routes, None for the global routing table
+    :return: A set of (destination, next_hop) tuples of the routes with incorrect netmask
+    """
+    invalid_netmask = set()
+    table = host.get_route_table(vrf)
+    for route in table.covering(source.network) + table.covering(destination.network):
+        if check_network_is_in_supernet(source.network, route.dest) or \
+                check_network_is_in_supernet(destination.network, route.dest):
+            if not check_network_contains_network(destination, route.dest) and \
+                    not check_network_contains_network(source, route.dest):
+                logger.debug(f"Invalid netmask for {route.dest} in {host.hostname}")
+                invalid_netmask.add((route.dest, route.next_hop))
+    return invalid_netmask
+
+
+def get_interface_ip_within_ip_network(index: InterfaceIndex, host: Host, ip_addresses: List[str]) \
+        -> Union[str, None]:
+    """
+    Get the IP of an interface of a host which is connected to the same subnet as one of the supplied IP addresses
+    :param index: The interface index of the network
     :param host: The with available IP addresses
-    :param ip_addresses: The IP address which should be contained within the interface IP address
-    :return: The IP address of the interface if it is contained within the supplied IP Network, None otherwise
+    :param ip_addresses: The IP addresses (with prefix length) whose subnet should be connected to the host
+    :return: The IP address of the interface if it is connected to one of the subnets, None otherwise
     """
-    for interface in host.interfaces:
-        if 'ipv4' in interface:
-            addr = interface['ipv4'][0]['address']
-            for ip_address in ip_addresses:
-                if check_network_contains_network(addr, ip_address):
-                    return addr
+    for ip_address in ip_addresses:
+        for member, interface in index.find_by_network(ip_address):
+            if member.hostname == host.hostname:
+                return interface.address
     return None
 
 
-def get_ip_address_from_same_subnet(source: Host, destination: Host) -> List[Tuple[Any, Any]]:
+def get_ip_address_from_same_subnet(index: InterfaceIndex, source: Host, destination: Host) -> List[Tuple[str, str]]:
     """
     Get the IP address of the source and destination host which are in the same subnet
+    :param index: The interface index of the network
     :param source: The source host
     :param destination: The destination host
     :return: The IP address of the source and destination host which are in the same subnet
     """
-    common_ips = []
-    for source_interface in source.interfaces:
-        if 'ipv4' in source_interface:
-            source_ip = source_interface['ipv4'][0]['address']
-            for dest_interface in destination.interfaces:
-                if 'ipv4' in dest_interface:
-                    dest_ip = dest_interface['ipv4'][0]['address']
-                    if check_network_contains_network(source_ip, dest_ip):
-                        if not compare_list_tuples(common_ips, (source_ip, dest_ip)):
-                            common_ips.append((source_ip, dest_ip))
-    return common_ips
+    return [(source_interface.address, dest_interface.address)
+            for source_interface, dest_interface in index.common_subnets(source, destination)]
 
 
-def get_route_match_by_dest(host: Host, dest: Union[str, netaddr.IPNetwork]) -> Tuple[str, str]:
+def get_route_match_by_dest(host: Host, dest: Union[str, netaddr.IPNetwork], vrf: str = None) \
+        -> Union[Tuple[str, str], None]:
     """
-    Get a route (destination and next_hop) from a host which matches or includes the destination
+    Get a route (destination and next_hop) from a host which matches or includes the destination.
+    The most specific route is returned (longest prefix match), default routes are not taken into account.
     :param host: The host which should be checked
     :param dest: The destination address
-    :return: Tuple with the destination and next_hop of the route
+    :param vrf: The VRF of the routes, None for the global routing table
+    :return: Tuple with the destination and next_hop of the route, None if there is no matching route
     """
-    for table in host.routes:
-        if 'vrf' not in table:
-            for route in table['address_families']:
-                if check_network_contains_network(dest, route['routes'][0]['dest']):
-                    return route['routes'][0]['dest'], route['routes'][0]['next_hops'][0]['forward_router_address']
+    for route in host.get_route_table(vrf).longest_match(dest):
+        if route.prefixlen:
+            return route.dest, route.next_hop
+    return None
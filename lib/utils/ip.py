@@ -1,7 +1,122 @@
-from typing import Union
+from functools import lru_cache
+from typing import NamedTuple, Union, Iterable, Tuple, TYPE_CHECKING
 
 import netaddr  # type: ignore
 
+from utils import trace
+
+if TYPE_CHECKING:
+    # numpy is only imported by the batch functions, so the scalar helpers do not pay for its import
+    import numpy as np
+
+# Maximum number of parsed addresses/networks kept in the parse cache
+PARSE_CACHE_SIZE = 16384
+
+IPV4_MAX_PREFIXLEN = 32
+
+
+class ParsedNetwork(NamedTuple):
+    """
+    Immutable, pre-parsed form of an IP address or network.
+    Pure IP addresses (Eg.: 192.168.10.1) are parsed as a /32 network.
+    """
+    # The IP address as an integer (Eg.: 192.168.10.1/30 -> 192.168.10.1)
+    ip: int
+    # The network address as an integer (Eg.: 192.168.10.1/30 -> 192.168.10.0)
+    network: int
+    # The netmask as an integer (Eg.: /30 -> 255.255.255.252)
+    mask: int
+    prefixlen: int
+    version: int
+
+    @property
+    def last(self) -> int:
+        """
+        The last (broadcast) address of the network as an integer
+        """
+        width = IPV4_MAX_PREFIXLEN if self.version == 4 else 128
+        return self.network | (((1 << width) - 1) ^ self.mask)
+
+
+def prefixlen_to_mask(prefixlen: int, width: int = IPV4_MAX_PREFIXLEN) -> int:
+    """
+    Convert a prefix length to an integer netmask (Eg.: 24 -> 0xFFFFFF00)
+    :param prefixlen: The prefix length of the network
+    :param width: The width of the address in bits (32 for IPv4)
+    :return: The netmask as an integer
+    """
+    full_mask = (1 << width) - 1
+    return (full_mask << (width - prefixlen)) & full_mask
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_network(value: str) -> ParsedNetwork:
+    """
+    Parse an address/network string with netaddr. The results are cached (LRU) by the string form.
+    :param value: The IP address or network in string format
+    :return: The parsed network
+    """
+    trace.count('netaddr_parses')
+    network = netaddr.IPNetwork(value)
+    width = IPV4_MAX_PREFIXLEN if network.version == 4 else 128
+    return ParsedNetwork(
+        ip=network.value, network=network.first, mask=prefixlen_to_mask(network.prefixlen, width),
+        prefixlen=network.prefixlen, version=network.version
+    )
+
+
+def parse_network(value: Union[str, netaddr.IPNetwork, netaddr.IPAddress]) -> ParsedNetwork:
+    """
+    Get the parsed form of an IP address or network through the shared parse cache
+    :param value: The IP address or network (string or netaddr object)
+    :return: The parsed network
+    """
+    return _parse_network(str(value))
+
+
+def parse_cache_info():
+    """
+    Get the statistics of the shared parse cache
+    :return: Named tuple with hits, misses, maxsize and currsize
+    """
+    return _parse_network.cache_info()
+
+
+def clear_parse_cache() -> None:
+    """
+    Empty the shared parse cache and reset its statistics
+    :return: None
+    """
+    _parse_network.cache_clear()
+
+
+def _network_contains(containing: ParsedNetwork, contained: ParsedNetwork) -> bool:
+    """
+    Check if a parsed network contains another parsed network (or address)
+    :param containing: The network which should contain the other one
+    :param contained: The network which should be contained
+    :return: True if the containing network contains the contained network, False if it does not
+    """
+    return containing.version == contained.version and contained.prefixlen >= containing.prefixlen and \
+        (contained.network & containing.mask) == containing.network
+
+
+# Networks handled as private by check_network_is_in_supernet (RFC 1918, 6598, 5736, 2544, 2365 and 3927)
+PRIVATE_NETWORKS_CIDR = (
+    '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '100.64.0.0/10', '192.0.0.0/24', '198.18.0.0/15',
+    '239.0.0.0/8', '169.254.0.0/16'
+)
+PRIVATE_NETWORKS = tuple(parse_network(network) for network in PRIVATE_NETWORKS_CIDR)
+
+
+def _is_private(network: ParsedNetwork) -> bool:
+    """
+    Check if a parsed network is entirely in one of the private networks
+    :param network: The network to check
+    :return: True if the network is private, False if it is not
+    """
+    return any(_network_contains(private, network) for private in PRIVATE_NETWORKS)
+
 
 def compare_cidr_and_ip_address(cidr_ip: str, ip_address: str) -> bool:
     """
@@ -10,7 +125,9 @@ def compare_cidr_and_ip_address(cidr_ip: str, ip_address: str) -> bool:
     :param ip_address: The IP address in string format
     :return: True if the IP addresses match, False if they are not the same.
     """
-    return netaddr.IPNetwork(cidr_ip).ip == netaddr.IPAddress(ip_address)
+    cidr = parse_network(cidr_ip)
+    address = parse_network(ip_address)
+    return cidr.version == address.version and cidr.ip == address.ip
 
 
 def check_network_contains_ip(ip_address: Union[str, netaddr.IPAddress], network: Union[str, netaddr.IPNetwork]) \
@@ -21,7 +138,9 @@ def check_network_contains_ip(ip_address: Union[str, netaddr.IPAddress], network
     :param network: The network where the IP address should be in
     :return: True if the IP address belongs to the network, False if it does not
     """
-    return netaddr.IPAddress(ip_address) in netaddr.IPNetwork(network)
+    parsed_network = parse_network(network)
+    address = parse_network(ip_address)
+    return address.version == parsed_network.version and (address.ip & parsed_network.mask) == parsed_network.network
 
 
 def check_network_contains_network(contained_network: Union[str, netaddr.IPNetwork],
@@ -33,9 +152,10 @@ def check_network_contains_network(contained_network: Union[str, netaddr.IPNetwo
     :param containing_network: The network which should contain the contained_network
     :return: True if the containing_network contains the contained_network, False if it does not
     """
-    if netaddr.IPNetwork(containing_network) == netaddr.IPNetwork('0.0.0.0/0'):
+    containing = parse_network(containing_network)
+    if containing.prefixlen == 0:
         return False
-    return netaddr.IPNetwork(contained_network) in netaddr.IPNetwork(containing_network)
+    return _network_contains(containing, parse_network(contained_network))
 
 
 def check_network_is_in_supernet(contained_network: Union[str, netaddr.IPNetwork],
@@ -48,14 +168,98 @@ def check_network_is_in_supernet(contained_network: Union[str, netaddr.IPNetwork
     :param containing_network: The supernet which should contain the contained_network
     :return: True if the containing_network contains the contained_network, False if it does not
     """
-    net = netaddr.IPNetwork(contained_network)
-    private = net.is_private()
-    supernets = net.supernet()
-    network_to_check = netaddr.IPNetwork(containing_network)
-    for network in supernets:
-        # Only check if the provided network is private and the checked network is also private
-        # If the provided network is not private, always check
-        if (private and network.is_private()) or not private:
-            if network_to_check == network:
-                return True
-    return False
+    net = parse_network(contained_network)
+    network_to_check = parse_network(containing_network)
+    # Supernets are strictly shorter networks containing the network itself.
+    if network_to_check.prefixlen >= net.prefixlen or not _network_contains(network_to_check, net):
+        return False
+    # Only check if the provided network is private and the checked network is also private
+    # If the provided network is not private, always check
+    return not _is_private(net) or _is_private(network_to_check)
+
+
+def parse_address_array(ip_addresses: Iterable[Union[str, netaddr.IPAddress]]) -> 'np.ndarray':
+    """
+    Parse IPv4 addresses into a vector usable by the batch checks
+    :param ip_addresses: The IP addresses to parse
+    :return: uint32 vector of the IP addresses
+    """
+    import numpy as np
+    return np.fromiter((parse_network(ip_address).ip for ip_address in ip_addresses), dtype=np.uint32)
+
+
+def parse_network_array(networks: Iterable[Union[str, netaddr.IPNetwork]]) -> Tuple['np.ndarray', 'np.ndarray']:
+    """
+    Parse IPv4 networks into network address and netmask vectors usable by the batch checks
+    :param networks: The networks to parse
+    :return: Tuple of uint32 vectors (network addresses, netmasks)
+    """
+    import numpy as np
+    parsed = [parse_network(network) for network in networks]
+    return np.fromiter((network.network for network in parsed), dtype=np.uint32, count=len(parsed)), \
+        np.fromiter((network.mask for network in parsed), dtype=np.uint32, count=len(parsed))
+
+
+def _batch_network_contains(contained_networks: 'np.ndarray', contained_masks: 'np.ndarray',
+                            containing_networks: 'np.ndarray', containing_masks: 'np.ndarray') -> 'np.ndarray':
+    """
+    Check every contained network against every containing network
+    :return: Boolean matrix, rows are the contained networks, columns are the containing networks
+    """
+    contained_networks = contained_networks[:, None]
+    contained_masks = contained_masks[:, None]
+    # The contained network has to be at least as long as the containing one and in the same address range
+    return ((contained_masks & containing_masks) == containing_masks) & \
+        ((contained_networks & containing_masks) == containing_networks)
+
+
+def batch_network_contains_ip(ip_addresses: 'np.ndarray', networks: 'np.ndarray', masks: 'np.ndarray') -> 'np.ndarray':
+    """
+    Batch variant of check_network_contains_ip. Check every IP address against every network in a single call.
+    :param ip_addresses: uint32 vector of IP addresses (see parse_address_array)
+    :param networks: uint32 vector of network addresses (see parse_network_array)
+    :param masks: uint32 vector of the netmasks of the networks
+    :return: Boolean matrix, [i, j] is True if the i-th IP address belongs to the j-th network
+    """
+    return (ip_addresses[:, None] & masks) == networks
+
+
+def batch_network_contains_network(contained_networks: 'np.ndarray', contained_masks: 'np.ndarray',
+                                   containing_networks: 'np.ndarray', containing_masks: 'np.ndarray') -> 'np.ndarray':
+    """
+    Batch variant of check_network_contains_network. Default routes never contain anything.
+    :param contained_networks: uint32 vector of the network addresses which should be contained
+    :param contained_masks: uint32 vector of the netmasks of the contained networks
+    :param containing_networks: uint32 vector of the network addresses which should contain the others
+    :param containing_masks: uint32 vector of the netmasks of the containing networks
+    :return: Boolean matrix, [i, j] is True if the j-th containing network contains the i-th contained network
+    """
+    return _batch_network_contains(contained_networks, contained_masks, containing_networks, containing_masks) & \
+        (containing_masks != 0)
+
+
+def _batch_is_private(networks: 'np.ndarray', masks: 'np.ndarray') -> 'np.ndarray':
+    """
+    Check which networks are entirely in one of the private networks
+    :return: Boolean vector
+    """
+    private_networks, private_masks = parse_network_array(PRIVATE_NETWORKS_CIDR)
+    return _batch_network_contains(networks, masks, private_networks, private_masks).any(axis=1)
+
+
+def batch_network_is_in_supernet(contained_networks: 'np.ndarray', contained_masks: 'np.ndarray',
+                                 containing_networks: 'np.ndarray', containing_masks: 'np.ndarray') -> 'np.ndarray':
+    """
+    Batch variant of check_network_is_in_supernet.
+    :param contained_networks: uint32 vector of the network addresses which should be contained in the supernets
+    :param contained_masks: uint32 vector of the netmasks of the contained networks
+    :param containing_networks: uint32 vector of the supernet addresses
+    :param containing_masks: uint32 vector of the netmasks of the supernets
+    :return: Boolean matrix, [i, j] is True if the j-th network is a (private) supernet of the i-th network
+    """
+    supernet = _batch_network_contains(contained_networks, contained_masks, containing_networks, containing_masks) & \
+        (contained_masks[:, None] != containing_masks)
+    # Private networks only have private supernets
+    contained_private = _batch_is_private(contained_networks, contained_masks)
+    containing_private = _batch_is_private(containing_networks, containing_masks)
+    return supernet & (~contained_private[:, None] | containing_private)
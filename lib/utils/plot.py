@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Tuple
+
+import networkx as nx  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Number of layouts kept in the layout cache
+LAYOUT_CACHE_SIZE = 32
+# Formats rendered by matplotlib (everything else is written as text without rasterization)
+FIGURE_FORMATS = ('png', 'jpg', 'jpeg', 'pdf', 'svg')
+TEXT_FORMATS = ('dot', 'gv', 'json')
+# Format of a filename without extension
+DEFAULT_FORMAT = 'png'
+
+NODE_COLORS = {
+    'PC-S': 'tab:green',
+    'PC-D': 'tab:red',
+}
+DEFAULT_NODE_COLOR = 'tab:blue'
+NODE_SIZES = {
+    'PC-S': 1000,
+    'PC-D': 1000,
+}
+DEFAULT_NODE_SIZE = 800
+
+_layout_cache: 'OrderedDict[FrozenSet[str], Dict[str, Tuple[float, float]]]' = OrderedDict()
+# The cache is shared by every analyzer of the process, which can plot from different threads
+_layout_cache_lock = threading.Lock()
+
+
+def get_layout(graph: nx.Graph) -> Dict[str, Tuple[float, float]]:
+    """
+    Get the circular layout of a graph. Layouts are cached (LRU) by the set of nodes,
+    so the nodes stay in place between plots of the same network and the layout is not recomputed.
+    :param graph: The graph to lay out
+    :return: Dictionary of node -> (x, y) position
+    """
+    key = frozenset(graph.nodes())
+    with _layout_cache_lock:
+        if key in _layout_cache:
+            _layout_cache.move_to_end(key)
+            return _layout_cache[key]
+    # Sort the nodes, so the layout does not depend on the order the nodes were added in
+    ordered = nx.DiGraph()
+    ordered.add_nodes_from(sorted(graph.nodes()))
+    layout = {node: (float(x), float(y)) for node, (x, y) in nx.circular_layout(ordered, scale=1).items()}
+    with _layout_cache_lock:
+        _layout_cache[key] = layout
+        if len(_layout_cache) > LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    return layout
+
+
+def clear_layout_cache() -> None:
+    """
+    Empty the layout cache
+    :return: None
+    """
+    with _layout_cache_lock:
+        _layout_cache.clear()
+
+
+def get_graph_format(filename: str) -> str:
+    """
+    Get the format of a graph file from its extension
+    :param filename: The output file
+    :return: The lowercase extension, DEFAULT_FORMAT if the filename has no extension
+    """
+    return os.path.splitext(filename)[1].lstrip('.').lower() or DEFAULT_FORMAT
+
+
+def render_graph(graph: nx.DiGraph, filename: str, title: str, subtitle: str = '') -> None:
+    """
+    Save a graph to a file. The format is selected by the file extension:
+    PNG/JPG/PDF/SVG are drawn with matplotlib, DOT and JSON are written as text (no matplotlib needed).
+    A filename without extension is saved as PNG (matplotlib appends the extension).
+    Edge attributes color, weight, style and label are used in every format.
+    :param graph: The graph to save
+    :param filename: The output file
+    :param title: The title of the plot
+    :param subtitle: The subtitle of the plot
+    :return: None
+    """
+    extension = get_graph_format(filename)
+    if extension in ('dot', 'gv'):
+        write_dot(graph, filename, title)
+    elif extension == 'json':
+        write_json(graph, filename, title)
+    elif extension in FIGURE_FORMATS:
+        draw_figure(graph, filename, title, subtitle)
+    else:
+        raise ValueError(f"Unknown graph format {extension}, use one of {', '.join(FIGURE_FORMATS + TEXT_FORMATS)}")
+
+
+def draw_figure(graph: nx.DiGraph, filename: str, title: str, subtitle: str = '') -> None:
+    """
+    Draw a graph on a new Agg (non-interactive) figure and save it.
+    The figure is not registered in pyplot, so it is freed after it is saved.
+    :param graph: The graph to draw
+    :param filename: The output file (the format is selected by matplotlib from the extension)
+    :param title: The title of the plot
+    :param subtitle: The subtitle of the plot
+    :return: None
+    """
+    # matplotlib is only needed (and imported) when a figure is saved
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # type: ignore
+    from matplotlib.figure import Figure  # type: ignore
+
+    figure = Figure(figsize=(6, 6))
+    FigureCanvasAgg(figure)
+    try:
+        axes = figure.add_subplot()
+        axes.set_axis_off()
+        figure.suptitle(title)
+        axes.set_title(subtitle)
+
+        pos = get_layout(graph)
+        nodes = list(graph.nodes())
+        nx.draw_networkx_nodes(
+            graph, pos=pos, ax=axes, nodelist=nodes,
+            node_color=[NODE_COLORS.get(node, DEFAULT_NODE_COLOR) for node in nodes],
+            node_size=[NODE_SIZES.get(node, DEFAULT_NODE_SIZE) for node in nodes], alpha=1
+        )
+        edges = list(graph.edges(data=True))
+        nx.draw_networkx_edges(
+            graph, pos=pos, ax=axes, edgelist=[(source, destination) for source, destination, _ in edges],
+            edge_color=[data.get('color', 'black') for _, _, data in edges],
+            width=[data.get('weight', 1) for _, _, data in edges],
+            style=[data.get('style', '-') for _, _, data in edges],
+            arrowsize=20, connectionstyle='arc3, rad = 0.1'
+        )
+        nx.draw_networkx_labels(graph, pos=pos, ax=axes, font_size=10, font_color='whitesmoke')
+        figure.savefig(filename)
+    finally:
+        figure.clear()
+
+
+def write_dot(graph: nx.DiGraph, filename: str, title: str) -> None:
+    """
+    Write a graph in Graphviz DOT format
+    :param graph: The graph to write
+    :param filename: The output file
+    :param title: The title (label) of the graph
+    :return: None
+    """
+    lines = ['digraph network {', f"  label={json.dumps(title)};"]
+    for node in graph.nodes():
+        color = NODE_COLORS.get(node, DEFAULT_NODE_COLOR).replace('tab:', '')
+        lines.append(f"  {json.dumps(node)} [color={color}];")
+    for source, destination, data in graph.edges(data=True):
+        attributes = [f"color={data.get('color', 'black')}", f"penwidth={data.get('weight', 1)}"]
+        if data.get('style', '-') != '-':
+            attributes.append('style=dashed')
+        if 'label' in data:
+            attributes.append(f"label={json.dumps(data['label'])}")
+        lines.append(f"  {json.dumps(source)} -> {json.dumps(destination)} [{', '.join(attributes)}];")
+    lines.append('}')
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def write_json(graph: nx.DiGraph, filename: str, title: str) -> None:
+    """
+    Write a graph in JSON (nodes with their layout position, edges with their attributes)
+    :param graph: The graph to write
+    :param filename: The output file
+    :param title: The title of the graph
+    :return: None
+    """
+    pos = get_layout(graph)
+    data = {
+        'title': title,
+        'nodes': [{'id': node, 'x': pos[node][0], 'y': pos[node][1]} for node in graph.nodes()],
+        'edges': [{'source': source, 'target': destination, **attributes}
+                  for source, destination, attributes in graph.edges(data=True)],
+    }
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=2)
@@ -0,0 +1,218 @@
+"""
+Timing spans and counters of the analysis stages.
+Tracing is off by default: span() returns a shared no-op context manager and count() returns immediately,
+so the instrumented code only pays for a function call and a None check.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Union
+
+logger = logging.getLogger(__name__)
+
+_NULL_SPAN = nullcontext()
+
+# The active tracer, None if tracing is off
+_tracer: Union['Tracer', None] = None
+
+
+class Tracer:
+    def __init__(self):
+        """
+        Collect the finished spans and the counters of a traced run.
+        Spans can be recorded from multiple threads (Eg.: concurrent Ansible runs, the server).
+        """
+        self.started = time.perf_counter()
+        self.pid = os.getpid()
+        # Finished spans in Chrome trace event format (complete events, microseconds from the start)
+        self.events: List[dict] = []
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, attributes: dict) -> None:
+        event = {
+            'name': name, 'ph': 'X', 'pid': self.pid, 'tid': threading.get_ident(),
+            'ts': round((start - self.started) * 1e6, 3), 'dur': round((end - start) * 1e6, 3),
+        }
+        if attributes:
+            event['args'] = attributes
+        with self._lock:
+            self.events.append(event)
+
+    def add_count(self, name: str, value: float) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def stages(self) -> Dict[str, List[float]]:
+        """
+        Get the total time and the number of the spans by name
+        :return: Dictionary of span name -> [seconds, count]
+        """
+        stages = {}
+        with self._lock:
+            for event in self.events:
+                stage = stages.setdefault(event['name'], [0.0, 0])
+                stage[0] += event['dur'] / 1e6
+                stage[1] += 1
+        return stages
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'attributes', 'start')
+
+    def __init__(self, tracer: Tracer, name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.start = None
+
+    def __enter__(self) -> '_Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.tracer.add_span(self.name, self.start, time.perf_counter(), self.attributes)
+        return False
+
+
+def enable() -> Tracer:
+    """
+    Start tracing (a new tracer replaces the active one)
+    :return: The active tracer
+    """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable() -> Union[Tracer, None]:
+    """
+    Stop tracing
+    :return: The tracer with the collected spans and counters, None if tracing was off
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **attributes):
+    """
+    Measure the time of a code block: with span('stage'): ...
+    :param name: Name of the stage
+    :param attributes: Extra information saved with the span (must be JSON serializable)
+    :return: Context manager
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, attributes)
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Increase a counter (Eg.: the number of parsed addresses)
+    :param name: Name of the counter
+    :param value: The increment
+    :return: None
+    """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.add_count(name, value)
+
+
+def traced(name: str = None) -> Callable:
+    """
+    Decorator measuring every call of a function (or coroutine function) as a span
+    :param name: Name of the span. If None, the qualified name of the function is used
+    :return: The decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        span_name = name or function.__qualname__
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                tracer = _tracer
+                if tracer is None:
+                    return await function(*args, **kwargs)
+                with _Span(tracer, span_name, {}):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            with _Span(tracer, span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_trace(tracer: Tracer, filename: str) -> None:
+    """
+    Save the spans and counters. A .jsonl file gets one JSON object per line,
+    any other file gets the Chrome trace format (chrome://tracing, Perfetto).
+    :param tracer: The tracer
+    :param filename: The output file
+    :return: None
+    """
+    end = round((time.perf_counter() - tracer.started) * 1e6, 3)
+    with open(filename, 'w', encoding='utf-8') as file:
+        if filename.endswith('.jsonl'):
+            for event in tracer.events:
+                file.write(json.dumps({'type': 'span', **event}) + '\n')
+            for counter, value in sorted(tracer.counters.items()):
+                file.write(json.dumps({'type': 'counter', 'name': counter, 'value': value}) + '\n')
+        else:
+            counters = [{'name': counter, 'ph': 'C', 'pid': tracer.pid, 'tid': 0, 'ts': end, 'args': {counter: value}}
+                        for counter, value in sorted(tracer.counters.items())]
+            json.dump({'traceEvents': tracer.events + counters, 'displayTimeUnit': 'ms'}, file)
+
+
+def prometheus_summary(tracer: Tracer) -> str:
+    """
+    Get the total time of the stages and the counters in Prometheus text exposition format
+    :param tracer: The tracer
+    :return: The metrics
+    """
+    lines = [
+        '# HELP network_analyzer_stage_seconds Time spent in the stages of the analysis',
+        '# TYPE network_analyzer_stage_seconds summary',
+    ]
+    for stage, (seconds, calls) in sorted(tracer.stages().items()):
+        lines.append(f'network_analyzer_stage_seconds_sum{{stage="{stage}"}} {seconds:.6f}')
+        lines.append(f'network_analyzer_stage_seconds_count{{stage="{stage}"}} {calls}')
+    lines.extend([
+        '# HELP network_analyzer_events_total Events counted during the analysis',
+        '# TYPE network_analyzer_events_total counter',
+    ])
+    for counter, value in sorted(tracer.counters.items()):
+        lines.append(f'network_analyzer_events_total{{event="{counter}"}} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def save(tracer: Tracer, filename: str) -> str:
+    """
+    Save the trace and the Prometheus summary next to it (same name with .prom extension)
+    :param tracer: The tracer
+    :param filename: The trace file
+    :return: The filename of the summary
+    """
+    write_trace(tracer, filename)
+    summary_filename = os.path.splitext(filename)[0] + '.prom'
+    with open(summary_filename, 'w', encoding='utf-8') as file:
+        file.write(prometheus_summary(tracer))
+    logger.info(f"Trace saved to {filename}, summary saved to {summary_filename}")
+    return summary_filename